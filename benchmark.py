@@ -0,0 +1,212 @@
+'''
+Throughput benchmarks of the data loading logic. Run like train.py, e.g.
+python benchmark.py --name bench --percent 0.1
+For the wall-clock time to reach a validation loss with either sampler, run train.py with
+--target_val_mse and --sampler uniform / activation instead.
+'''
+
+import copy
+import multiprocessing as mp
+import os
+import numpy as np
+import random
+import time
+import torch
+
+import musclesinaction.configs.args as args
+import musclesinaction.dataloader.data as data
+import musclesinaction.dataloader.store as store
+import musclesinaction.utils.augs as augs
+import musclesinaction.vis.logvisgen as logvisgen
+
+
+def _samples_per_sec(dataset, indices):
+    start_time = time.time()
+    for index in indices:
+        dataset[index]
+    return len(indices) / (time.time() - start_time)
+
+
+def bench_gather(args, logger, num_samples=2000):
+    '''
+    Compares the per-frame loop of visualize_video() against gather_window(), in samples / sec
+    of a single process (i.e. per data loader worker).
+    '''
+    dataset = data.MyMuscleDataset(args.data_path_train, logger, 'train', percent=args.percent,
+                                   step=args.step, cache_root=args.cache_path)
+    indices = np.random.randint(len(dataset), size=num_samples)
+
+    # Touch every sample once so that both paths see a warm page cache.
+    dataset.vectorized = True
+    _samples_per_sec(dataset, indices)
+
+    for vectorized in [False, True]:
+        dataset.vectorized = vectorized
+        rate = _samples_per_sec(dataset, indices)
+        logger.info(f'{"gather_window" if vectorized else "visualize_video"}: '
+                    f'{rate:.1f} samples/s per worker')
+
+
+
+def bench_batch(args, logger, batch_sizes=(8, 64, 256, 512), num_samples=4096):
+    '''
+    Compares __getitems__() against per-sample gather_window() calls, both through
+    _collate_batch(), in samples / sec of a single process, for the training fields and for all
+    fields.
+    '''
+    for fields in [data.TRAIN_FIELDS, data.SAMPLE_FIELDS]:
+        dataset = data.MyMuscleDataset(args.data_path_train, logger, 'train',
+                                       percent=args.percent, step=args.step,
+                                       cache_root=args.cache_path, fields=fields)
+        indices = np.random.randint(len(dataset), size=num_samples)
+        dataset.__getitems__(indices[:max(batch_sizes)])  # Warm page cache.
+
+        for bs in batch_sizes:
+            batches = indices[:len(indices) // bs * bs].reshape(-1, bs)
+            for batched in [False, True]:
+                start_time = time.time()
+                for batch in batches:
+                    if batched:
+                        data._collate_batch(dataset.__getitems__(batch))
+                    else:
+                        data._collate_batch([dataset.gather_window(index) for index in batch])
+                rate = batches.size / (time.time() - start_time)
+                logger.info(f'{"__getitems__" if batched else "gather_window"} '
+                            f'({len(fields)} fields, bs {bs}): {rate:.1f} samples/s per worker')
+
+
+def _process_rss(pid):
+    '''
+    :return (dict): Memory of one process in MiB: resident, proportional (shared pages divided by
+        the number of processes mapping them), privately dirtied (e.g. copy-on-write copies of the
+        parent's pages) and proportional shared memory. Plain RSS also counts the pages that forked
+        workers still share with the parent, so it cannot tell the two modes apart.
+    '''
+    rss = dict()
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            (name, _, value) = line.partition(':')
+            if name in ['Rss', 'Pss', 'Private_Dirty', 'Pss_Shmem']:
+                rss[name] = int(value.split()[0]) / 1024.0
+    return rss
+
+
+def bench_worker_rss(args, logger, num_batches=50, start_methods=('fork', 'spawn')):
+    '''
+    Reports the memory of this process and of the train loader workers of
+    create_train_val_data_loaders() (i.e. persistent if configured) with and without share_memory,
+    with forked workers (which inherit the parent's pages copy-on-write) and spawned ones (which
+    receive a pickled copy of the dataset). Pss is the number to compare; shared memory pages that
+    only one process touched count as Private_Dirty.
+    '''
+    default_method = mp.get_start_method()
+    for start_method in start_methods:
+        for share_memory in [False, True]:
+            # Both modes should unpickle the videos themselves.
+            store.clear_pose_registry()
+            store.release_heap()
+            bench_args = copy.copy(args)
+            bench_args.share_memory = share_memory
+            # The loaders use the default start method.
+            mp.set_start_method(start_method, force=True)
+            loaders = data.create_train_val_data_loaders(
+                bench_args, logger, fields=data.train_fields(bench_args))
+            train_loader = loaders[0]
+            # Two epochs, such that persistent workers are measured after being reused.
+            for _ in range(2):
+                for (_, batch) in zip(range(min(num_batches, len(train_loader))), train_loader):
+                    pass
+
+            # DataLoader workers are multiprocessing children of this process.
+            label = f'{start_method} share_memory={share_memory}'
+            processes = [('parent', os.getpid())] + \
+                [(f'worker {i}', child.pid) for (i, child) in enumerate(mp.active_children())]
+            total = dict()
+            for (name, pid) in processes:
+                rss = _process_rss(pid)
+                total = {k: total.get(k, 0.0) + v for (k, v) in rss.items()}
+                logger.info(f'{label} {name}: ' +
+                            '  '.join(f'{k}: {v:.1f} MiB' for (k, v) in rss.items()))
+            logger.info(f'{label} total: ' +
+                        '  '.join(f'{k}: {v:.1f} MiB' for (k, v) in total.items()))
+            del batch, train_loader, loaders
+            store.release_heap()
+    mp.set_start_method(default_method, force=True)
+
+
+def bench_sampler(args, logger, num_batches=200):
+    '''
+    Reports how much more often the activation sampler draws high-activation windows than uniform
+    sampling, and at which effective sample size.
+    '''
+    dataset = data.MyMuscleDataset(args.data_path_train, logger, 'train', percent=args.percent,
+                                   step=args.step, cache_root=args.cache_path,
+                                   fields=data.TRAIN_FIELDS)
+    muscle = None if args.sample_muscle == 'all' else int(args.sample_muscle)
+    activation = dataset.window_activation(muscle)
+    high = activation >= np.quantile(activation, 0.9)
+    for alpha in [0.0, float(args.sample_alpha)]:
+        weights = data.activation_weights(activation, alpha, float(args.sample_max_ratio))
+        sampler = data.ActivationSampler(dataset, weights, args.seed)
+        drawn = sampler.order().numpy()[:num_batches * args.bs]
+        ess = data.effective_sample_size(weights)
+        logger.info(f'alpha {alpha}: mean activation {activation[drawn].mean():.3f}, '
+                    f'{high[drawn].mean():.1%} of windows in the top 10%, '
+                    f'effective sample size {ess / len(weights):.1%}')
+
+
+def bench_augs(args, logger, num_batches=10, height=256, width=144):
+    '''
+    Compares the per-image transforms (get_train_transform() on every frame), the per-clip
+    transforms (get_clip_train_transform()) and BatchClipAugment on synthetic uint8 clips, in
+    clips / sec on the CPU and, if available, the GPU.
+    '''
+    size = int(args.clip_size)
+    (batch_size, num_frames) = (int(args.bs), int(args.step))
+    clips = torch.randint(0, 256, (batch_size, num_frames, height, width, 3), dtype=torch.uint8)
+
+    def _time(fn, device='cpu'):
+        start_time = time.time()
+        for _ in range(num_batches):
+            fn()
+        if device == 'cuda':
+            torch.cuda.synchronize()
+        return num_batches * batch_size / (time.time() - start_time)
+
+    image_transform = augs.get_train_transform(size)
+    frames = clips.numpy()
+    rate = _time(lambda: torch.stack([torch.stack([image_transform(frame) for frame in clip])
+                                      for clip in frames]))
+    logger.info(f'per image: {rate:.1f} clips / sec')
+
+    clip_transform = augs.get_clip_train_transform(size)
+    rate = _time(lambda: torch.stack([clip_transform(clip) for clip in clips]))
+    logger.info(f'per clip: {rate:.1f} clips / sec')
+
+    batch_transform = augs.BatchClipAugment(size)
+    devices = ['cpu', 'cuda'] if torch.cuda.is_available() else ['cpu']
+    for device in devices:
+        device_clips = clips.to(device)
+        rate = _time(lambda: batch_transform(augs.clips_to_tensor(device_clips)), device)
+        logger.info(f'batched ({device}): {rate:.1f} clips / sec')
+
+
+def main(args, logger):
+
+    np.random.seed(args.seed)
+    random.seed(args.seed)
+
+    bench_gather(args, logger)
+    bench_batch(args, logger)
+    bench_worker_rss(args, logger)
+    bench_sampler(args, logger)
+    bench_augs(args, logger)
+
+
+if __name__ == '__main__':
+
+    args = args.train_args()
+
+    logger = logvisgen.Logger(args.log_path, 'benchmark', args.name)
+
+    main(args, logger)
@@ -19,6 +19,15 @@ def train_args():
     args = parser.parse_args()
     args.bs = int(args.bs)
     args.learn_rate = float(args.learn_rate)
+    args.lazy_load = _str2bool(args.lazy_load)
+    args.vectorized = _str2bool(args.vectorized)
+    args.share_memory = _str2bool(args.share_memory)
+    args.precomputed = _str2bool(args.precomputed)
+    args.streaming = _str2bool(args.streaming)
+    args.skip_invalid = _str2bool(args.skip_invalid)
+    args.persistent_workers = _str2bool(args.persistent_workers)
+    args.reweight_loss = _str2bool(args.reweight_loss)
+    args.batch_augment = _str2bool(args.batch_augment)
     #movie = args.data_path_train
     # movie = movie.split("/")[-1].split(".txt")[0].split("_")[2]    
     movie = 'all'
@@ -5,24 +5,37 @@ Data loading and processing logic.
 import numpy as np
 import random
 import musclesinaction.utils.augs as augs
+import musclesinaction.dataloader.framestore as framestore
+import musclesinaction.dataloader.store as store
+import musclesinaction.dataloader.windows as windows
 import utils
 import pdb
 import torch
 import os
+import copy
 import pathlib
 import cv2
 import matplotlib.pyplot as plt
 import joblib
 from matplotlib import animation
-import time
+from benedict import benedict
 
-def _read_image_robust(img_path, no_fail=False):
+def _read_image_robust(img_path, no_fail=False, frame_reader=None):
     '''
     Loads and returns an image that meets conditions along with a success flag, in order to avoid
     crashing.
+    :param frame_reader (framesource.FrameReader): If set, read img_path through it, e.g. from the
+        source video instead of the extracted PNG.
     '''
     try:
-        image = plt.imread(img_path).copy()
+        if frame_reader is not None:
+            image = frame_reader.read(img_path)
+            if image is None:
+                raise IOError(f'Could not read {img_path}')
+            # Same layout as plt.imread() of a PNG: RGB floats in [0, 1].
+            image = np.ascontiguousarray(image[..., ::-1], dtype=np.float32) / 255.0
+        else:
+            image = plt.imread(img_path).copy()
         success = True
         if (image.ndim != 3 or image.shape[2] != 3
                 or np.any(np.array(image.strides) < 0)):
@@ -43,6 +56,47 @@ def _read_image_robust(img_path, no_fail=False):
     return image, success
 
 
+# Registry of named video sets, see configs/videosets.yaml.
+VIDEO_SETS_PATH = 'musclesinaction/configs/videosets.yaml'
+
+# Keys that samples can carry, and the array store field that each one is gathered from.
+SAMPLE_FIELDS = ['bined_left_quad', 'bined_right_quad', 'left_quad', 'emg_values', 'orig_cam',
+                 'verts', 'right_quad', '2dskeleton', 'cond', '3dskeleton', 'bboxes', 'predcam',
+                 'frame_paths', 'bins', 'video_id', 'frame_idx', 'sample_weight']
+SAMPLE_TO_STORE_FIELD = {'orig_cam': 'orig_cam', 'verts': 'verts',
+                         '2dskeleton': 'joints2d_img_coord', '3dskeleton': 'joints3d',
+                         'bboxes': 'bboxes', 'predcam': 'pred_cam', 'twodkpts': 'twodkpts_norm'}
+# Keys that are only available with precomputed=True: normalized 2D keypoints (T, 25, 2) and
+# digitized EMG values (channels, T).
+PRECOMPUTED_SAMPLE_FIELDS = ['twodkpts', 'emg_bins']
+# Keys that are only available with a frame store: RGB clips, (T, H, W, 3) uint8 or the output of
+# clip_transform.
+FRAME_SAMPLE_FIELDS = ['rgb']
+# Everything that MyTrainPipeline.forward() needs.
+TRAIN_FIELDS = ['3dskeleton', 'bboxes', 'predcam', 'emg_values', 'cond', 'video_id', 'frame_idx']
+PRECOMPUTED_TRAIN_FIELDS = ['twodkpts', 'emg_values', 'cond', 'video_id', 'frame_idx']
+
+
+def train_fields(args):
+    fields = PRECOMPUTED_TRAIN_FIELDS if args.precomputed else TRAIN_FIELDS
+    if args.reweight_loss:
+        fields = fields + ['sample_weight']
+    if args.frame_store:
+        # Augmented per clip by the dataset, or per batch in train.py with args.batch_augment.
+        fields = fields + FRAME_SAMPLE_FIELDS
+    return fields
+
+
+def load_video_set(name, path=VIDEO_SETS_PATH):
+    '''
+    :param name (str): Video set, for example all / squat / alpha.
+    :return (dict): videos, stride, num_emg, emg_channels, pose_source and len_offset of the set.
+    '''
+    video_sets = benedict.from_yaml(path)
+    assert name in video_sets, f'Unknown video set {name}, expected one of {list(video_sets.keys())}'
+    return video_sets[name]
+
+
 def _seed_worker(worker_id):
     '''
     Ensures that every data loader worker has a separate seed with respect to NumPy and Python
@@ -54,8 +108,115 @@ def _seed_worker(worker_id):
     random.seed(worker_seed)
 
 
-def create_train_val_data_loaders(args, logger):
+def _collate_batch(batch):
+    '''
+    Batches built by MyMuscleDataset.__getitems__() only need their arrays turned into tensors;
+    lists of individual samples go through the default collate.
+    '''
+    if isinstance(batch, dict):
+        frame_paths = batch.pop('frame_paths', None)
+        batch = torch.utils.data.default_convert(batch)
+        if frame_paths is not None:
+            batch['frame_paths'] = frame_paths
+        return batch
+    return torch.utils.data.default_collate(batch)
+
+
+class ResumableSampler(torch.utils.data.Sampler):
+    '''
+    Random sampler whose order depends only on the seed and the epoch, and which can start in the
+    middle of an epoch, such that training resumes from the exact batch of a checkpoint.
+    '''
+
+    def __init__(self, data_source, seed=0):
+        self.data_source = data_source
+        self.seed = int(seed)
+        self.epoch = 0
+        self.position = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = int(epoch)
+
+    def set_position(self, position):
+        '''
+        :param position (int): Number of samples of the current epoch to skip on the next pass.
+        '''
+        self.position = int(position)
+
+    def order(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed * 1000003 + self.epoch)
+        return torch.randperm(len(self.data_source), generator=generator)
+
+    def __iter__(self):
+        (order, position) = (self.order(), self.position)
+        # Later epochs (and re-iterations) start from the beginning again.
+        self.position = 0
+        return iter(order[position:].tolist())
+
+    def __len__(self):
+        return len(self.data_source)
+
+    def state_dict(self, num_consumed):
+        '''
+        :param num_consumed (int): Samples of this epoch that training has actually used so far.
+            This differs from what the sampler handed out, since workers and prefetching run ahead.
+        '''
+        return {'seed': self.seed, 'epoch': self.epoch, 'position': int(num_consumed),
+                'num_samples': len(self.data_source)}
+
+    def load_state_dict(self, state):
+        assert state['num_samples'] == len(self.data_source), \
+            'Dataset size changed since the checkpoint, cannot resume mid-epoch'
+        self.seed = state['seed']
+        self.epoch = state['epoch']
+        self.position = state['position']
+
+
+class ActivationSampler(ResumableSampler):
     '''
+    Importance sampler that draws windows (with replacement) in proportion to fixed weights, e.g.
+    activation_weights(), and is resumable just like ResumableSampler.
+    '''
+
+    def __init__(self, data_source, weights, seed=0):
+        super().__init__(data_source, seed)
+        self.weights = torch.as_tensor(np.asarray(weights), dtype=torch.float64)
+        assert len(self.weights) == len(data_source)
+
+    def order(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed * 1000003 + self.epoch)
+        return torch.multinomial(self.weights, len(self.weights), replacement=True,
+                                 generator=generator)
+
+
+def activation_weights(activation, alpha=1.0, max_ratio=10.0):
+    '''
+    :param activation (N,) array: Mean EMG value of every window, see window_activation().
+    :param alpha (float): Sampling probability grows with activation ** alpha; 0 = uniform.
+    :param max_ratio (float): Cap on weight / mean weight, which bounds the loss weights.
+    :return (N,) array: Sampling weights with mean 1.
+    '''
+    weights = np.power(np.maximum(np.asarray(activation, dtype=np.float64), 0.0) + 1e-3, alpha)
+    weights /= weights.mean()
+    weights = np.minimum(weights, max_ratio)
+    return weights / weights.mean()
+
+
+def effective_sample_size(weights):
+    '''
+    :return (float): Kish effective sample size of drawing windows with the given weights.
+    '''
+    weights = np.asarray(weights, dtype=np.float64)
+    return float(weights.sum() ** 2 / np.sum(weights ** 2))
+
+
+def create_train_val_data_loaders(args, logger, fields=None, video_set=None):
+    '''
+    :param fields (list of str): Keys that every sample should carry, e.g. TRAIN_FIELDS, or None
+        for all of SAMPLE_FIELDS.
+    :param video_set (str): Overrides args.video_set.
     return (train_loader, val_aug_loader, val_noaug_loader, dset_args).
     '''
 
@@ -64,29 +225,87 @@ def create_train_val_data_loaders(args, logger):
     dset_args = dict()
     dset_args['percent'] = args.percent
     dset_args['step'] = int(args.step)
+    dset_args['cache_root'] = args.cache_path
+    dset_args['lazy'] = args.lazy_load
+    dset_args['cache_bytes'] = int(float(args.cache_gb) * (2 ** 30))
+    dset_args['vectorized'] = args.vectorized
+    dset_args['fields'] = fields
+    dset_args['share_memory'] = args.share_memory
+    dset_args['windowing'] = args.windowing
+    dset_args['window_stride'] = int(args.window_stride)
+    dset_args['decimate'] = int(args.decimate)
+    dset_args['video_set'] = video_set if video_set is not None else args.video_set
+    dset_args['precomputed'] = args.precomputed
+    dset_args['skip_invalid'] = args.skip_invalid
+    dset_args['subset'] = args.subset
+    dset_args['subset_seed'] = int(args.subset_seed)
+    dset_args['frame_store'] = args.frame_store
     #dset_args['transform'] = my_transform
+    # Keep workers (and their copy of the dataset) alive across epochs instead of re-forking them.
+    persistent = args.persistent_workers and int(args.num_workers) > 0
+    # Batches arrive in page-locked memory, such that BatchPrefetcher copies them asynchronously.
+    pin = args.device == 'cuda'
 
-    train_dataset = MyMuscleDataset(
-        args.data_path_train, logger, 'train', **dset_args)
+    # RGB clips are augmented like images in get_train_transform(), or per batch on the device by
+    # augs.BatchClipAugment in train.py, in which case training clips stay uint8.
+    train_clip_args = {'clip_transform': augs.get_clip_train_transform(int(args.clip_size))} \
+        if args.frame_store and not args.batch_augment else dict()
+    val_clip_args = {'clip_transform': augs.get_clip_test_transform(int(args.clip_size))} \
+        if args.frame_store else dict()
+
+    if args.streaming:
+        # Every process should only load the videos of its own shards.
+        train_dataset = MyMuscleDataset(
+            args.data_path_train, logger, 'train',
+            **dict(dset_args, lazy=True, share_memory=False, **train_clip_args))
+    else:
+        train_dataset = MyMuscleDataset(
+            args.data_path_train, logger, 'train', **dict(dset_args, **train_clip_args))
 
     #validations = os.listdir(args.data_path_val)
     
     
     val_aug_dataset = MyMuscleDataset(
-        args.data_path_val, logger, 'val', **dset_args)
+        args.data_path_val, logger, 'val', **dict(dset_args, **val_clip_args))
     val_aug_loader = torch.utils.data.DataLoader(
     val_aug_dataset, batch_size=args.bs, num_workers=args.num_workers,
-    shuffle=True, worker_init_fn=_seed_worker, drop_last=True, pin_memory=False)
+    shuffle=True, worker_init_fn=_seed_worker, drop_last=True, pin_memory=pin,
+    collate_fn=_collate_batch, persistent_workers=persistent)
 
     #first = int(len(dataset)*0.8)
     #second = len(dataset) - first
     #train_dataset, val_aug_dataset = torch.utils.data.random_split(dataset, [first, second])
-    train_loader = torch.utils.data.DataLoader(
-        train_dataset, batch_size=args.bs, num_workers=args.num_workers,
-        shuffle=True, worker_init_fn=_seed_worker, drop_last=True, pin_memory=False)
+    if args.streaming:
+        train_stream = MyMuscleStream(train_dataset, args.bs, int(args.shuffle_buffer), args.seed)
+        # NOTE: Not persistent, since set_epoch() must reach the workers' copies of the stream.
+        train_loader = torch.utils.data.DataLoader(
+            train_stream, batch_size=None, num_workers=args.num_workers,
+            worker_init_fn=_seed_worker, pin_memory=pin, collate_fn=_collate_batch)
+    else:
+        if args.sampler == 'activation':
+            muscle = None if args.sample_muscle == 'all' else int(args.sample_muscle)
+            weights = activation_weights(train_dataset.window_activation(muscle),
+                                         float(args.sample_alpha), float(args.sample_max_ratio))
+            if args.reweight_loss:
+                # Importance weights, such that the expected loss matches uniform sampling.
+                train_dataset.sample_weights = (1.0 / weights).astype(np.float32)
+            ess = effective_sample_size(weights)
+            logger.info(f'Activation sampler: effective sample size {ess:.0f} / {len(weights)} '
+                        f'({ess / len(weights):.1%}), weights {weights.min():.3f} to '
+                        f'{weights.max():.3f}')
+            train_sampler = ActivationSampler(train_dataset, weights, args.seed)
+        else:
+            assert args.sampler == 'uniform', args.sampler
+            train_sampler = ResumableSampler(train_dataset, args.seed)
+        train_loader = torch.utils.data.DataLoader(
+            train_dataset, batch_size=args.bs, num_workers=args.num_workers,
+            sampler=train_sampler, worker_init_fn=_seed_worker,
+            drop_last=True, pin_memory=pin, collate_fn=_collate_batch,
+            persistent_workers=persistent)
     train_loader_noshuffle = torch.utils.data.DataLoader(
         train_dataset, batch_size=args.bs, num_workers=args.num_workers,
-        shuffle=False, worker_init_fn=_seed_worker, drop_last=True, pin_memory=False)
+        shuffle=False, worker_init_fn=_seed_worker, drop_last=True, pin_memory=pin,
+        collate_fn=_collate_batch, persistent_workers=persistent)
     
    
     return (train_loader, train_loader_noshuffle, val_aug_loader, val_aug_loader, dset_args)
@@ -118,12 +337,46 @@ class MyMuscleDataset(torch.utils.data.Dataset):
     dataset.
     '''
 
-    def __init__(self, dataset_root, logger, phase, percent,  step,transform=None):
+    def __init__(self, dataset_root, logger, phase, percent,  step,transform=None, cache_root=None,
+                 lazy=False, cache_bytes=8 * (2 ** 30), vectorized=True,
+                 fields=None, share_memory=False, windowing='index', window_stride=1, decimate=1,
+                 video_set='all', precomputed=False, skip_invalid=True, subset='stratified',
+                 subset_seed=0, frame_store=None, clip_transform=None):
         '''
         :param dataset_root (str): Path to dataset (with or without phase).
         :param logger (MyLogger).
         :param phase (str): train / val_aug / val_noaug / test.
         :param transform: Data transform to apply on every image.
+        :param cache_root (str): Array store built by dataloader/store.py. If set, VIBE outputs are
+            memory-mapped from there instead of being unpickled.
+        :param lazy (bool): Load every video on first use instead of all of them up front, and
+            keep at most cache_bytes worth of videos around.
+        :param cache_bytes (int): Byte budget of the lazy video cache.
+        :param vectorized (bool): Gather windows with gather_window() instead of the per-frame loop
+            in visualize_video().
+        :param fields (list of str): Subset of SAMPLE_FIELDS to return, or None for all of them.
+            Array store fields that none of these need are never loaded.
+        :param share_memory (bool): Publish unpickled VIBE outputs once into shared memory, such
+            that data loader workers attach to them zero-copy. This saves a copy of the arrays per
+            spawned worker; forked workers already share the parent's arrays copy-on-write.
+            Memory-mapped videos are already shared through the page cache and are left alone.
+        :param windowing (str): index = one window per line of the text file / sliding = windows
+            of step frames built at runtime from the per-frame timeline of every video.
+        :param window_stride (int): Frames between consecutive sliding window starts.
+        :param decimate (int): Temporal subsampling factor within sliding windows.
+        :param video_set (str): Entry of configs/videosets.yaml that determines which videos to
+            load, the layout of the window text files and the EMG channels to return.
+        :param precomputed (bool): Also offer PRECOMPUTED_SAMPLE_FIELDS, read from the array store
+            (see store.py --precompute) and from digitized EMG values cached next to the text file.
+        :param skip_invalid (bool): Leave out windows marked invalid by dataloader/validate.py.
+        :param subset (str): How to keep only percent of the windows. stratified = a subset that
+            keeps every video and EMG activation level represented (see windows.stratified_subset),
+            cached next to the text file / prefix = the first windows of the text file.
+        :param subset_seed (int): Which stratified subset to draw.
+        :param frame_store (str): Frame store built by dataloader/framestore.py. If set, also offer
+            FRAME_SAMPLE_FIELDS.
+        :param clip_transform: Applied to every (T, H, W, 3) uint8 tensor clip, e.g.
+            augs.get_clip_train_transform().
         '''
         # Get root and phase directories.
         phase_dir = os.path.join(dataset_root, phase)
@@ -137,17 +390,81 @@ class MyMuscleDataset(torch.utils.data.Dataset):
         # NOTE: This method call handles subdirectories recursively, but also creates extra files.
         #all_files = utils.cached_listdir(phase_dir, allow_exts=['jpg', 'jpeg', 'png'],
         #                                 recursive=True)
+        self.logger = logger
         self.phase = phase
-        with open(dataset_root) as f:
-            lines = f.readlines()
-            self.all_files = lines
-            file_count = len(self.all_files)
-            print('Image file count:', file_count)
-            self.dset_size = file_count
-            self.file_count = file_count
+        self.video_set = video_set
+        video_set_info = load_video_set(video_set)
+        self.videos = list(video_set_info['videos'])
+        self.emg_channels = list(video_set_info['emg_channels'])
+        self.pose_source = video_set_info['pose_source']
+        self.len_offset = int(video_set_info['len_offset'])
+        (self.index, self.index_meta) = windows.load_window_index(
+            dataset_root, int(video_set_info['stride']), int(video_set_info['num_emg']))
+        self.index_keys = [video.split("/")[-1].split("_")[1] for video in self.index_meta['videos']]
+        self.index_video_ids = np.array([store.video_id(key) for key in self.index_keys])
+        # Lookup table that turns (video_id, frame_idx) of a sample back into frame paths.
+        self.frame_dirs = {int(vid): store.VIBE_ROOT + video
+                           for (vid, video) in zip(self.index_video_ids, self.index_meta['videos'])}
+        self.windowing = windowing
+        # Index rows that windows refer to, if not all of them (see skip_invalid).
+        self.rows = None
+        # Validity masks only apply to the pose outputs they were computed from.
+        poses = store.pose_stamps(self.videos, self.pose_source) if skip_invalid else None
+        if self.windowing == 'sliding':
+            timeline = windows.load_timeline(dataset_root, self.index, self.index_meta)
+            self.sliding = windows.SlidingWindows(timeline, step, window_stride, decimate)
+            valid = windows.load_validity(dataset_root + '.timeline', self.index_meta['source'],
+                                          poses) if skip_invalid else None
+            if valid is not None:
+                all_rows = self.sliding.rows(np.arange(len(self.sliding)))
+                window_valid = np.asarray(valid)[all_rows, 0].all(axis=1)
+                self.sliding.starts = self.sliding.starts[window_valid]
+                self.logger.info(f'Skipping invalid windows: {int(np.sum(~window_valid))}')
+            file_count = len(self.sliding)
+        else:
+            assert self.windowing == 'index', self.windowing
+            assert self.index_meta['width'] >= int(step), \
+                f'{dataset_root} holds windows of {self.index_meta["width"]} frames, fewer than step'
+            self.sliding = None
+            valid = windows.load_validity(dataset_root + '.idx', self.index_meta['source'],
+                                          poses) if skip_invalid else None
+            if valid is not None:
+                self.rows = np.flatnonzero(np.asarray(valid)[:, :int(step)].all(axis=1))
+                self.logger.info(f'Skipping invalid windows: {len(self.index) - len(self.rows)}')
+            file_count = len(self.index) if self.rows is None else len(self.rows)
+        self.logger.info(f'Image file count: {file_count}')
+
+        # Windows that percent < 1 keeps, folded into self.rows / self.sliding.starts.
+        self.subset = None
+        num_candidates = file_count - self.len_offset
+        if subset == 'stratified' and float(percent) < 1.0 and num_candidates > 0:
+            if self.sliding is not None:
+                rows = self.sliding.rows(np.arange(num_candidates))
+                (videos, emg) = (self.sliding.timeline['video'][rows[:, 0]],
+                                self.sliding.timeline['emg'][rows])
+                prefix = dataset_root + '.timeline'
+            else:
+                rows = np.arange(num_candidates) if self.rows is None \
+                    else self.rows[:num_candidates]
+                (videos, emg) = (self.index['video'][rows], self.index['emg'][rows][:, :int(step)])
+                prefix = dataset_root + '.idx'
+            activation = np.asarray(emg)[..., self.emg_channels].mean(axis=(1, 2))
+            stamp = {'source': self.index_meta['source'], 'video_set': video_set,
+                     'windowing': windowing, 'step': int(step), 'window_stride': int(window_stride),
+                     'decimate': int(decimate), 'skip_invalid': bool(skip_invalid),
+                     'validity': windows.validity_stamp(prefix) if valid is not None else None}
+            self.subset = windows.load_subset(prefix, stamp, videos, activation, float(percent),
+                                              subset_seed)
+            if self.sliding is not None:
+                self.sliding.starts = self.sliding.starts[self.subset]
+            else:
+                self.rows = rows[self.subset]
+        else:
+            assert subset in ['stratified', 'prefix'], subset
+        self.dset_size = file_count
+        self.file_count = file_count
 
         self.dataset_root = dataset_root
-        self.logger = logger
         self.phase = phase
         self.phase_dir = phase_dir
         self.transform = transform
@@ -158,36 +475,62 @@ class MyMuscleDataset(torch.utils.data.Dataset):
         self.log_dir = 'training_viz_digitized'
         self.plot = False
         self.muscles=['rightquad','leftquad','rightham','leftham','rightglutt','leftglutt','leftbicep','rightbicep']
-        self.videos = ['IMG_2419_30.MOV','IMG_2420_30.MOV','IMG_2422_30.MOV', 'IMG_2404_30.MOV',
-        'IMG_2426_30.MOV','IMG_2405_30.MOV','IMG_2409_30.MOV','IMG_2410_30.MOV',
-        'IMG_2411_30.MOV','IMG_2412_30.MOV','IMG_2403_30.MOV','IMG_2413_30.MOV',
-        'IMG_2414_30.MOV','IMG_2424_30.MOV','IMG_2415_30.MOV','IMG_2406_30.MOV',
-        'IMG_2407_30.MOV','IMG_2408_30.MOV','IMG_2416_30.MOV','IMG_2423_30.MOV',
-        'IMG_2425_30.MOV','IMG_2096_30.MOV','IMG_2097_30.MOV','IMG_2099_30.MOV','IMG_2100_30.MOV','IMG_2101_30.MOV',
-        'IMG_2104_30.MOV','IMG_2105_30.MOV','IMG_2108_30.MOV','IMG_2109_30.MOV','IMG_2110_30.MOV',
-        'IMG_2111_30.MOV','IMG_2112_30.MOV','IMG_2125_30.MOV','IMG_2129_30.MOV','IMG_2098_30.MOV',
-        'IMG_2103_30.MOV','IMG_2107_30.MOV','IMG_2113_30.MOV','IMG_2126_30.MOV','IMG_2131_30.MOV',
-        ]
-        #self.videos = ['IMG_squatright_30.MOV', 'IMG_squatwrong_30.MOV']
-        #self.videos = ['IMG_2403_30.MOV','IMG_2411_30.MOV','IMG_2412_30.MOV', 'IMG_2414_30.MOV',
-        #'IMG_2415_30.MOV']
-        """self.videos = ['IMG_2096_30.MOV','IMG_2097_30.MOV','IMG_2099_30.MOV','IMG_2100_30.MOV','IMG_2101_30.MOV',
-        'IMG_2104_30.MOV','IMG_2105_30.MOV','IMG_2108_30.MOV','IMG_2109_30.MOV','IMG_2110_30.MOV',
-        'IMG_2111_30.MOV','IMG_2112_30.MOV','IMG_2125_30.MOV','IMG_2129_30.MOV','IMG_2098_30.MOV',
-        'IMG_2103_30.MOV','IMG_2107_30.MOV','IMG_2113_30.MOV','IMG_2126_30.MOV','IMG_2131_30.MOV']"""
-        """self.videos = ['IMG_2419_30.MOV','IMG_2420_30.MOV','IMG_2422_30.MOV', 'IMG_2404_30.MOV',
-        'IMG_2426_30.MOV','IMG_2405_30.MOV','IMG_2409_30.MOV','IMG_2410_30.MOV',
-        'IMG_2411_30.MOV','IMG_2412_30.MOV','IMG_2403_30.MOV','IMG_2413_30.MOV',
-        'IMG_2414_30.MOV','IMG_2424_30.MOV','IMG_2415_30.MOV','IMG_2406_30.MOV',
-        'IMG_2407_30.MOV','IMG_2408_30.MOV','IMG_2416_30.MOV','IMG_2423_30.MOV',
-        'IMG_2425_30.MOV'] """
-        """self.videos = ['IMG_2478_30.MOV','IMG_2479_30.MOV','IMG_2480_30.MOV',
-        'IMG_2487_30.MOV','IMG_2488_30.MOV','IMG_2489_30.MOV','IMG_2490_30.MOV',
-        'IMG_2471_30.MOV','IMG_2472_30.MOV','IMG_2473_30.MOV','IMG_2474_30.MOV',
-        'IMG_2483_30.MOV','IMG_2484_30.MOV','IMG_2485_30.MOV','IMG_2486_30.MOV']"""
-        self.pickledict = {}
-        for elem in self.videos:
-            self.pickledict[elem.split("_")[1]] = joblib.load('../../../vondrick/mia/VIBE/' + 'output/' + elem + '/vibe_output.pkl')#filepath[1]) 
+        self.cache_root = cache_root
+        self.vectorized = vectorized
+        self.precomputed = precomputed
+        # Pose sources other than VIBE only provide some of the store fields.
+        source_fields = list(store.POSE_SOURCE_FIELDS[self.pose_source])
+        sample_fields = list(SAMPLE_FIELDS)
+        if self.precomputed:
+            source_fields += store.PRECOMPUTED_FIELDS[self.pose_source]
+            sample_fields += PRECOMPUTED_SAMPLE_FIELDS
+            if self.sliding is not None:
+                self.emg_bins = windows.load_emg_bins(
+                    dataset_root + '.timeline', self.sliding.timeline['emg'],
+                    self.index_meta['source'], self.bins)
+            else:
+                self.emg_bins = windows.load_emg_bins(
+                    dataset_root + '.idx', self.index['emg'], self.index_meta['source'], self.bins)
+        self.frame_store = framestore.FrameStore(frame_store) if frame_store else None
+        self.clip_transform = clip_transform
+        if self.frame_store is not None:
+            sample_fields += FRAME_SAMPLE_FIELDS
+        available = [field for field in sample_fields if field not in SAMPLE_TO_STORE_FIELD
+                     or SAMPLE_TO_STORE_FIELD[field] in source_fields]
+        self.fields = list(available) if fields is None else list(fields)
+        assert all(field in available for field in self.fields), \
+            f'{self.fields} not all available for video set {video_set}'
+        if self.vectorized:
+            self.store_fields = [SAMPLE_TO_STORE_FIELD[field] for field in self.fields
+                                 if field in SAMPLE_TO_STORE_FIELD]
+        else:
+            # The per-frame loop always reads every field and assumes the 8 channel VIBE layout.
+            assert self.pose_source == 'vibe' and self.index_meta['num_emg'] == 8 \
+                and not self.precomputed, \
+                f'Video set {video_set} requires vectorized loading'
+            self.store_fields = list(store.STORE_FIELDS)
+        # Per window loss weights, see ActivationSampler; None = all 1.
+        self.sample_weights = None
+        self.lazy = lazy
+        self.share_memory = share_memory
+        assert not (self.lazy and self.share_memory), 'Lazily loaded videos are per worker'
+        self.shared = dict()
+        self.key_to_video = {store.video_key(elem): elem for elem in self.videos}
+        if self.lazy:
+            self.pickledict = store.VideoCache(self._load_video_by_key, cache_bytes)
+        else:
+            self.pickledict = {}
+            for elem in self.videos:
+                self.pickledict[store.video_key(elem)] = self._load_video(elem)
+            if self.share_memory:
+                for (key, arrays) in self.pickledict.items():
+                    if not any(isinstance(array, (np.memmap, store.EncodedArray))
+                               for array in arrays.values()):
+                        self.shared[key] = store.share_video(arrays)
+                        self.pickledict[key] = store.shared_to_numpy(self.shared[key])
+                # The loop variable would keep the originals of the last video alive.
+                arrays = None
+                store.release_heap()
         #self.pathtopklone = '../../../vondrick/mia/VIBE/' + 'output/IMG_1196_30.MOV/vibe_output.pkl'#filepath[1]
         #self.pathtopkltwo = '../../../vondrick/mia/VIBE/' + 'output/IMG_1197_30.MOV/vibe_output.pkl'#filepath[1]
         #self.pathtopkthree = '../../../vondrick/mia/VIBE/' + 'output/IMG_1203_30.MOV/vibe_output.pkl'#filepath[1]
@@ -212,8 +555,136 @@ class MyMuscleDataset(torch.utils.data.Dataset):
         self.totalten = joblib.load(self.pathtopkten)
         self.totaleleven = joblib.load(self.pathtopkeleven)"""
 
+    def _load_video(self, video):
+        '''
+        :return (dict): Maps VIBE output field name to per-frame array for the tracked person.
+        '''
+        if self.cache_root:
+            if store.has_video(self.cache_root, video, self.store_fields):
+                return store.open_video(self.cache_root, video, self.store_fields)
+            self.logger.warning(f'{video} missing from array store {self.cache_root}, unpickling instead')
+        if not self.lazy:
+            return store.load_pose_shared(video, self.store_fields, self.pose_source)
+        # The cache budget should bound what this dataset keeps in memory.
+        total = store.load_pose(video, self.pose_source)
+        if 'twodkpts_norm' in self.store_fields:
+            total = dict(total, twodkpts_norm=store.compute_twodkpts_norm(total))
+        return {field: total[field] for field in self.store_fields}
+
+    def __getstate__(self):
+        # When workers are spawned rather than forked, send shared tensors (which torch pickles as
+        # handles to the shared segment) instead of copies of their numpy views, and file handles
+        # instead of the pages of memory-mapped arrays (window index, timeline, array store).
+        state = self.__dict__.copy()
+        if len(self.shared) != 0:
+            state['pickledict'] = {key: arrays for (key, arrays) in self.pickledict.items()
+                                   if key not in self.shared}
+        if self.sliding is not None:
+            state['sliding'] = copy.copy(self.sliding)
+            state['sliding'].timeline = store.pack_arrays(self.sliding.timeline)
+        return store.pack_arrays(state)
+
+    def __setstate__(self, state):
+        self.__dict__.update(store.unpack_arrays(state))
+        if self.sliding is not None:
+            self.sliding.timeline = store.unpack_arrays(self.sliding.timeline)
+        for (key, tensors) in self.shared.items():
+            self.pickledict[key] = store.shared_to_numpy(tensors)
+
+    def _window(self, index):
+        '''
+        :return (video, frame, pickle_frame, emg): Video id, and per-frame frame numbers, VIBE
+            output indices and raw EMG values (step, NUM_EMG) of one window.
+        '''
+        if self.sliding is not None:
+            return self.sliding[index]
+        record = self.index[index if self.rows is None else self.rows[index]]
+        return (record['video'], record['frame'][:self.step], record['pickle_frame'][:self.step],
+                record['emg'][:self.step])
+
+    def frame_path(self, video_id, frame_idx):
+        '''
+        :param video_id (int): As carried by samples, see store.video_id().
+        :param frame_idx (int): Frame number within the video.
+        :return (str): Path to the extracted frame.
+        '''
+        return self.frame_dirs[int(video_id)] + "/" + str(int(frame_idx)).zfill(6) + ".png"
+
+    def _windows(self, indices):
+        '''
+        :return (video, frame, pickle_frame, emg): Same as _window(), stacked over a whole batch.
+        '''
+        if self.sliding is not None:
+            return self.sliding.batch(indices)
+        records = self.index[indices if self.rows is None else self.rows[indices]]
+        return (records['video'], records['frame'][:, :self.step],
+                records['pickle_frame'][:, :self.step], records['emg'][:, :self.step])
+
+    def _emg_bins(self, indices):
+        '''
+        :return (B, step, NUM_EMG): Precomputed np.digitize() of the raw EMG values of windows.
+        '''
+        if self.sliding is not None:
+            return np.asarray(self.emg_bins[self.sliding.rows(indices)])
+        rows = indices if self.rows is None else self.rows[indices]
+        return np.asarray(self.emg_bins[rows])[:, :self.step]
+
+    def _load_video_by_key(self, key):
+        return self._load_video(self.key_to_video[key])
+
+    def cache_stats(self):
+        '''
+        :return (dict): Hit, miss and eviction counters of the lazy video cache in this process.
+        '''
+        if not self.lazy:
+            return None
+        return self.pickledict.stats()
+
     def __len__(self):
-        return int((self.dset_size)*self.percent)
+        if self.subset is not None:
+            return len(self.subset)
+        return int((self.dset_size - self.len_offset)*self.percent)
+
+    def window_activation(self, muscle=None, chunk_size=65536):
+        '''
+        :param muscle (int): Channel of emg_values to use, or None to average all of them.
+        :return (len(self),) array: Mean raw EMG value over the frames of every window.
+        '''
+        channels = self.emg_channels if muscle is None else [self.emg_channels[muscle]]
+        activation = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), chunk_size):
+            indices = np.arange(start, min(start + chunk_size, len(self)))
+            emg = np.asarray(self._windows(indices)[3], dtype=np.float32)
+            activation[indices] = emg[..., channels].mean(axis=(1, 2))
+        return activation
+
+    def _sample_weights(self, indices):
+        if self.sample_weights is None:
+            return np.ones(len(indices), dtype=np.float32)
+        return np.asarray(self.sample_weights[indices], dtype=np.float32)
+
+    def _clip(self, video, frames):
+        '''
+        :param video (int): Index into index_meta['videos'].
+        :param frames (step,) array: Frame numbers of the window.
+        :return: (step, H, W, 3) uint8 array, a zero-copy view into the frame store where possible,
+            or the output of clip_transform.
+        '''
+        clip = self.frame_store.video(store.VIBE_ROOT + self.index_meta['videos'][video]).clip(frames)
+        if self.clip_transform is not None:
+            # One copy of the uint8 clip, as torch only wraps writable arrays.
+            clip = self.clip_transform(torch.from_numpy(np.array(clip)))
+        return clip
+
+    def window_videos(self):
+        '''
+        :return (len(self),) array: Index into index_meta['videos'] of every window.
+        '''
+        if self.sliding is not None:
+            videos = self.sliding.timeline['video'][self.sliding.starts]
+        else:
+            videos = self.index['video'] if self.rows is None else self.index['video'][self.rows]
+        return np.asarray(videos[:len(self)])
 
     def animate(self, list_of_data, labels, part, trialnum, current_path):
     
@@ -250,20 +721,11 @@ class MyMuscleDataset(torch.utils.data.Dataset):
     def visualize_video(self,index):
         #index = 5100
         current_path = self.log_dir + "/" + str(index)
-        cur = time.time()
         os.makedirs(current_path, 0o777, exist_ok=True)
-        file_idx = index
-        filepath = self.all_files[file_idx].split(",")
-        cur2 = time.time()
-        #print(cur2-cur, "1")
-        cur = cur2
+        (video, frames, pickle_frames, emg) = self._window(index)
         
-        pathtoframes = '../../../vondrick/mia/VIBE/' + filepath[0]
-        #print(filepath[0],filepath[1])
+        pathtoframes = store.VIBE_ROOT + self.index_meta['videos'][video]
         
-        cur2 = time.time()
-        #print(cur2-cur, "2")
-        cur = cur2
         list_of_emg_values_rightquad = []
         list_of_emg_values_rightham = []
         list_of_emg_values_rightbicep = []
@@ -280,17 +742,11 @@ class MyMuscleDataset(torch.utils.data.Dataset):
         list_of_frame_paths = []
         list_of_orig_cam = []
         list_of_verts = []
-        filepath = self.all_files[index].split(",")
         for i in range(self.step):
-            frame1=pathtoframes + "/" + filepath[2+i*17].zfill(6) + ".png"
-            frame2=pathtoframes +  "/" + filepath[3+i*17].zfill(6) + ".png"
-            frame3=pathtoframes +  "/" + filepath[4+i*17].zfill(6) + ".png"
+            frame1=pathtoframes + "/" + str(frames[i]).zfill(6) + ".png"
             list_of_frame_paths.append(frame1)
-            pickleframe1= int(filepath[5+i*17].split("/")[-1])
-            pickleframe2=int(filepath[6+i*17].split("/")[-1])
-            pickleframe3=int(filepath[7+i*17].split("/")[-1])
-            emgvalues = filepath[8+i*17:17+i*17]
-            emgvalues[-1] = emgvalues[-1].split("\n")[0]
+            pickleframe1= int(pickle_frames[i])
+            emgvalues = emg[i]
             list_of_emg_values_rightquad.append(float(emgvalues[0]))
             list_of_emg_values_rightham.append(float(emgvalues[2]))
             list_of_emg_values_rightbicep.append(float(emgvalues[4]))
@@ -328,27 +784,20 @@ class MyMuscleDataset(torch.utils.data.Dataset):
                 total = self.totaleleven"""
             
             
-            firstjoints2dframe= total[1]['joints2d_img_coord'][pickleframe1]
+            firstjoints2dframe= total['joints2d_img_coord'][pickleframe1]
             list_of_2d_joints.append(firstjoints2dframe)
-            second2djoints2dframe = total[1]['joints2d_img_coord'][pickleframe2]
-            third2djoints2dframe = total[1]['joints2d_img_coord'][pickleframe3]
 
-            origcam = total[1]['orig_cam'][pickleframe1]
-            verts = total[1]['verts'][pickleframe1]
+            origcam = total['orig_cam'][pickleframe1]
+            verts = total['verts'][pickleframe1]
             list_of_orig_cam.append(origcam)
             list_of_verts.append(verts)
-            firstjoints3dframe= total[1]['joints3d'][pickleframe1]
-            firstbboxes= total[1]['bboxes'][pickleframe1]
-            firstpredcam = total[1]['pred_cam'][pickleframe1]
+            firstjoints3dframe= total['joints3d'][pickleframe1]
+            firstbboxes= total['bboxes'][pickleframe1]
+            firstpredcam = total['pred_cam'][pickleframe1]
             list_of_3d_joints.append(firstjoints3dframe)
             list_of_bboxes.append(firstbboxes)
             list_of_predcam.append(firstpredcam)
-            second2djoints3dframe = total[1]['joints3d'][pickleframe2]
-            third2djoints3dframe = total[1]['joints3d'][pickleframe3]
             #if i==0:
-                #cur2 = time.time()
-                #print(cur2-cur,(cur2-cur)*30, "3")
-                #cur = cur2
             """if self.phase != 'train':
                 img=cv2.imread(frame1)
                 img = img[...,::-1]
@@ -369,28 +818,140 @@ class MyMuscleDataset(torch.utils.data.Dataset):
 
         digitized_emg_values=[]
 
-        cur2 = time.time()
-        #print(cur2-cur, "4")
-        cur = cur2
         for muscle in emg_values:
             digitized_emg_values.append(np.digitize(muscle,self.bins))
         
-        cur2 = time.time()
-        #print(cur2-cur, "5")
-        cur = cur2
 
         #emg_values.pop(5)
         #emg_values.pop(1)
         return (emg_values,list_of_2d_joints, list_of_3d_joints, list_of_frame_paths, list_of_bboxes, list_of_predcam, list_of_orig_cam, list_of_verts)
 
+    def gather_window(self, index):
+        '''
+        Vectorized equivalent of visualize_video() + __getitem__(). Every field of the window is
+        gathered with one fancy index into the per-video arrays.
+        :return (dict): Same sample as __getitem__(), with contiguous float32 arrays, restricted to
+            self.fields.
+        '''
+        (video, frames, frame_idx, emg) = self._window(index)
+        key = self.index_keys[video]
+        total = self.pickledict[key]
+
+        emg_values = np.ascontiguousarray(emg.T[self.emg_channels], dtype=np.float32)
+
+        result = dict()
+        for field in self.fields:
+            if field in SAMPLE_TO_STORE_FIELD:
+                array = total[SAMPLE_TO_STORE_FIELD[field]]
+                if field == '3dskeleton':
+                    result[field] = array[frame_idx, :25].astype(np.float32, copy=False)
+                else:
+                    result[field] = array[frame_idx].astype(np.float32, copy=False)
+            elif field == 'emg_values':
+                result[field] = emg_values
+            elif field in ['left_quad', 'right_quad']:
+                result[field] = emg_values[0]
+            elif field in ['bined_left_quad', 'bined_right_quad']:
+                if self.precomputed:
+                    result[field] = self._emg_bins([index])[0, :, self.emg_channels[0]].astype(np.int64)
+                else:
+                    result[field] = np.digitize(emg_values[0], self.bins)
+            elif field == 'emg_bins':
+                result[field] = np.ascontiguousarray(
+                    self._emg_bins([index])[0].T[self.emg_channels], dtype=np.int64)
+            elif field == 'cond':
+                result[field] = np.array([0.0]) if key[2] == '4' else np.array([1.0])
+            elif field == 'frame_paths':
+                pathtoframes = store.VIBE_ROOT + self.index_meta['videos'][video]
+                result[field] = [pathtoframes + "/" + str(frame).zfill(6) + ".png"
+                                 for frame in frames]
+            elif field == 'bins':
+                result[field] = np.linspace(0, self.maxemg, 20)
+            elif field == 'video_id':
+                result[field] = np.int64(self.index_video_ids[video])
+            elif field == 'frame_idx':
+                result[field] = np.asarray(frames, dtype=np.int64)
+            elif field == 'sample_weight':
+                result[field] = self._sample_weights([index])[0]
+            elif field == 'rgb':
+                result[field] = self._clip(video, frames)
+        return result
+
+    def __getitems__(self, indices):
+        '''
+        Batched equivalent of gather_window(), called by the DataLoader with all indices of a batch.
+        Every field is gathered into one preallocated (B, ...) buffer with one index operation per
+        video in the batch, instead of stacking B separate samples.
+        :return (dict): Whole batch, to be converted into tensors by _collate_batch().
+        '''
+        if not self.vectorized:
+            return [self[index] for index in indices]
+
+        indices = np.asarray(indices)
+        batch_size = len(indices)
+        (video, frames, frame_idx, emg) = self._windows(indices)
+        groups = [(vid, np.flatnonzero(video == vid)) for vid in np.unique(video)]
+
+        emg_values = np.ascontiguousarray(
+            np.asarray(emg, dtype=np.float32).transpose(0, 2, 1)[:, self.emg_channels])
+
+        result = dict()
+        for field in self.fields:
+            if field in SAMPLE_TO_STORE_FIELD:
+                buf = None
+                for (vid, sel) in groups:
+                    array = self.pickledict[self.index_keys[vid]][SAMPLE_TO_STORE_FIELD[field]]
+                    if field == '3dskeleton':
+                        values = array[frame_idx[sel], :25]
+                    else:
+                        values = array[frame_idx[sel]]
+                    if buf is None:
+                        buf = np.empty((batch_size,) + values.shape[1:], dtype=np.float32)
+                    buf[sel] = values
+                result[field] = buf
+            elif field == 'emg_values':
+                result[field] = emg_values
+            elif field in ['left_quad', 'right_quad']:
+                result[field] = np.ascontiguousarray(emg_values[:, 0])
+            elif field in ['bined_left_quad', 'bined_right_quad']:
+                if self.precomputed:
+                    result[field] = self._emg_bins(indices)[:, :, self.emg_channels[0]].astype(np.int64)
+                else:
+                    result[field] = np.digitize(emg_values[:, 0], self.bins)
+            elif field == 'emg_bins':
+                result[field] = np.ascontiguousarray(
+                    self._emg_bins(indices).transpose(0, 2, 1)[:, self.emg_channels], dtype=np.int64)
+            elif field == 'cond':
+                result[field] = np.empty((batch_size, 1))
+                for (vid, sel) in groups:
+                    result[field][sel] = 0.0 if self.index_keys[vid][2] == '4' else 1.0
+            elif field == 'frame_paths':
+                # Same layout as the default collate: step tuples of batch_size paths.
+                paths = [[store.VIBE_ROOT + self.index_meta['videos'][vid] + "/" +
+                          str(frame).zfill(6) + ".png" for frame in row]
+                         for (vid, row) in zip(video, frames)]
+                result[field] = list(zip(*paths))
+            elif field == 'bins':
+                result[field] = np.tile(np.linspace(0, self.maxemg, 20), (batch_size, 1))
+            elif field == 'video_id':
+                result[field] = self.index_video_ids[video].astype(np.int64)
+            elif field == 'frame_idx':
+                result[field] = np.asarray(frames, dtype=np.int64)
+            elif field == 'sample_weight':
+                result[field] = self._sample_weights(indices)
+            elif field == 'rgb':
+                clips = [self._clip(vid, row) for (vid, row) in zip(video, frames)]
+                result[field] = torch.stack(clips) if self.clip_transform is not None \
+                    else np.stack(clips)
+        return result
+
     def __getitem__(self, index):
-        
-        cur = time.time()
+
+        if self.vectorized:
+            return self.gather_window(index)
+
         (list_of_emg_values, twod_joints, list_of_threed_joints, list_of_frame_paths, list_of_bboxes, list_of_predcam,
         list_of_orig_cam, list_of_verts) = self.visualize_video(index)
-        cur2 = time.time()
-        #print(cur2-cur,"0")
-        cur = cur2
         #list_of_frames=np.array(list_of_frames)
         twod_joints=np.array(twod_joints)
         bboxes = np.array(list_of_bboxes)
@@ -403,15 +964,12 @@ class MyMuscleDataset(torch.utils.data.Dataset):
         bined_left_quad = np.digitize(emg_values_left_quad,self.bins)
 
         # Return results.
-        cur2 = time.time()
-        #print(cur2-cur,"1")
         name = list_of_frame_paths[0].split("/")[-2].split("_")[1]
         if name[2] == '4':
             cond = np.array([0.0]) 
         else:
             cond = np.array([1.0])
         
-        cur = cur2
         result = {'bined_left_quad': bined_left_quad,  
                   'bined_right_quad': bined_right_quad,
                   'left_quad': emg_values_left_quad,
@@ -426,6 +984,102 @@ class MyMuscleDataset(torch.utils.data.Dataset):
                   'predcam': predcam,
                   #'frames': list_of_frames,
                   'frame_paths': list_of_frame_paths,
-                  'bins': np.linspace(0, self.maxemg, 20)}
-        return result
+                  'bins': np.linspace(0, self.maxemg, 20),
+                  'video_id': np.int64(store.video_id(name)),
+                  'frame_idx': np.asarray(self._window(index)[1], dtype=np.int64),
+                  'sample_weight': self._sample_weights([index])[0]}
+        return {field: result[field] for field in self.fields}
+
+
+class MyMuscleStream(torch.utils.data.IterableDataset):
+    '''
+    Streaming variant of MyMuscleDataset for many videos and multiple processes / nodes. Every video
+    is one shard, and every (rank, data loader worker) pair only reads the windows of its own
+    shards, sequentially and through a shuffle buffer. Yields whole batches, so use it with
+    batch_size=None.
+    '''
+
+    def __init__(self, dataset, batch_size, shuffle_buffer=1024, seed=0, rank=None,
+                 world_size=None):
+        '''
+        :param dataset (MyMuscleDataset): Preferably lazy, such that videos are only loaded by the
+            processes that stream them.
+        :param batch_size (int): Windows per yielded batch. Incomplete batches are dropped.
+        :param shuffle_buffer (int): Number of windows to sample from at random; 1 = no shuffling.
+        :param seed (int): Shard order and buffer sampling depend only on seed and epoch.
+        :param rank, world_size (int): Default to torch.distributed if initialized, otherwise 0, 1.
+        '''
+        super().__init__()
+        self.dataset = dataset
+        self.batch_size = int(batch_size)
+        self.shuffle_buffer = max(int(shuffle_buffer), 1)
+        self.seed = int(seed)
+        distributed = torch.distributed.is_available() and torch.distributed.is_initialized()
+        if rank is None:
+            rank = torch.distributed.get_rank() if distributed else 0
+        if world_size is None:
+            world_size = torch.distributed.get_world_size() if distributed else 1
+        self.rank = int(rank)
+        self.world_size = int(world_size)
+        self.epoch = 0
+
+        window_videos = dataset.window_videos()
+        order = np.argsort(window_videos, kind='stable')
+        (shard_ids, starts) = np.unique(window_videos[order], return_index=True)
+        self.shards = np.split(order, starts[1:])
+        self.shard_videos = shard_ids
+
+    def set_epoch(self, epoch):
+        '''
+        Call before every epoch (in the main process) to reshuffle the shard order.
+        '''
+        self.epoch = int(epoch)
+
+    def __len__(self):
+        # Approximate number of batches per rank; shards are not exactly balanced.
+        num_windows = sum(len(shard) for shard in self.shards)
+        return num_windows // (self.world_size * self.batch_size)
+
+    def assign_shards(self, slot, num_slots):
+        '''
+        Shuffles the shards for this epoch, identically in every process, and deals them out
+        greedily such that all slots get about the same number of windows.
+        :return (list of int): Shard indices of the given slot.
+        '''
+        rng = np.random.default_rng([self.seed, self.epoch])
+        loads = np.zeros(num_slots, dtype=np.int64)
+        assigned = [[] for _ in range(num_slots)]
+        for shard in rng.permutation(len(self.shards)):
+            target = int(np.argmin(loads))
+            assigned[target].append(int(shard))
+            loads[target] += len(self.shards[shard])
+        return assigned[slot]
+
+    def __iter__(self):
+        worker_info = torch.utils.data.get_worker_info()
+        (worker_id, num_workers) = (0, 1) if worker_info is None \
+            else (worker_info.id, worker_info.num_workers)
+        slot = self.rank * num_workers + worker_id
+        num_slots = self.world_size * num_workers
+        rng = np.random.default_rng([self.seed, self.epoch, slot])
+
+        buffer = []
+        batch = []
+        for shard in self.assign_shards(slot, num_slots):
+            for index in self.shards[shard]:
+                if len(buffer) < self.shuffle_buffer:
+                    buffer.append(index)
+                    continue
+                pick = rng.integers(len(buffer))
+                (buffer[pick], index) = (index, buffer[pick])
+                batch.append(index)
+                if len(batch) == self.batch_size:
+                    yield self.dataset.__getitems__(batch)
+                    batch = []
 
+        rng.shuffle(buffer)
+        for index in buffer:
+            batch.append(index)
+            if len(batch) == self.batch_size:
+                yield self.dataset.__getitems__(batch)
+                batch = []
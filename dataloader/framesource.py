@@ -0,0 +1,134 @@
+'''
+Frame sources that return the video frames behind the frame paths carried by samples, either
+from the %06d.png folders extracted for VIBE or decoded straight from the source videos.
+'''
+
+import collections
+import os
+
+import cv2
+
+
+# VIBE extracts frames with ffmpeg, which numbers them from 1.
+FIRST_FRAME = 1
+VIDEO_EXTS = ['.MOV', '.mov', '.mp4']
+
+
+def source_video_path(frame_dir, video_root):
+    '''
+    :param frame_dir (str): Extracted frame folder, e.g. .../IMG_2419_30_MOV (VIBE replaces the dots
+        of the video name by underscores).
+    :param video_root (str): Folder holding the source videos.
+    :return (str): Path to the source video, e.g. <video_root>/IMG_2419_30.MOV.
+    '''
+    name = os.path.basename(os.path.normpath(frame_dir))
+    if os.path.splitext(name)[1] not in VIDEO_EXTS:
+        (stem, _, ext) = name.rpartition('_')
+        name = stem + '.' + ext
+    return os.path.join(video_root, name)
+
+
+class VideoFrameSource(object):
+    '''
+    Decodes frames of one video with OpenCV (ffmpeg). Reads that move forward by a few frames keep
+    decoding from the current position; everything else seeks, which ffmpeg serves by decoding
+    from the nearest preceding keyframe. Recently decoded frames are kept in a small LRU.
+    '''
+
+    def __init__(self, video_path, max_frames=64, max_skip=60):
+        '''
+        :param max_frames (int): Decoded frames to keep around.
+        :param max_skip (int): Up to this many frames ahead, frames are skipped by grabbing them
+            (decoding without conversion) instead of seeking. Roughly the keyframe interval.
+        '''
+        self.video_path = video_path
+        self.capture = cv2.VideoCapture(video_path)
+        if not self.capture.isOpened():
+            raise IOError(f'Could not open {video_path}')
+        self.num_frames = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.position = 0  # Index of the frame that the next read() returns.
+        self.max_frames = int(max_frames)
+        self.max_skip = int(max_skip)
+        self.frames = collections.OrderedDict()
+        self.seeks = 0
+
+    def read(self, index):
+        '''
+        :param index (int): 0-based frame index.
+        :return (H, W, 3) uint8 array: BGR frame, like cv2.imread().
+        '''
+        if index in self.frames:
+            self.frames.move_to_end(index)
+            return self.frames[index]
+
+        if not (0 <= index - self.position <= self.max_skip):
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+            self.position = index
+            self.seeks += 1
+        while self.position < index:
+            self.capture.grab()
+            self.position += 1
+        (success, frame) = self.capture.read()
+        if not success:
+            raise IOError(f'Could not decode frame {index} of {self.video_path}')
+        self.position += 1
+
+        self.frames[index] = frame
+        while len(self.frames) > self.max_frames:
+            self.frames.popitem(last=False)
+        return frame
+
+    def close(self):
+        self.capture.release()
+
+
+class FrameReader(object):
+    '''
+    Maps frame paths to images, reading the PNG files (source png) or decoding the corresponding
+    frames of the source videos (source video), such that the extracted folders are not needed.
+    '''
+
+    def __init__(self, source='png', video_root='', max_videos=4, max_frames=64):
+        '''
+        :param source (str): png / video.
+        :param video_root (str): Folder holding the source videos, see source_video_path().
+        :param max_videos (int): Videos to keep open at the same time.
+        :param max_frames (int): Decoded frames to keep per open video.
+        '''
+        assert source in ['png', 'video'], source
+        self.source = source
+        self.video_root = video_root
+        self.max_videos = int(max_videos)
+        self.max_frames = int(max_frames)
+        self.videos = collections.OrderedDict()
+
+    def _video(self, frame_dir):
+        if frame_dir in self.videos:
+            self.videos.move_to_end(frame_dir)
+            return self.videos[frame_dir]
+        video = VideoFrameSource(source_video_path(frame_dir, self.video_root), self.max_frames)
+        self.videos[frame_dir] = video
+        while len(self.videos) > self.max_videos:
+            self.videos.popitem(last=False)[1].close()
+        return video
+
+    def read(self, frame_path):
+        '''
+        :param frame_path (str): <frame dir>/%06d.png, as carried by the frame_paths field.
+        :return (H, W, 3) uint8 array: BGR frame, like cv2.imread(), or None if it is missing.
+        '''
+        if self.source == 'png':
+            return cv2.imread(frame_path)
+        (frame_dir, file_name) = os.path.split(frame_path)
+        index = int(os.path.splitext(file_name)[0]) - FIRST_FRAME
+        try:
+            return self._video(frame_dir).read(index)
+        except IOError as e:
+            print(e)
+            return None
+
+    def __getstate__(self):
+        # Open captures cannot be pickled; every process opens its own.
+        state = self.__dict__.copy()
+        state['videos'] = collections.OrderedDict()
+        return state
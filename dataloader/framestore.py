@@ -0,0 +1,190 @@
+'''
+Pre-resized uint8 RGB frames of every video in chunked, memory-mapped .npy files, such that RGB
+video models (e.g. ResNet3d in models/3dconv.py) can read [T, H, W, 3] clips without decoding
+PNGs. Consecutive chunks overlap, such that every clip of up to overlap + 1 consecutive frames is
+a zero-copy view into a single chunk.
+'''
+
+import argparse
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+import musclesinaction.dataloader.framesource as framesource
+import musclesinaction.dataloader.store as store
+import musclesinaction.dataloader.windows as windows
+
+
+META_NAME = 'frames.json'
+
+
+def _chunk_path(video_dir, chunk):
+    return os.path.join(video_dir, f'frames_{chunk:05d}.npy')
+
+
+def _iter_frames(frame_dir, frame_reader):
+    '''
+    Yields the BGR frames of one video in order, from the extracted PNGs or the source video.
+    '''
+    if frame_reader.source == 'video':
+        video = framesource.VideoFrameSource(
+            framesource.source_video_path(frame_dir, frame_reader.video_root))
+        for index in range(video.num_frames):
+            try:
+                yield video.read(index)
+            except IOError:
+                # The frame count of the container is only an estimate.
+                break
+        video.close()
+    else:
+        for file_name in sorted(fn for fn in os.listdir(frame_dir) if fn.endswith('.png')):
+            yield cv2.imread(os.path.join(frame_dir, file_name))
+
+
+def build_video(frame_dir, store_root, frame_reader, height=256, width=144, chunk_frames=256,
+                overlap=63):
+    '''
+    Resizes all frames of one video and writes them as (<= chunk_frames + overlap, H, W, 3) uint8
+    chunks, where chunk k starts at frame k * chunk_frames.
+    :param frame_dir (str): Extracted frame folder, as in the window text files.
+    :param frame_reader (framesource.FrameReader): Determines whether frames are read from the
+        PNGs or decoded from the source video.
+    :param overlap (int): Frames shared by consecutive chunks; the longest zero-copy clip is
+        overlap + 1 frames.
+    :return (dict): Metadata of the written video.
+    '''
+    video_dir = os.path.join(store_root, os.path.basename(os.path.normpath(frame_dir)))
+    os.makedirs(video_dir, exist_ok=True)
+    span = chunk_frames + overlap
+    buffer = []
+    (num_frames, chunk) = (0, 0)
+
+    def _write(frames):
+        array = np.lib.format.open_memmap(_chunk_path(video_dir, chunk), mode='w+',
+                                          dtype=np.uint8, shape=(len(frames), height, width, 3))
+        array[:] = np.stack(frames)
+        array.flush()
+
+    for frame in _iter_frames(frame_dir, frame_reader):
+        # Stored as RGB, which is what the augmentations and models expect.
+        buffer.append(cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)[..., ::-1])
+        num_frames += 1
+        if len(buffer) == span:
+            _write(buffer)
+            buffer = buffer[chunk_frames:]
+            chunk += 1
+    if len(buffer) != 0 and (chunk == 0 or len(buffer) > overlap):
+        _write(buffer)
+        chunk += 1
+
+    meta = {'num_frames': num_frames, 'num_chunks': chunk, 'chunk_frames': chunk_frames,
+            'overlap': overlap, 'height': height, 'width': width,
+            'first_frame': framesource.FIRST_FRAME}
+    with open(os.path.join(video_dir, META_NAME), 'w') as f:
+        json.dump(meta, f)
+    return meta
+
+
+class VideoFrames(object):
+    '''
+    Read access to the frame chunks of one video. Chunks are memory-mapped on first use.
+    '''
+
+    def __init__(self, video_dir):
+        self.video_dir = video_dir
+        with open(os.path.join(video_dir, META_NAME)) as f:
+            self.meta = json.load(f)
+        self.chunks = dict()
+
+    def _chunk(self, chunk):
+        if chunk not in self.chunks:
+            self.chunks[chunk] = np.load(_chunk_path(self.video_dir, chunk), mmap_mode='r')
+        return self.chunks[chunk]
+
+    def clip(self, frame_numbers):
+        '''
+        :param frame_numbers (T,) array: Frame numbers as in the window text files.
+        :return (T, H, W, 3) uint8 array: A view into one chunk when the frames are consecutive and
+            fit into the overlap, a copy otherwise.
+        '''
+        indices = np.asarray(frame_numbers, dtype=np.int64) - self.meta['first_frame']
+        chunk_frames = self.meta['chunk_frames']
+        last_chunk = self.meta['num_chunks'] - 1
+        if len(indices) <= self.meta['overlap'] + 1 and np.all(np.diff(indices) == 1):
+            chunk = min(indices[0] // chunk_frames, last_chunk)
+            start = indices[0] - chunk * chunk_frames
+            return self._chunk(chunk)[start:start + len(indices)]
+        clip = np.empty((len(indices), self.meta['height'], self.meta['width'], 3), dtype=np.uint8)
+        for (i, index) in enumerate(indices):
+            chunk = min(index // chunk_frames, last_chunk)
+            clip[i] = self._chunk(chunk)[index - chunk * chunk_frames]
+        return clip
+
+    def __getstate__(self):
+        # Workers map the chunks themselves rather than receiving copies.
+        state = self.__dict__.copy()
+        state['chunks'] = dict()
+        return state
+
+
+class FrameStore(object):
+    '''
+    Maps frame folders (as in the window text files) to their VideoFrames.
+    '''
+
+    def __init__(self, store_root):
+        self.store_root = store_root
+        self.videos = dict()
+
+    def has_video(self, frame_dir):
+        return os.path.exists(os.path.join(self._video_dir(frame_dir), META_NAME))
+
+    def _video_dir(self, frame_dir):
+        return os.path.join(self.store_root, os.path.basename(os.path.normpath(frame_dir)))
+
+    def video(self, frame_dir):
+        if frame_dir not in self.videos:
+            self.videos[frame_dir] = VideoFrames(self._video_dir(frame_dir))
+        return self.videos[frame_dir]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store_root', required=True)
+    parser.add_argument('--txt_paths', nargs='+', required=True,
+                        help='Window text files whose videos to convert, e.g. train6.txt.')
+    parser.add_argument('--video_set', default='all')
+    parser.add_argument('--frame_source', default='png', choices=['png', 'video'])
+    parser.add_argument('--video_root', default='')
+    parser.add_argument('--height', type=int, default=256)
+    parser.add_argument('--width', type=int, default=144)
+    parser.add_argument('--chunk_frames', type=int, default=256)
+    parser.add_argument('--overlap', type=int, default=63)
+    parser.add_argument('--overwrite', action='store_true')
+    frame_args = parser.parse_args()
+
+    # Imported here since data.py imports this module.
+    import musclesinaction.dataloader.data as data
+
+    video_set_info = data.load_video_set(frame_args.video_set)
+    frame_reader = framesource.FrameReader(frame_args.frame_source, frame_args.video_root)
+    frame_store = FrameStore(frame_args.store_root)
+    frame_dirs = []
+    for txt_path in frame_args.txt_paths:
+        (_, meta) = windows.load_window_index(
+            txt_path, int(video_set_info['stride']), int(video_set_info['num_emg']))
+        frame_dirs += [store.VIBE_ROOT + video for video in meta['videos']
+                       if store.VIBE_ROOT + video not in frame_dirs]
+
+    for frame_dir in frame_dirs:
+        if frame_store.has_video(frame_dir) and not frame_args.overwrite:
+            continue
+        start_time = time.time()
+        meta = build_video(frame_dir, frame_args.store_root, frame_reader, frame_args.height,
+                           frame_args.width, frame_args.chunk_frames, frame_args.overlap)
+        print(f'Stored {meta["num_frames"]} frames of {frame_dir} in {meta["num_chunks"]} chunks '
+              f'({time.time() - start_time:.3f}s)')
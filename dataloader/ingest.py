@@ -0,0 +1,162 @@
+'''
+Incremental refresh of the dataset after recordings are added or re-run through VIBE: converts
+only new or changed pose outputs into the array store, in parallel, and appends new windows to the
+compiled window indexes, such that the time taken is proportional to the new data.
+'''
+
+import argparse
+import multiprocessing as mp
+import os
+import time
+
+import musclesinaction.dataloader.data as data
+import musclesinaction.dataloader.store as store
+import musclesinaction.dataloader.validate as validate
+import musclesinaction.dataloader.windows as windows
+
+
+def is_stale(entry, stamp, pose_source):
+    '''
+    :param entry (dict): Manifest entry of the video, or None.
+    :param stamp (dict): Current store.source_stamp() of its pose output.
+    '''
+    if entry is None or entry.get('pose_source', 'vibe') != pose_source \
+            or 'source' not in entry:
+        return True
+    if 'md5' in stamp and 'md5' in entry['source']:
+        return stamp['md5'] != entry['source']['md5']
+    return (stamp['size'], stamp['mtime']) != \
+        (entry['source']['size'], entry['source']['mtime'])
+
+
+def _ingest_video(job):
+    '''
+    Converts (and precomputes) one video; runs in a worker process.
+    :param job (tuple): (video, store_root, vibe_root, pose_source, encodings, precompute, stamp).
+    :return (video, manifest entry, seconds).
+    '''
+    (video, store_root, vibe_root, pose_source, encodings, precompute, stamp) = job
+    start_time = time.time()
+    entry = store.convert_video(video, store_root, vibe_root, pose_source, encodings)
+    if precompute and pose_source == 'vibe':
+        entry['fields'].update(store.precompute_video(video, store_root))
+    entry['source'] = stamp
+    return (video, entry, time.time() - start_time)
+
+
+def ingest(videos, store_root, vibe_root=store.VIBE_ROOT, pose_source='vibe', encodings=None,
+           precompute=False, content_hash=False, num_procs=None):
+    '''
+    Converts the videos whose pose outputs are missing from or changed since the array store.
+    :param videos (list of str): Candidate video names.
+    :param num_procs (int): Worker processes; all CPUs if None.
+    :return (list of str): Converted videos.
+    '''
+    os.makedirs(store_root, exist_ok=True)
+    manifest = store.load_manifest(store_root)
+    manifest['vibe_root'] = vibe_root
+
+    jobs = []
+    for video in videos:
+        stamp = store.source_stamp(video, pose_source, vibe_root, content_hash)
+        entry = manifest['videos'].get(video)
+        if is_stale(entry, stamp, pose_source):
+            jobs.append((video, store_root, vibe_root, pose_source, encodings, precompute, stamp))
+        elif entry['source'] != stamp:
+            # Same contents, only touched.
+            entry['source'] = stamp
+    print(f'{len(jobs)} / {len(videos)} videos are new or changed')
+
+    converted = []
+    if len(jobs) != 0:
+        with mp.Pool(min(num_procs or os.cpu_count(), len(jobs))) as pool:
+            for (video, entry, seconds) in pool.imap_unordered(_ingest_video, jobs):
+                manifest['videos'][video] = entry
+                converted.append(video)
+                # Save progress after every video, such that an interrupted ingest resumes.
+                store.save_manifest(store_root, manifest)
+                print(f'Converted {video} in {seconds:.3f}s')
+        store.write_encoding_report(store_root, manifest)
+    store.save_manifest(store_root, manifest)
+    return converted
+
+
+def append_windows(new_txt_path, txt_path):
+    '''
+    Appends the window lines of new recordings to a window text file, skipping lines that it
+    already holds.
+    :return (int): Number of appended lines.
+    '''
+    with open(txt_path, 'rb') as f:
+        contents = f.read()
+    existing = set(line for line in contents.split(b'\n') if line.strip())
+    needs_newline = len(contents) != 0 and not contents.endswith(b'\n')
+    with open(new_txt_path, 'rb') as f:
+        lines = [line.rstrip(b'\n') for line in f
+                 if line.strip() and line.rstrip(b'\n') not in existing]
+    if len(lines) != 0:
+        with open(txt_path, 'ab') as f:
+            if needs_newline:
+                f.write(b'\n')
+            f.write(b'\n'.join(lines) + b'\n')
+    return len(lines)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store_root', required=True)
+    parser.add_argument('--vibe_root', default=store.VIBE_ROOT)
+    parser.add_argument('--pose_source', default='vibe',
+                        choices=list(store.POSE_SOURCE_FIELDS.keys()))
+    parser.add_argument('--videos', nargs='*', default=None,
+                        help='Video names to consider; all VIBE outputs if omitted.')
+    parser.add_argument('--encoding', default='float32', choices=store.ENCODINGS,
+                        help='Encoding of all fields of newly converted videos.')
+    parser.add_argument('--precompute', action='store_true',
+                        help='Also store normalized 2D keypoints of newly converted videos.')
+    parser.add_argument('--content_hash', action='store_true',
+                        help='Detect changes by md5 of the pose outputs instead of size / mtime.')
+    parser.add_argument('--num_procs', type=int, default=None)
+    parser.add_argument('--txt_paths', nargs='*', default=[],
+                        help='Window text files (e.g. train6.txt) whose indexes to update.')
+    parser.add_argument('--new_windows', nargs='*', default=[],
+                        help='Window text files of the new recordings, appended to the single '
+                             'file given by --txt_paths.')
+    parser.add_argument('--video_set', default='all',
+                        help='Determines the text file layout, see configs/videosets.yaml.')
+    parser.add_argument('--validate', action='store_true',
+                        help='Rerun dataloader/validate.py on the updated text files.')
+    ingest_args = parser.parse_args()
+
+    start_time = time.time()
+    videos = ingest_args.videos
+    if not videos:
+        output_dir = os.path.join(ingest_args.vibe_root, 'output')
+        videos = sorted(fn for fn in os.listdir(output_dir)
+                        if os.path.exists(store.pose_output_path(fn, ingest_args.pose_source,
+                                                                 ingest_args.vibe_root)))
+    encodings = {field: ingest_args.encoding
+                 for field in store.POSE_SOURCE_FIELDS[ingest_args.pose_source]}
+    ingest(videos, ingest_args.store_root, ingest_args.vibe_root, ingest_args.pose_source,
+           encodings, ingest_args.precompute, ingest_args.content_hash, ingest_args.num_procs)
+
+    video_set_info = data.load_video_set(ingest_args.video_set)
+    missing = [video for video in videos if video not in video_set_info['videos']]
+    if len(missing) != 0:
+        print(f'Not yet in video set {ingest_args.video_set} (configs/videosets.yaml): '
+              f'{", ".join(missing)}')
+
+    if len(ingest_args.new_windows) != 0:
+        assert len(ingest_args.txt_paths) == 1, 'Give exactly one text file to append to'
+        for new_txt_path in ingest_args.new_windows:
+            num_lines = append_windows(new_txt_path, ingest_args.txt_paths[0])
+            print(f'Appended {num_lines} lines of {new_txt_path} to {ingest_args.txt_paths[0]}')
+    for txt_path in ingest_args.txt_paths:
+        windows.append_window_index(txt_path, int(video_set_info['stride']),
+                                    int(video_set_info['num_emg']))
+        if ingest_args.validate:
+            validate.validate(txt_path, ingest_args.video_set, ingest_args.store_root,
+                              num_procs=ingest_args.num_procs)
+
+    print(f'Ingest took {time.time() - start_time:.3f}s')
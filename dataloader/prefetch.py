@@ -0,0 +1,140 @@
+'''
+Background prefetching of data loader batches, such that loading, collation and host-to-device
+copies overlap with model compute.
+'''
+
+import queue
+import threading
+import time
+
+import torch
+
+
+class BatchPrefetcher(object):
+    '''
+    Iterable wrapper around a DataLoader that keeps num_batches batches ready on a background thread,
+    already converted to the target dtype and device.
+    '''
+
+    def __init__(self, data_loader, device, num_batches=2, dtype=torch.float32,
+                 batch_transform=None):
+        '''
+        :param data_loader: Any iterable of batch dicts.
+        :param device (torch.device): Device to move every tensor to.
+        :param num_batches (int): Number of converted batches to keep ready.
+        :param dtype (torch.dtype): Floating point tensors are cast to this; integer tensors (e.g.
+            video_id, frame_idx) keep their dtype. None to leave all dtypes alone.
+        :param batch_transform: Applied to every converted batch dict on the device (and stream) it
+            was copied to, e.g. batched GPU augmentations.
+        '''
+        self.data_loader = data_loader
+        self.device = torch.device(device)
+        self.num_batches = max(int(num_batches), 1)
+        self.dtype = dtype
+        self.batch_transform = batch_transform
+        # Data-wait time (seconds) of every step of the current / last epoch.
+        self.wait_times = []
+
+    def __len__(self):
+        return len(self.data_loader)
+
+    def _convert(self, value):
+        # Copies only overlap with compute for tensors that the DataLoader already pinned
+        # (pin_memory=True).
+        if isinstance(value, torch.Tensor):
+            if self.dtype is not None and value.is_floating_point():
+                return value.to(self.device, self.dtype, non_blocking=True)
+            return value.to(self.device, non_blocking=True)
+        if isinstance(value, dict):
+            return {key: self._convert(item) for (key, item) in value.items()}
+        return value
+
+    def _worker(self, batch_queue, stop_event):
+        stream = torch.cuda.Stream(self.device) if self.device.type == 'cuda' else None
+        try:
+            for batch in self.data_loader:
+                if stream is not None:
+                    with torch.cuda.stream(stream):
+                        batch = self._convert(batch)
+                        if self.batch_transform is not None:
+                            batch = self.batch_transform(batch)
+                        ready = torch.cuda.Event()
+                        ready.record(stream)
+                    batch = (batch, ready)
+                else:
+                    batch = self._convert(batch)
+                    if self.batch_transform is not None:
+                        batch = self.batch_transform(batch)
+                while not stop_event.is_set():
+                    try:
+                        batch_queue.put(('batch', batch), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop_event.is_set():
+                    return
+            batch_queue.put(('done', None))
+        except Exception as e:
+            # Re-raised in the main thread by __iter__().
+            batch_queue.put(('error', e))
+
+    def __iter__(self):
+        self.wait_times = []
+        batch_queue = queue.Queue(maxsize=self.num_batches)
+        stop_event = threading.Event()
+        thread = threading.Thread(target=self._worker, args=(batch_queue, stop_event), daemon=True)
+        thread.start()
+
+        try:
+            while True:
+                start_time = time.time()
+                (kind, item) = batch_queue.get()
+                if kind == 'done':
+                    break
+                if kind == 'error':
+                    raise item
+                self.wait_times.append(time.time() - start_time)
+                if self.device.type == 'cuda':
+                    (item, ready) = item
+                    self._hand_over(item, ready)
+                yield item
+
+        finally:
+            # Also reached when the loop breaks early, e.g. when cutting epochs short.
+            stop_event.set()
+            while thread.is_alive():
+                try:
+                    batch_queue.get_nowait()
+                except queue.Empty:
+                    pass
+                thread.join(timeout=0.1)
+
+    def _record_stream(self, value, stream):
+        if isinstance(value, torch.Tensor) and value.is_cuda:
+            value.record_stream(stream)
+        elif isinstance(value, dict):
+            for item in value.values():
+                self._record_stream(item, stream)
+
+    def _hand_over(self, batch, ready):
+        '''
+        Makes the consumer's stream wait for the copies of one batch (without blocking the host),
+        and tells the caching allocator that its tensors are in use there, such that their memory
+        is not handed back to the copy stream before the consumer's kernels are done with them.
+        '''
+        current = torch.cuda.current_stream(self.device)
+        current.wait_event(ready)
+        self._record_stream(batch, current)
+
+    @property
+    def last_wait(self):
+        return self.wait_times[-1] if len(self.wait_times) != 0 else 0.0
+
+    def wait_stats(self):
+        '''
+        :return (dict): Total and mean data-wait time and number of steps of the current / last
+            epoch.
+        '''
+        total = sum(self.wait_times)
+        return {'steps': len(self.wait_times), 'total': total,
+                'mean': total / max(len(self.wait_times), 1)}
@@ -0,0 +1,662 @@
+'''
+Preprocessed, memory-mapped storage of per-video pose estimation (VIBE / AlphaPose) outputs.
+'''
+
+import argparse
+import collections
+import copy
+import ctypes
+import gc
+import hashlib
+import json
+import mmap
+import os
+import time
+import zlib
+
+import joblib
+import numpy as np
+import torch
+
+import musclesinaction.utils.projection as projection
+
+
+VIBE_ROOT = '../../../vondrick/mia/VIBE/'
+ALPHAPOSE_ROOT = '../squatdataset/'
+STORE_FIELDS = ['joints3d', 'joints2d_img_coord', 'bboxes', 'pred_cam', 'orig_cam', 'verts']
+# Store fields provided by each pose source.
+POSE_SOURCE_FIELDS = {'vibe': STORE_FIELDS, 'alphapose': ['joints2d_img_coord']}
+# Fields derived from the pose estimation output by precompute_store(), per pose source.
+PRECOMPUTED_FIELDS = {'vibe': ['twodkpts_norm'], 'alphapose': []}
+# AlphaPose (Halpe, 26 keypoints) indices of the 25 OpenPose joints in VIBE's joints2d order.
+ALPHAPOSE_TO_OPENPOSE = [0, 18, 6, 8, 10, 5, 7, 9, 19, 19, 14, 16, 19, 13, 15, 2, 1, 4, 3, 20, 22,
+                         24, 21, 23, 25]
+MANIFEST_NAME = 'manifest.json'
+ENCODING_REPORT_NAME = 'encoding_report.json'
+# float32 keeps the arrays as VIBE wrote them; int16 is quantized per channel (last axis).
+ENCODINGS = ['float32', 'float16', 'int16']
+
+# Pose outputs read by this process, see load_pose_shared(), and the shared memory tensors behind
+# the registered arrays that share_video() replaced, by id of the array.
+_POSE_REGISTRY = dict()
+_SHARED_REGISTRY = dict()
+
+
+def video_key(video):
+    '''
+    :param video (str): Video name, for example IMG_2419_30.MOV.
+    :return (str): Short key that windows use to refer to this video, for example 2419.
+    '''
+    return video.split("_")[1]
+
+
+def video_id(key):
+    '''
+    :param key (str): Video key, see video_key().
+    :return (int): Integer id carried by samples instead of frame path strings. This is the IMG
+        number itself for IMG_<number>_30.MOV videos, and a stable negative id otherwise.
+    '''
+    if key.isdigit():
+        return int(key)
+    return -(zlib.crc32(key.encode()) & 0x7fffffff) - 1
+
+
+def vibe_output_path(video, vibe_root=VIBE_ROOT):
+    return os.path.join(vibe_root, 'output', video, 'vibe_output.pkl')
+
+
+def alphapose_output_path(video, alphapose_root=ALPHAPOSE_ROOT):
+    return os.path.join(alphapose_root, video.replace(".", "_"), 'alphapose-results.json')
+
+
+def pose_output_path(video, pose_source='vibe', vibe_root=VIBE_ROOT):
+    if pose_source == 'alphapose':
+        return alphapose_output_path(video)
+    assert pose_source == 'vibe', pose_source
+    return vibe_output_path(video, vibe_root)
+
+
+def source_stamp(video, pose_source='vibe', vibe_root=VIBE_ROOT, content_hash=False):
+    '''
+    :param content_hash (bool): Also hash the contents of the pose output, such that files that
+        were only touched (e.g. copied) are not converted again.
+    :return (dict): Size, mtime and optionally md5 of the pose output of one video.
+    '''
+    path = pose_output_path(video, pose_source, vibe_root)
+    stat = os.stat(path)
+    stamp = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    if content_hash:
+        md5 = hashlib.md5()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2 ** 24), b''):
+                md5.update(block)
+        stamp['md5'] = md5.hexdigest()
+    return stamp
+
+
+def pose_stamps(videos, pose_source='vibe', vibe_root=VIBE_ROOT):
+    '''
+    :return (dict): Maps every video to the source_stamp() of its pose output, or None if missing.
+    '''
+    return {video: source_stamp(video, pose_source, vibe_root)
+            if os.path.exists(pose_output_path(video, pose_source, vibe_root)) else None
+            for video in videos}
+
+
+def load_alphapose(video, alphapose_root=ALPHAPOSE_ROOT):
+    '''
+    :return (dict): AlphaPose keypoints of every frame as joints2d_img_coord (N, 25, 2), reordered
+        to match VIBE.
+    '''
+    with open(alphapose_output_path(video, alphapose_root)) as f:
+        total = json.load(f)
+    keypoints = np.array([frame['keypoints'] for frame in total], dtype=np.float32)
+    keypoints = keypoints.reshape(len(total), 26, 3)[:, :, :2]
+    return {'joints2d_img_coord': np.ascontiguousarray(keypoints[:, ALPHAPOSE_TO_OPENPOSE])}
+
+
+def load_pose(video, pose_source='vibe', vibe_root=VIBE_ROOT, person_id=1):
+    '''
+    Reads the original (pickle or json) pose estimation output of one video.
+    :param pose_source (str): vibe / alphapose.
+    :param person_id (int): Tracked VIBE person to keep.
+    :return (dict): Maps every field of POSE_SOURCE_FIELDS[pose_source] to its per-frame array.
+    '''
+    if pose_source == 'alphapose':
+        return load_alphapose(video)
+    assert pose_source == 'vibe', pose_source
+    return joblib.load(vibe_output_path(video, vibe_root))[person_id]
+
+
+def load_pose_shared(video, fields, pose_source='vibe', vibe_root=VIBE_ROOT, person_id=1):
+    '''
+    Same as load_pose(), but restricted to fields (which may include PRECOMPUTED_FIELDS). Every
+    output file is read only once per process for the same fields (until it changes on disk), all
+    callers get the same read-only arrays, and the fields that nobody asked for are dropped right
+    after reading. Data loader workers forked afterwards inherit the registry.
+    :param fields (list of str): Store fields to keep.
+    :return (dict): Maps every field to its per-frame array.
+    '''
+    path = os.path.abspath(pose_output_path(video, pose_source, vibe_root))
+    key = (path, os.path.getmtime(path), pose_source, person_id)
+    if key not in _POSE_REGISTRY:
+        # Drop entries of older versions of the same file.
+        for old_key in [old_key for old_key in _POSE_REGISTRY if old_key[0] == path]:
+            del _POSE_REGISTRY[old_key]
+        _POSE_REGISTRY[key] = dict()
+    arrays = _POSE_REGISTRY[key]
+    missing = [field for field in fields if field not in arrays]
+    if len(missing) != 0:
+        total = load_pose(video, pose_source, vibe_root, person_id)
+        if 'twodkpts_norm' in missing:
+            total = dict(total, twodkpts_norm=compute_twodkpts_norm(total))
+        for field in missing:
+            array = np.ascontiguousarray(total[field])
+            array.flags.writeable = False
+            arrays[field] = array
+    return {field: arrays[field] for field in fields}
+
+
+def clear_pose_registry():
+    _POSE_REGISTRY.clear()
+    _SHARED_REGISTRY.clear()
+
+
+class EncodedArray(object):
+    '''
+    Read-only view of a float16 or int16 store array that decodes to float32 when indexed, such
+    that only the gathered rows are ever decoded. Indexing must not select along the last axis,
+    which holds the quantization channels.
+    '''
+
+    def __init__(self, data, quant=None):
+        '''
+        :param data: Encoded (memory-mapped) array.
+        :param quant (2, C) array: Per-channel scale and offset for int16, None for float16.
+        '''
+        self.data = data
+        self.quant = quant
+        self.shape = data.shape
+        self.ndim = data.ndim
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self):
+        return len(self.data)
+
+    def _decode(self, values):
+        values = np.asarray(values).astype(np.float32)
+        if self.quant is not None:
+            values = values * self.quant[0] + self.quant[1]
+        return values
+
+    def __getitem__(self, key):
+        return self._decode(self.data[key])
+
+    def __array__(self, dtype=None, copy=None):
+        values = self._decode(self.data)
+        return values if dtype is None else values.astype(dtype)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + (0 if self.quant is None else self.quant.nbytes)
+
+
+def encode_array(array, encoding):
+    '''
+    :param encoding (str): One of ENCODINGS.
+    :return (data, quant): Encoded array, and for int16 the (2, C) float32 per-channel scale and
+        offset such that array ~= data * scale + offset.
+    '''
+    if encoding == 'float32':
+        return (np.ascontiguousarray(array), None)
+    if encoding == 'float16':
+        return (np.ascontiguousarray(array, dtype=np.float16), None)
+    assert encoding == 'int16', encoding
+    channels = np.asarray(array, dtype=np.float64).reshape(-1, array.shape[-1])
+    (lo, hi) = (channels.min(axis=0), channels.max(axis=0))
+    scale = (hi - lo) / 65535.0
+    scale[scale == 0] = 1.0
+    quant = np.stack([scale, lo + 32768.0 * scale]).astype(np.float32)
+    data = np.round((np.asarray(array, dtype=np.float64) - quant[1]) / quant[0])
+    return (np.clip(data, -32768, 32767).astype(np.int16), quant)
+
+
+def decode_array(data, quant=None):
+    if data.dtype == np.float16 or quant is not None:
+        return np.asarray(EncodedArray(data, quant))
+    return data
+
+
+def _max_error(array, decoded):
+    diff = np.abs(np.asarray(decoded, dtype=np.float64) - np.asarray(array, dtype=np.float64))
+    diff = diff[np.isfinite(diff)]
+    return float(diff.max()) if diff.size != 0 else 0.0
+
+
+def projection_error(arrays, decoded):
+    '''
+    :return (float): Max difference in pixels between the 2D keypoints projected from the original
+        and from the decoded joints3d, bboxes and pred_cam.
+    '''
+    diff = (compute_twodkpts_norm(decoded) - compute_twodkpts_norm(arrays)) * \
+        np.array([projection.IMG_W, projection.IMG_H], dtype=np.float32)
+    diff = np.abs(diff[np.isfinite(diff)])
+    return float(diff.max()) if diff.size != 0 else 0.0
+
+
+def encoding_errors(arrays):
+    '''
+    Measures what every encoding would cost for one video, without writing anything.
+    :param arrays (dict): Original (float) arrays of one video.
+    :return (dict): Maps encoding to {field: max abs error, 'projection_px': max pixel error when
+        all of joints3d, bboxes and pred_cam use that encoding}.
+    '''
+    errors = dict()
+    for encoding in ENCODINGS[1:]:
+        decoded = {field: decode_array(*encode_array(array, encoding))
+                   for (field, array) in arrays.items()}
+        errors[encoding] = {field: _max_error(arrays[field], decoded[field]) for field in arrays}
+        if all(field in arrays for field in ['joints3d', 'bboxes', 'pred_cam']):
+            errors[encoding]['projection_px'] = projection_error(arrays, decoded)
+    return errors
+
+
+def convert_video(video, store_root, vibe_root=VIBE_ROOT, pose_source='vibe', encodings=None):
+    '''
+    Converts the pose estimation output of one video into one .npy file per field.
+    :param video (str): Video name, for example IMG_2419_30.MOV.
+    :param store_root (str): Folder to write the array store to.
+    :param vibe_root (str): Folder containing output/<video>/vibe_output.pkl.
+    :param pose_source (str): vibe / alphapose.
+    :param encodings (dict): Maps field to one of ENCODINGS; float32 for missing fields.
+    :return (dict): Manifest entry describing the written arrays.
+    '''
+    # Stamped before reading, such that changes during the conversion are picked up next time.
+    source = source_stamp(video, pose_source, vibe_root)
+    person = load_pose(video, pose_source, vibe_root)
+    fields = POSE_SOURCE_FIELDS[pose_source]
+    encodings = encodings or dict()
+    video_dir = os.path.join(store_root, video)
+    os.makedirs(video_dir, exist_ok=True)
+
+    entry = {'key': video_key(video), 'num_frames': int(len(person[fields[0]])),
+             'pose_source': pose_source, 'source': source, 'fields': dict()}
+    arrays = {field: np.asarray(person[field]) for field in fields}
+    decoded = dict()
+    for field in fields:
+        encoding = encodings.get(field, 'float32')
+        if encoding != 'float32' and not np.all(np.isfinite(arrays[field])):
+            # NaNs would not survive quantization and could hide invalid windows.
+            print(f'{video} {field} has non-finite values, keeping float32')
+            encoding = 'float32'
+        (array, quant) = encode_array(arrays[field], encoding)
+        np.save(os.path.join(video_dir, field + '.npy'), array)
+        quant_fp = os.path.join(video_dir, field + '.quant.npy')
+        if quant is not None:
+            np.save(quant_fp, quant)
+        elif os.path.exists(quant_fp):
+            os.remove(quant_fp)
+        decoded[field] = decode_array(array, quant)
+        entry['fields'][field] = {'shape': list(array.shape), 'dtype': str(array.dtype),
+                                  'encoding': encoding,
+                                  'max_error': _max_error(arrays[field], decoded[field])}
+    if pose_source == 'vibe':
+        entry['projection_px_error'] = projection_error(arrays, decoded)
+
+    return entry
+
+
+def compute_twodkpts_norm(arrays):
+    '''
+    :param arrays (dict): joints3d, bboxes and pred_cam of one video.
+    :return (N, 25, 2) float32 array: Normalized 2D keypoints of every frame, exactly as fed to
+        my_model by MyTrainPipeline.
+    '''
+    with torch.no_grad():
+        twodkpts = projection.normalized_keypoints(
+            torch.from_numpy(np.asarray(arrays['joints3d'][:, :25], dtype=np.float32))[None],
+            torch.from_numpy(np.asarray(arrays['bboxes'], dtype=np.float32))[None],
+            torch.from_numpy(np.asarray(arrays['pred_cam'], dtype=np.float32))[None])
+    return np.ascontiguousarray(twodkpts[0].numpy(), dtype=np.float32)
+
+
+def precompute_video(video, store_root):
+    '''
+    Adds the PRECOMPUTED_FIELDS of one already converted video to the array store.
+    :return (dict): Manifest entries of the written arrays.
+    '''
+    arrays = open_video(store_root, video, ['joints3d', 'bboxes', 'pred_cam'])
+    array = compute_twodkpts_norm(arrays)
+    np.save(os.path.join(store_root, video, 'twodkpts_norm.npy'), array)
+    return {'twodkpts_norm': {'shape': list(array.shape), 'dtype': str(array.dtype)}}
+
+
+def load_manifest(store_root):
+    manifest_fp = os.path.join(store_root, MANIFEST_NAME)
+    if not os.path.exists(manifest_fp):
+        return {'vibe_root': VIBE_ROOT, 'videos': dict()}
+    with open(manifest_fp) as f:
+        return json.load(f)
+
+
+def save_manifest(store_root, manifest):
+    # Write to a temporary file first such that readers never see a partial manifest.
+    manifest_fp = os.path.join(store_root, MANIFEST_NAME)
+    with open(manifest_fp + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_fp + '.tmp', manifest_fp)
+
+
+def build_store(videos, store_root, vibe_root=VIBE_ROOT, pose_source='vibe', encodings=None):
+    '''
+    One-time conversion of VIBE pickles (or AlphaPose json) into the memory-mappable array store.
+    :param videos (list of str): Video names to convert.
+    :param store_root (str): Folder to write the array store and manifest to.
+    :param vibe_root (str): Folder containing output/<video>/vibe_output.pkl.
+    :param pose_source (str): vibe / alphapose.
+    :param encodings (dict): Maps field to one of ENCODINGS, see convert_video().
+    :return manifest (dict).
+    '''
+    os.makedirs(store_root, exist_ok=True)
+    manifest = load_manifest(store_root)
+    manifest['vibe_root'] = vibe_root
+
+    for video in videos:
+        start_time = time.time()
+        manifest['videos'][video] = convert_video(
+            video, store_root, vibe_root, pose_source, encodings)
+        print(f'Converted {video} in {time.time() - start_time:.3f}s')
+
+    save_manifest(store_root, manifest)
+    write_encoding_report(store_root, manifest)
+    return manifest
+
+
+def write_encoding_report(store_root, manifest):
+    '''
+    Summarizes the max decoding error of every field over all videos in the store, and the max
+    projection error in pixels.
+    '''
+    report = {'fields': dict(), 'projection_px_error': 0.0}
+    for entry in manifest['videos'].values():
+        for (field, info) in entry['fields'].items():
+            if 'encoding' not in info:
+                continue
+            summary = report['fields'].setdefault(field, {'encodings': [], 'max_error': 0.0})
+            if info['encoding'] not in summary['encodings']:
+                summary['encodings'].append(info['encoding'])
+            summary['max_error'] = max(summary['max_error'], info['max_error'])
+        report['projection_px_error'] = max(report['projection_px_error'],
+                                            entry.get('projection_px_error', 0.0))
+
+    with open(os.path.join(store_root, ENCODING_REPORT_NAME), 'w') as f:
+        json.dump(report, f, indent=2)
+    for (field, summary) in report['fields'].items():
+        print(f'{field} ({"/".join(summary["encodings"])}): max error {summary["max_error"]:.6g}')
+    print(f'Projection: max error {report["projection_px_error"]:.4f}px')
+    return report
+
+
+def precompute_store(videos, store_root):
+    '''
+    Offline precompute stage: stores everything that only depends on the static VIBE outputs (see
+    PRECOMPUTED_FIELDS), such that training does not recompute it every step.
+    :return manifest (dict).
+    '''
+    manifest = load_manifest(store_root)
+    for video in videos:
+        entry = manifest['videos'].get(video)
+        if entry is None or entry.get('pose_source', 'vibe') != 'vibe':
+            print(f'Skipping {video}, no converted VIBE outputs in {store_root}')
+            continue
+        start_time = time.time()
+        entry['fields'].update(precompute_video(video, store_root))
+        print(f'Precomputed {video} in {time.time() - start_time:.3f}s')
+
+    save_manifest(store_root, manifest)
+    return manifest
+
+
+def has_video(store_root, video, fields=None):
+    if fields is None:
+        fields = STORE_FIELDS
+    return all(os.path.exists(os.path.join(store_root, video, field + '.npy')) for field in fields)
+
+
+def open_video(store_root, video, fields=None, mmap_mode='r'):
+    '''
+    Opens the arrays of one video without reading them into memory. Pages are loaded on demand
+    and shared between processes through the OS page cache.
+    :param fields (list of str): Subset of STORE_FIELDS to open, or None for all.
+    :return (dict): Maps field name to (memory-mapped) array, or EncodedArray for float16 / int16
+        fields, which decode to float32 when indexed.
+    '''
+    if fields is None:
+        fields = STORE_FIELDS
+    video_dir = os.path.join(store_root, video)
+    arrays = dict()
+    for field in fields:
+        array = np.load(os.path.join(video_dir, field + '.npy'), mmap_mode=mmap_mode)
+        quant_fp = os.path.join(video_dir, field + '.quant.npy')
+        if os.path.exists(quant_fp):
+            array = EncodedArray(array, np.load(quant_fp))
+        elif array.dtype == np.float16:
+            array = EncodedArray(array)
+        arrays[field] = array
+    return arrays
+
+
+def share_video(arrays):
+    '''
+    Copies the arrays of one video into shared memory once, such that data loader workers attach
+    to the same pages instead of holding private copies. Arrays from load_pose_shared() are
+    replaced by views of their shared copy in the registry, such that the original is released.
+    :return (dict): Maps field name to a shared torch tensor. Use shared_to_numpy() for arrays.
+    '''
+    tensors = dict()
+    for (field, array) in arrays.items():
+        if id(array) in _SHARED_REGISTRY and _SHARED_REGISTRY[id(array)][0] is array:
+            tensors[field] = _SHARED_REGISTRY[id(array)][1]
+            continue
+        # Filled in place, since a temporary copy would stay in the heap of this process.
+        dtype = torch.from_numpy(np.empty(0, dtype=array.dtype)).dtype
+        tensors[field] = torch.empty(array.shape, dtype=dtype).share_memory_()
+        tensors[field].numpy()[...] = array
+        for registered in _POSE_REGISTRY.values():
+            for (name, value) in list(registered.items()):
+                if value is array:
+                    view = tensors[field].numpy()
+                    view.flags.writeable = False
+                    registered[name] = view
+                    # Keeping the view alive here keeps its id unique.
+                    _SHARED_REGISTRY[id(view)] = (view, tensors[field])
+    return tensors
+
+
+def release_heap():
+    '''
+    Returns freed heap memory to the OS (glibc only), e.g. the unpickled originals of arrays that
+    share_video() copied. glibc otherwise keeps them, and forked workers inherit them.
+    '''
+    gc.collect()
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def shared_to_numpy(tensors):
+    # Zero-copy views; every array keeps its tensor (and thus the shared segment) alive.
+    return {field: tensor.numpy() for (field, tensor) in tensors.items()}
+
+
+class MemmapHandle(object):
+    '''
+    Picklable reference to a read-only np.memmap over a whole file. Pickling the memmap itself
+    would copy all of its pages into the pickle; this reopens the file on the other side instead.
+    '''
+
+    def __init__(self, array):
+        self.filename = array.filename
+        self.dtype = array.dtype
+        self.shape = array.shape
+        self.offset = array.offset
+        self.order = 'F' if array.flags.f_contiguous and not array.flags.c_contiguous else 'C'
+
+    @staticmethod
+    def is_mapped(value):
+        # Views into a mapping carry the offset of their parent, so only whole mappings qualify.
+        return isinstance(value, np.memmap) and isinstance(value.base, mmap.mmap) \
+            and value.filename is not None
+
+    def open(self):
+        return np.memmap(self.filename, self.dtype, 'r', self.offset, self.shape, self.order)
+
+
+def pack_arrays(value):
+    '''
+    Replaces every memory-mapped array within value (dicts, lists, tuples, EncodedArray,
+    VideoCache) by a MemmapHandle, such that value is cheap to send to data loader workers.
+    '''
+    if MemmapHandle.is_mapped(value):
+        return MemmapHandle(value)
+    if isinstance(value, dict):
+        return type(value)((key, pack_arrays(item)) for (key, item) in value.items())
+    if type(value) in (list, tuple):
+        return type(value)(pack_arrays(item) for item in value)
+    if isinstance(value, (EncodedArray, VideoCache)):
+        packed = copy.copy(value)
+        packed.__dict__ = pack_arrays(value.__dict__)
+        return packed
+    return value
+
+
+def unpack_arrays(value):
+    '''
+    Inverse of pack_arrays().
+    '''
+    if isinstance(value, MemmapHandle):
+        return value.open()
+    if isinstance(value, dict):
+        return type(value)((key, unpack_arrays(item)) for (key, item) in value.items())
+    if type(value) in (list, tuple):
+        return type(value)(unpack_arrays(item) for item in value)
+    if isinstance(value, (EncodedArray, VideoCache)):
+        value.__dict__ = unpack_arrays(value.__dict__)
+    return value
+
+
+def video_nbytes(arrays):
+    return sum(array.nbytes for array in arrays.values()
+               if isinstance(array, (np.ndarray, EncodedArray)))
+
+
+class VideoCache(object):
+    '''
+    Dictionary-like cache that loads per-video arrays on first access and evicts the least recently
+    used videos once the total size exceeds a byte budget.
+    '''
+
+    def __init__(self, load_fn, max_bytes):
+        '''
+        :param load_fn: Maps a video key to its dict of arrays.
+        :param max_bytes (int): Budget across all cached videos. The most recently used video is
+            always kept, even if it alone exceeds the budget.
+        '''
+        self.load_fn = load_fn
+        self.max_bytes = int(max_bytes)
+        self.entries = collections.OrderedDict()
+        self.sizes = dict()
+        self.cur_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, key):
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        self.misses += 1
+        value = self.load_fn(key)
+        size = video_nbytes(value)
+        while len(self.entries) != 0 and self.cur_bytes + size > self.max_bytes:
+            (old_key, _) = self.entries.popitem(last=False)
+            self.cur_bytes -= self.sizes.pop(old_key)
+            self.evictions += 1
+
+        self.entries[key] = value
+        self.sizes[key] = size
+        self.cur_bytes += size
+        return value
+
+    def stats(self):
+        '''
+        NOTE: Counters are per process, so every data loader worker keeps its own.
+        '''
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'videos': len(self.entries), 'bytes': self.cur_bytes}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store_root', required=True)
+    parser.add_argument('--vibe_root', default=VIBE_ROOT)
+    parser.add_argument('--pose_source', default='vibe', choices=list(POSE_SOURCE_FIELDS.keys()))
+    parser.add_argument('--videos', nargs='*', default=None,
+                        help='Video names to convert; all VIBE outputs if omitted.')
+    parser.add_argument('--precompute', action='store_true',
+                        help='Also store normalized 2D keypoints after converting.')
+    parser.add_argument('--skip_convert', action='store_true',
+                        help='Only run the precompute stage on already converted videos.')
+    parser.add_argument('--encoding', default='float32', choices=ENCODINGS,
+                        help='Encoding of all fields.')
+    parser.add_argument('--field_encodings', nargs='*', default=[],
+                        help='Per-field overrides, for example verts=int16 joints3d=float16.')
+    parser.add_argument('--error_report', action='store_true',
+                        help='Only measure the max error of every encoding, without converting.')
+    store_args = parser.parse_args()
+
+    videos = store_args.videos
+    if not videos:
+        output_dir = os.path.join(store_args.vibe_root, 'output')
+        videos = sorted(fn for fn in os.listdir(output_dir)
+                        if os.path.exists(pose_output_path(fn, store_args.pose_source,
+                                                           store_args.vibe_root)))
+
+    encodings = {field: store_args.encoding for field in POSE_SOURCE_FIELDS[store_args.pose_source]}
+    for override in store_args.field_encodings:
+        (field, encoding) = override.split('=')
+        assert encoding in ENCODINGS, encoding
+        encodings[field] = encoding
+
+    if store_args.error_report:
+        errors = dict()
+        for video in videos:
+            person = load_pose(video, store_args.pose_source, store_args.vibe_root)
+            for (encoding, video_errors) in encoding_errors(
+                    {field: np.asarray(person[field])
+                     for field in POSE_SOURCE_FIELDS[store_args.pose_source]}).items():
+                for (field, error) in video_errors.items():
+                    errors.setdefault(encoding, dict())
+                    errors[encoding][field] = max(errors[encoding].get(field, 0.0), error)
+        os.makedirs(store_args.store_root, exist_ok=True)
+        with open(os.path.join(store_args.store_root, 'encoding_errors.json'), 'w') as f:
+            json.dump(errors, f, indent=2)
+        for (encoding, field_errors) in errors.items():
+            for (field, error) in field_errors.items():
+                print(f'{encoding:>8} {field:>20}: {error:.6g}')
+
+    elif not store_args.skip_convert:
+        build_store(videos, store_args.store_root, store_args.vibe_root, store_args.pose_source,
+                    encodings)
+    if store_args.precompute or store_args.skip_convert:
+        precompute_store(videos, store_args.store_root)
@@ -0,0 +1,155 @@
+'''
+Build-time validation of every window of a window text file. Writes a per-frame validity mask
+next to the text file, which MyMuscleDataset uses to skip invalid windows up front, plus a report
+with counts per failure reason and per video.
+'''
+
+import argparse
+import collections
+import json
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+
+import musclesinaction.dataloader.data as data
+import musclesinaction.dataloader.store as store
+import musclesinaction.dataloader.windows as windows
+
+
+REASONS = ['video_not_in_set', 'video_unreadable', 'pickle_frame_out_of_range', 'zero_bbox',
+           'bad_pred_cam', 'bad_joints', 'bad_emg']
+
+
+def _load_arrays(video, pose_source, cache_root):
+    fields = ['joints3d', 'bboxes', 'pred_cam'] if pose_source == 'vibe' \
+        else ['joints2d_img_coord']
+    if cache_root and store.has_video(cache_root, video, fields):
+        return store.open_video(cache_root, video, fields)
+    total = store.load_pose(video, pose_source)
+    return {field: total[field] for field in fields}
+
+
+def _validate_video(job):
+    '''
+    Checks all rows of one video; runs in a worker process.
+    :param job (tuple): (video, pose_source, cache_root, pickle_frames (N, W), emg (N, W, E)).
+    :return (video, valid (N, W) bool array, counts (dict)).
+    '''
+    (video, pose_source, cache_root, pickle_frames, emg) = job
+    valid = np.ones(pickle_frames.shape, dtype=bool)
+    counts = collections.Counter()
+
+    def _mark(reason, invalid):
+        counts[reason] += int(np.sum(invalid & valid))
+        valid[invalid] = False
+
+    if video is None:
+        _mark('video_not_in_set', np.ones_like(valid))
+        return (video, valid, dict(counts))
+    try:
+        arrays = _load_arrays(video, pose_source, cache_root)
+    except Exception as e:
+        print(f'Could not read {video}: {e}')
+        _mark('video_unreadable', np.ones_like(valid))
+        return (video, valid, dict(counts))
+
+    num_frames = len(next(iter(arrays.values())))
+    _mark('pickle_frame_out_of_range', (pickle_frames < 0) | (pickle_frames >= num_frames))
+    frames = np.clip(pickle_frames, 0, num_frames - 1)
+
+    if pose_source == 'vibe':
+        bboxes = np.asarray(arrays['bboxes'])[frames]
+        _mark('zero_bbox', ~np.all(np.isfinite(bboxes), axis=-1) | ~(bboxes[..., 2] > 0))
+        # convert_pare_to_full_img_cam() divides by the scale, i.e. pred_cam[:, 0].
+        pred_cam = np.asarray(arrays['pred_cam'])[frames]
+        _mark('bad_pred_cam', ~np.all(np.isfinite(pred_cam), axis=-1) | (pred_cam[..., 0] == 0))
+        joints = np.asarray(arrays['joints3d'])[frames][..., :25, :]
+        _mark('bad_joints', ~np.all(np.isfinite(joints), axis=(-2, -1)))
+    else:
+        joints = np.asarray(arrays['joints2d_img_coord'])[frames]
+        _mark('bad_joints', ~np.all(np.isfinite(joints), axis=(-2, -1)))
+
+    _mark('bad_emg', ~np.all(np.isfinite(emg), axis=-1))
+    return (video, valid, dict(counts))
+
+
+def validate(txt_path, video_set='all', cache_root='', windowing='index', num_procs=None):
+    '''
+    Validates all windows (index) or frames (sliding, i.e. the timeline) of a text file in
+    parallel, one video per job, and saves the validity mask and report.
+    :param windowing (str): index / sliding, see MyMuscleDataset.
+    :param num_procs (int): Worker processes; all CPUs if None.
+    :return report (dict).
+    '''
+    start_time = time.time()
+    video_set_info = data.load_video_set(video_set)
+    key_to_video = {store.video_key(video): video for video in video_set_info['videos']}
+    (index, meta) = windows.load_window_index(
+        txt_path, int(video_set_info['stride']), int(video_set_info['num_emg']))
+    if windowing == 'sliding':
+        rows = windows.load_timeline(txt_path, index, meta)
+        (videos, pickle_frames, emg) = (np.asarray(rows['video']),
+                                        np.asarray(rows['pickle_frame'])[:, None],
+                                        np.asarray(rows['emg'])[:, None])
+        prefix = txt_path + '.timeline'
+    else:
+        assert windowing == 'index', windowing
+        (videos, pickle_frames, emg) = (np.asarray(index['video']),
+                                        np.asarray(index['pickle_frame']),
+                                        np.asarray(index['emg']))
+        prefix = txt_path + '.idx'
+
+    jobs = []
+    selections = []
+    for vid in np.unique(videos):
+        sel = np.flatnonzero(videos == vid)
+        key = meta['videos'][vid].split("/")[-1].split("_")[1]
+        jobs.append((key_to_video.get(key), video_set_info['pose_source'], cache_root,
+                     pickle_frames[sel], emg[sel]))
+        selections.append((meta['videos'][vid], sel))
+
+    mask = np.ones(pickle_frames.shape, dtype=bool)
+    totals = collections.Counter()
+    per_video = dict()
+    with mp.Pool(num_procs) as pool:
+        for ((name, sel), (_, valid, counts)) in zip(selections, pool.imap(_validate_video, jobs)):
+            mask[sel] = valid
+            totals.update(counts)
+            per_video[name] = {'rows': int(len(sel)), 'invalid_rows': int(np.sum(~valid.all(axis=1))),
+                               **counts}
+
+    row_valid = mask.all(axis=1)
+    report = {'source': meta['source'],
+              'poses': store.pose_stamps(video_set_info['videos'], video_set_info['pose_source']),
+              'video_set': video_set, 'windowing': windowing,
+              'rows': int(len(row_valid)), 'valid_rows': int(np.sum(row_valid)),
+              'invalid_frames': {reason: int(totals.get(reason, 0)) for reason in REASONS},
+              'videos': per_video, 'seconds': time.time() - start_time}
+    (mask_fp, report_fp) = windows.validity_paths(prefix)
+    np.save(mask_fp, mask)
+    with open(report_fp, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f'{report["valid_rows"]} / {report["rows"]} rows of {txt_path} valid '
+          f'({report["seconds"]:.3f}s)')
+    for reason in REASONS:
+        if report['invalid_frames'][reason] != 0:
+            print(f'  {reason}: {report["invalid_frames"][reason]} frames')
+    return report
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('txt_paths', nargs='+', help='Window text files, e.g. train6.txt.')
+    parser.add_argument('--video_set', default='all')
+    parser.add_argument('--cache_path', default='', help='Array store built by store.py.')
+    parser.add_argument('--windowing', default='index', choices=['index', 'sliding'])
+    parser.add_argument('--num_procs', type=int, default=None)
+    validate_args = parser.parse_args()
+
+    for txt_path in validate_args.txt_paths:
+        validate(txt_path, validate_args.video_set, validate_args.cache_path,
+                 validate_args.windowing, validate_args.num_procs)
@@ -0,0 +1,416 @@
+'''
+Compiled binary index of the training windows listed in the text files (e.g. train6.txt).
+'''
+
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+
+# Every line is "<frames dir>,<pickle path>," followed by one record of STRIDE fields per frame:
+# three frame numbers, three pickle frame references and the EMG values.
+STRIDE = 17
+NUM_EMG = 8
+FRAME_OFFSET = 0
+PICKLE_OFFSET = 3
+EMG_OFFSET = 6
+
+
+def window_dtype(width, num_emg=NUM_EMG):
+    return np.dtype([('video', np.int32),
+                     ('frame', np.int32, (width,)),
+                     ('pickle_frame', np.int32, (width,)),
+                     ('emg', np.float32, (width, num_emg))])
+
+
+def _line_width(fields, stride, num_emg):
+    # Number of complete frame records on this line.
+    return (len(fields) - 2 - EMG_OFFSET - num_emg) // stride + 1
+
+
+def _index_paths(txt_path):
+    return (txt_path + '.idx.npy', txt_path + '.idx.json')
+
+
+def _source_stamp(txt_path):
+    stat = os.stat(txt_path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def _save_array(array_fp, array):
+    # Data loader workers may still memory-map the previous file, so never overwrite it in place:
+    # write to a temporary file first and replace the old one with it.
+    with open(array_fp + '.tmp', 'wb') as f:
+        np.save(f, array)
+    os.replace(array_fp + '.tmp', array_fp)
+
+
+def _tail_digest(txt_path, size, num_bytes=4096):
+    # Fingerprint of the last bytes of the first size bytes, to tell appends from other edits.
+    with open(txt_path, 'rb') as f:
+        f.seek(max(size - num_bytes, 0))
+        return hashlib.md5(f.read(min(size, num_bytes))).hexdigest()
+
+
+def _parse_windows(lines, width, stride, num_emg, videos, pickles):
+    '''
+    :param lines (list of str): Non-empty window lines.
+    :param videos, pickles (list of str): Video folders and pickle paths that the video column
+        refers to; unseen ones are appended in place.
+    :return index: Structured array with one row per line.
+    '''
+    index = np.zeros(len(lines), dtype=window_dtype(width, num_emg))
+    video_ids = {video: i for (i, video) in enumerate(videos)}
+    (video_col, frame_col, pickle_col, emg_col) = \
+        (index['video'], index['frame'], index['pickle_frame'], index['emg'])
+    for (i, line) in enumerate(lines):
+        fields = line.rstrip('\n').split(',')
+        if fields[0] not in video_ids:
+            video_ids[fields[0]] = len(videos)
+            videos.append(fields[0])
+            pickles.append(fields[1])
+        video_col[i] = video_ids[fields[0]]
+        for j in range(width):
+            base = 2 + j * stride
+            frame_col[i, j] = int(fields[base + FRAME_OFFSET])
+            pickle_col[i, j] = int(fields[base + PICKLE_OFFSET].split('/')[-1])
+            emg_col[i, j] = [float(v) for v in
+                             fields[base + EMG_OFFSET:base + EMG_OFFSET + num_emg]]
+    return index
+
+
+def compile_window_index(txt_path, stride=STRIDE, num_emg=NUM_EMG):
+    '''
+    Parses every line of a window text file exactly once.
+    :param txt_path (str): Text file with one window per line.
+    :param stride (int): Number of comma-separated fields per frame.
+    :param num_emg (int): Number of EMG channels to keep per frame.
+    :return (index, meta): Structured array with one row per window, and a dict holding the
+        video folders that the video column refers to.
+    '''
+    # First pass only counts lines and finds the shortest window, so we can preallocate.
+    num_windows = 0
+    width = None
+    with open(txt_path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            fields = line.rstrip('\n').split(',')
+            width = _line_width(fields, stride, num_emg) if width is None \
+                else min(width, _line_width(fields, stride, num_emg))
+            num_windows += 1
+
+    source = _source_stamp(txt_path)
+    videos = []
+    pickles = []
+    with open(txt_path) as f:
+        index = _parse_windows([line for line in f if line.strip()], width or 0, stride, num_emg,
+                               videos, pickles)
+    assert len(index) == num_windows
+
+    meta = {'videos': videos, 'pickles': pickles, 'width': int(width or 0), 'stride': stride,
+            'num_emg': num_emg, 'source': source,
+            'tail': _tail_digest(txt_path, source['size'])}
+    return (index, meta)
+
+
+def append_window_index(txt_path, stride=STRIDE, num_emg=NUM_EMG):
+    '''
+    Brings the saved index of a window text file up to date by parsing only the lines appended
+    since it was compiled, falling back to load_window_index() (i.e. a full compile) if the text
+    file was changed in any other way.
+    :return (index, meta): See compile_window_index().
+    '''
+    (index_fp, meta_fp) = _index_paths(txt_path)
+    source = _source_stamp(txt_path)
+    meta = None
+    if os.path.exists(index_fp) and os.path.exists(meta_fp):
+        with open(meta_fp) as f:
+            meta = json.load(f)
+    old_size = meta['source']['size'] if meta is not None else 0
+    if meta is None or meta['source'] == source or meta['stride'] != stride \
+            or meta['num_emg'] != num_emg or old_size == 0 or source['size'] < old_size \
+            or meta.get('tail') != _tail_digest(txt_path, old_size):
+        return load_window_index(txt_path, stride, num_emg)
+
+    start_time = time.time()
+    with open(txt_path, 'rb') as f:
+        f.seek(old_size - 1)
+        appended = f.read()
+    if not appended.startswith(b'\n'):
+        # The last old line was extended rather than new lines appended.
+        return load_window_index(txt_path, stride, num_emg)
+    lines = [line for line in appended[1:].decode().split('\n') if line.strip()]
+    widths = [_line_width(line.split(','), stride, num_emg) for line in lines]
+    if len(widths) != 0 and min(widths) < meta['width']:
+        # Shorter windows shrink the width of the whole index.
+        return load_window_index(txt_path, stride, num_emg)
+
+    new_index = _parse_windows(lines, meta['width'], stride, num_emg, meta['videos'],
+                               meta['pickles'])
+    index = np.concatenate([np.load(index_fp), new_index])
+    meta['source'] = source
+    meta['tail'] = _tail_digest(txt_path, source['size'])
+    _save_array(index_fp, index)
+    with open(meta_fp, 'w') as f:
+        json.dump(meta, f)
+    print(f'Appended {len(new_index)} windows to the index of {txt_path} '
+          f'in {time.time() - start_time:.3f}s')
+    return (np.load(index_fp, mmap_mode='r'), meta)
+
+
+def load_window_index(txt_path, stride=STRIDE, num_emg=NUM_EMG):
+    '''
+    Returns the compiled index of a window text file, memory-mapped such that all data loader
+    workers share the same pages. The index is (re)compiled and saved next to the text file
+    whenever it is missing or older than the text file.
+    :return (index, meta): See compile_window_index().
+    '''
+    (index_fp, meta_fp) = _index_paths(txt_path)
+
+    if os.path.exists(index_fp) and os.path.exists(meta_fp):
+        with open(meta_fp) as f:
+            meta = json.load(f)
+        if meta['source'] == _source_stamp(txt_path) and meta['stride'] == stride \
+                and meta['num_emg'] == num_emg:
+            return (np.load(index_fp, mmap_mode='r'), meta)
+
+    start_time = time.time()
+    (index, meta) = compile_window_index(txt_path, stride, num_emg)
+    print(f'Compiled {len(index)} windows of {txt_path} in {time.time() - start_time:.3f}s')
+
+    try:
+        _save_array(index_fp, index)
+        with open(meta_fp, 'w') as f:
+            json.dump(meta, f)
+        index = np.load(index_fp, mmap_mode='r')
+    except OSError as e:
+        # Read-only dataset folder; keep the index in memory instead.
+        print(f'Could not save window index next to {txt_path}: {e}')
+
+    return (index, meta)
+
+
+def timeline_dtype(num_emg=NUM_EMG):
+    return np.dtype([('video', np.int32),
+                     ('frame', np.int32),
+                     ('pickle_frame', np.int32),
+                     ('emg', np.float32, (num_emg,))])
+
+
+def compile_timeline(index, num_emg=NUM_EMG):
+    '''
+    Flattens the (overlapping) windows of an index into one row per distinct frame of every video.
+    :param index: Structured array returned by load_window_index().
+    :return (timeline): Structured array sorted by video and frame number.
+    '''
+    width = index['frame'].shape[1]
+    videos = np.repeat(np.asarray(index['video'], dtype=np.int64), width)
+    frames = np.asarray(index['frame'], dtype=np.int64).reshape(-1)
+    keys = (videos << 32) | frames
+    (_, first) = np.unique(keys, return_index=True)
+
+    timeline = np.zeros(len(first), dtype=timeline_dtype(num_emg))
+    timeline['video'] = videos[first]
+    timeline['frame'] = frames[first]
+    timeline['pickle_frame'] = np.asarray(index['pickle_frame']).reshape(-1)[first]
+    timeline['emg'] = np.asarray(index['emg']).reshape(-1, num_emg)[first]
+    return timeline
+
+
+def load_timeline(txt_path, index, meta):
+    '''
+    Returns the memory-mapped per-frame timeline of a window text file, compiling it from the
+    window index and saving it next to the text file if needed.
+    '''
+    timeline_fp = txt_path + '.timeline.npy'
+    stamp_fp = txt_path + '.timeline.json'
+    if os.path.exists(timeline_fp) and os.path.exists(stamp_fp):
+        with open(stamp_fp) as f:
+            if json.load(f) == meta['source']:
+                return np.load(timeline_fp, mmap_mode='r')
+
+    timeline = compile_timeline(index, meta['num_emg'])
+    try:
+        _save_array(timeline_fp, timeline)
+        with open(stamp_fp, 'w') as f:
+            json.dump(meta['source'], f)
+        timeline = np.load(timeline_fp, mmap_mode='r')
+    except OSError as e:
+        print(f'Could not save timeline next to {txt_path}: {e}')
+
+    return timeline
+
+
+def load_emg_bins(prefix, emg, source, bins):
+    '''
+    Returns np.digitize() of the raw EMG values of an index or timeline, memory-mapped from
+    prefix + '.bins.npy' and recomputed whenever the text file or the bin edges change.
+    :param prefix (str): For example txt_path + '.idx' or txt_path + '.timeline'.
+    :param emg: emg column of the index or timeline.
+    :param source (dict): Stamp of the text file, see meta['source'].
+    :param bins (array): Bin edges.
+    :return (array): uint8 array of the same shape as emg.
+    '''
+    bins_fp = prefix + '.bins.npy'
+    stamp_fp = prefix + '.bins.json'
+    stamp = {'source': source, 'bins': [float(edge) for edge in bins]}
+    if os.path.exists(bins_fp) and os.path.exists(stamp_fp):
+        with open(stamp_fp) as f:
+            if json.load(f) == stamp:
+                return np.load(bins_fp, mmap_mode='r')
+
+    emg_bins = np.digitize(np.asarray(emg), bins).astype(np.uint8)
+    try:
+        _save_array(bins_fp, emg_bins)
+        with open(stamp_fp, 'w') as f:
+            json.dump(stamp, f)
+        emg_bins = np.load(bins_fp, mmap_mode='r')
+    except OSError as e:
+        print(f'Could not save EMG bins next to {prefix}: {e}')
+
+    return emg_bins
+
+
+def validity_paths(prefix):
+    return (prefix + '.valid.npy', prefix + '.valid.json')
+
+
+def validity_stamp(prefix):
+    '''
+    :return (dict or None): Size and mtime of the validity mask of prefix, if there is one, such
+        that caches derived from the valid windows notice re-validation.
+    '''
+    (mask_fp, _) = validity_paths(prefix)
+    return _source_stamp(mask_fp) if os.path.exists(mask_fp) else None
+
+
+def load_validity(prefix, source, poses):
+    '''
+    :param prefix (str): txt_path + '.idx' for the index or txt_path + '.timeline' for the timeline.
+    :param source (dict): Stamp of the text file, see meta['source'].
+    :param poses (dict): Current store.pose_stamps() of the videos of the video set.
+    :return (array or None): (rows, width) boolean mask written by dataloader/validate.py, or None
+        if there is none for the current version of the text file and pose outputs.
+    '''
+    (mask_fp, report_fp) = validity_paths(prefix)
+    if not (os.path.exists(mask_fp) and os.path.exists(report_fp)):
+        return None
+    with open(report_fp) as f:
+        report = json.load(f)
+    if report['source'] != source:
+        print(f'Ignoring validity mask of {prefix}, the text file changed since validation')
+        return None
+    if report.get('poses') != poses:
+        print(f'Ignoring validity mask of {prefix}, pose outputs changed since validation')
+        return None
+    return np.load(mask_fp, mmap_mode='r')
+
+
+def stratified_subset(videos, activation, percent, num_levels=5, seed=0):
+    '''
+    Picks a fraction of the windows such that every (video, activation level) stratum keeps its
+    share, and at least one window.
+    :param videos (N,) array: Video of every window.
+    :param activation (N,) array: Mean EMG value of every window.
+    :param percent (float): Fraction of the windows to keep.
+    :param num_levels (int): Number of activation quantiles to stratify on.
+    :param seed (int): Which windows of a stratum are kept.
+    :return (array): Sorted indices of the selected windows.
+    '''
+    edges = np.quantile(activation, np.linspace(0, 1, num_levels + 1)[1:-1]) \
+        if len(activation) != 0 else []
+    levels = np.digitize(activation, edges)
+    strata = np.asarray(videos, dtype=np.int64) * num_levels + levels
+    rng = np.random.default_rng(seed)
+    selected = []
+    for stratum in np.unique(strata):
+        members = np.flatnonzero(strata == stratum)
+        quota = max(1, int(round(len(members) * percent)))
+        selected.append(rng.choice(members, quota, replace=False))
+    if len(selected) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.sort(np.concatenate(selected))
+
+
+def load_subset(prefix, stamp, videos, activation, percent, seed=0):
+    '''
+    Returns stratified_subset(), cached next to the text file under a name derived from stamp.
+    :param prefix (str): For example txt_path + '.idx' or txt_path + '.timeline'.
+    :param stamp (dict): Everything that determines the candidate windows, e.g. the source stamp of
+        the text file, the windowing arguments and the validity_stamp().
+    '''
+    stamp = dict(stamp, percent=float(percent), seed=int(seed), num_windows=int(len(videos)))
+    tag = hashlib.md5(json.dumps(stamp, sort_keys=True).encode()).hexdigest()[:12]
+    subset_fp = f'{prefix}.subset_{tag}.npy'
+    if os.path.exists(subset_fp):
+        return np.load(subset_fp)
+
+    subset = stratified_subset(videos, activation, percent, seed=seed)
+    print(f'Selected {len(subset)} / {len(videos)} windows of {prefix} '
+          f'({len(np.unique(np.asarray(videos)[subset]))} videos)')
+    try:
+        _save_array(subset_fp, subset)
+    except OSError as e:
+        print(f'Could not save window subset next to {prefix}: {e}')
+    return subset
+
+
+class SlidingWindows(object):
+    '''
+    Windows built at runtime from contiguous runs of a per-frame timeline, such that window length,
+    overlap and temporal decimation can change without regenerating the text files.
+    '''
+
+    def __init__(self, timeline, step, stride=1, decimate=1):
+        '''
+        :param timeline: Structured array returned by load_timeline().
+        :param step (int): Number of frames per window.
+        :param stride (int): Timeline rows between the starts of consecutive windows, e.g. step for
+            non-overlapping windows with decimate 1.
+        :param decimate (int): Keep every decimate-th frame within a window.
+        '''
+        self.timeline = timeline
+        self.step = int(step)
+        self.stride = int(stride)
+        self.decimate = int(decimate)
+        self.span = (self.step - 1) * self.decimate + 1
+
+        # Split the timeline into runs of consecutive frames of the same video.
+        videos = np.asarray(timeline['video'])
+        frames = np.asarray(timeline['frame'])
+        breaks = np.flatnonzero((np.diff(videos) != 0) | (np.diff(frames) != 1)) + 1
+        run_starts = np.concatenate([[0], breaks])
+        run_ends = np.concatenate([breaks, [len(timeline)]])
+
+        starts = [np.arange(a, b - self.span + 1, self.stride)
+                  for (a, b) in zip(run_starts, run_ends) if b - a >= self.span]
+        self.starts = np.concatenate(starts) if len(starts) != 0 else np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        '''
+        :return (video, frame, pickle_frame, emg): Strided views into the timeline (no copies).
+        '''
+        start = self.starts[i]
+        rows = self.timeline[start:start + self.span:self.decimate]
+        return (rows['video'][0], rows['frame'], rows['pickle_frame'], rows['emg'])
+
+    def rows(self, indices):
+        '''
+        :return (len(indices), step) array: Timeline rows that make up every window.
+        '''
+        return self.starts[indices][:, None] + np.arange(self.step) * self.decimate
+
+    def batch(self, indices):
+        '''
+        :return (video, frame, pickle_frame, emg): Same as __getitem__(), stacked over indices with
+            a single gather into the timeline.
+        '''
+        windows = self.timeline[self.rows(indices)]
+        return (windows['video'][:, 0], windows['frame'], windows['pickle_frame'], windows['emg'])
@@ -4,6 +4,9 @@ import torch
 import musclesinaction.configs.args as args
 import vis.logvis as logvis
 import musclesinaction.dataloader.data as data
+import musclesinaction.dataloader.prefetch as prefetch
+import musclesinaction.dataloader.store as store
+import musclesinaction.utils.projection as projection
 import time
 import os
 import random
@@ -14,47 +17,6 @@ import musclesinaction.models.model as model
 import musclesinaction.models.basicconv as convmodel
 
 
-def perspective_projection(points, rotation, translation,
-                        focal_length, camera_center):
-
-    batch_size = points.shape[0]
-    K = torch.zeros([batch_size, 3, 3], device=points.device)
-    K[:,0,0] = focal_length
-    K[:,1,1] = focal_length
-    K[:,2,2] = 1.
-    K[:,:-1, -1] = camera_center
-
-    # Transform points
-    points = torch.einsum('bij,bkj->bki', rotation, points)
-    points = points + translation.unsqueeze(1)
-
-    # Apply perspective distortion
-    projected_points = points / points[:,:,-1].unsqueeze(-1)
-
-    # Apply camera intrinsics
-    projected_points = torch.einsum('bij,bkj->bki', K, projected_points)
-
-    return projected_points[:, :, :-1], points
-
-def convert_pare_to_full_img_cam(
-        pare_cam, bbox_height, bbox_center,
-        img_w, img_h, focal_length, crop_res=224):
-    # Converts weak perspective camera estimated by PARE in
-    # bbox coords to perspective camera in full image coordinates
-    # from https://arxiv.org/pdf/2009.06549.pdf
-    s, tx, ty = pare_cam[:, 0], pare_cam[:, 1], pare_cam[:, 2]
-    res = 224
-    r = bbox_height / res
-    tz = 2 * focal_length / (r * res * s)
-
-    cx = 2 * (bbox_center[:, 0] - (img_w / 2.)) / (s * bbox_height)
-    cy = 2 * (bbox_center[:, 1] - (img_h / 2.)) / (s * bbox_height)
-
-    cam_t = torch.stack([tx + cx, ty + cy, tz], dim=-1)
-
-    return cam_t
-
-
 class NearestNeighbor(object):
     def __init__(self):
         pass
@@ -136,13 +98,17 @@ def main(args, logger):
     logger.info('Initializing data loaders...')
     start_time = time.time()
     (train_loader, train_loader_noshuffle, val_aug_loader, val_noaug_loader, dset_args) = \
-        data.create_train_val_data_loaders(args, logger)
+        data.create_train_val_data_loaders(args, logger, fields=data.train_fields(args))
 
     list_of_resultsnn = []
     list_of_results = []
     list_of_resultsnn = []
     (train_loader, train_loader_noshuffle, val_aug_loader, val_noaug_loader, dset_args) = \
-    data.create_train_val_data_loaders(args, logger)
+    data.create_train_val_data_loaders(args, logger, fields=data.train_fields(args))
+    if int(args.prefetch) > 0:
+        # Everything below runs on the host, so only overlap loading and collation.
+        train_loader = prefetch.BatchPrefetcher(train_loader, 'cpu', int(args.prefetch))
+        val_aug_loader = prefetch.BatchPrefetcher(val_aug_loader, 'cpu', int(args.prefetch))
 
     
     total_emg_train = []
@@ -153,6 +119,7 @@ def main(args, logger):
         trainpath= args.data_path_train #= trainpath
         ignoremovie = trainpath
         ignoremovie = ignoremovie.split("/")[-1].split(".txt")[0].split("_")[2]
+        ignore_id = store.video_id(ignoremovie)
 
         list_of_train_emg = []
         list_of_train_skeleton = []
@@ -164,28 +131,9 @@ def main(args, logger):
 
         for cur_step, data_retval in enumerate(tqdm.tqdm(train_loader)):
             
-            if ignoremovie in data_retval['frame_paths'][0][0]: 
-                threedskeleton = data_retval['3dskeleton']
-                bboxes = data_retval['bboxes']
-                predcam = data_retval['predcam']
-                proj = 5000.0
-                
-                #pdb.set_trace()
-                height= bboxes[:,:,2:3].reshape(bboxes.shape[0]*bboxes.shape[1])
-                center = bboxes[:,:,:2].reshape(bboxes.shape[0]*bboxes.shape[1],-1)
-                focal=torch.tensor([[proj]]).repeat(height.shape[0],1)
-                predcamelong = predcam.reshape(predcam.shape[0]*predcam.shape[1],-1)
-                translation = convert_pare_to_full_img_cam(predcamelong,height,center,1080,1920,focal[:,0])
-                reshapethreed= threedskeleton.reshape(threedskeleton.shape[0]*threedskeleton.shape[1],threedskeleton.shape[2],threedskeleton.shape[3])
-                rotation=torch.unsqueeze(torch.eye(3),dim=0).repeat(reshapethreed.shape[0],1,1)
-                focal=torch.tensor([[proj]]).repeat(translation.shape[0],1)
-                imgdimgs=torch.unsqueeze(torch.tensor([1080.0/2, 1920.0/2]),dim=0).repeat(reshapethreed.shape[0],1)
-                twodkpts, skeleton = perspective_projection(reshapethreed, rotation, translation.float(),focal[:,0], imgdimgs)
-                twodkpts = twodkpts.reshape(threedskeleton.shape[0],int(args.step),twodkpts.shape[1],twodkpts.shape[2])
-                divide = torch.unsqueeze(torch.unsqueeze(torch.unsqueeze(torch.tensor([1080.0,1920.0]),dim=0),dim=0),dim=0).repeat(twodkpts.shape[0],twodkpts.shape[1],twodkpts.shape[2],1)
-
-                twodkpts = twodkpts/divide
-                #twodkpts = twodkpts.reshape(threedskeleton.shape[0],twodkpts.shape[1],-1)
+            if int(data_retval['video_id'][0]) == ignore_id: 
+                twodkpts = projection.batch_keypoints(data_retval, args.precomputed)
+                #twodkpts = twodkpts.reshape(twodkpts.shape[0],twodkpts.shape[1],-1)
                 emggroundtruth = data_retval['emg_values']
                 emggroundtruth = emggroundtruth/100.0
                 list_of_train_emg.append(emggroundtruth.reshape(-1).numpy())
@@ -195,26 +143,9 @@ def main(args, logger):
 
         for cur_step, data_retval in enumerate(tqdm.tqdm(val_aug_loader)):
 
-                if ignoremovie in data_retval['frame_paths'][0][0]: 
-
-                    threedskeleton = data_retval['3dskeleton']
-                    bboxes = data_retval['bboxes']
-                    predcam = data_retval['predcam']
-                    proj = 5000.0
-                
-                    height= bboxes[:,:,2:3].reshape(bboxes.shape[0]*bboxes.shape[1])
-                    center = bboxes[:,:,:2].reshape(bboxes.shape[0]*bboxes.shape[1],-1)
-                    focal=torch.tensor([[proj]]).repeat(height.shape[0],1)
-                    predcamelong = predcam.reshape(predcam.shape[0]*predcam.shape[1],-1)
-                    translation = convert_pare_to_full_img_cam(predcamelong,height,center,1080,1920,focal[:,0])
-                    reshapethreed= threedskeleton.reshape(threedskeleton.shape[0]*threedskeleton.shape[1],threedskeleton.shape[2],threedskeleton.shape[3])
-                    rotation=torch.unsqueeze(torch.eye(3),dim=0).repeat(reshapethreed.shape[0],1,1)
-                    focal=torch.tensor([[proj]]).repeat(translation.shape[0],1)
-                    imgdimgs=torch.unsqueeze(torch.tensor([1080.0/2, 1920.0/2]),dim=0).repeat(reshapethreed.shape[0],1)
-                    twodkpts, skeleton = perspective_projection(reshapethreed, rotation, translation.float(),focal[:,0], imgdimgs)
-                    twodkpts = twodkpts.reshape(threedskeleton.shape[0],int(args.step),twodkpts.shape[1],twodkpts.shape[2])
-                    divide = torch.unsqueeze(torch.unsqueeze(torch.unsqueeze(torch.tensor([1080.0,1920.0]),dim=0),dim=0),dim=0).repeat(twodkpts.shape[0],twodkpts.shape[1],twodkpts.shape[2],1)
-                    twodkpts = twodkpts/divide
+                if int(data_retval['video_id'][0]) == ignore_id: 
+
+                    twodkpts = projection.batch_keypoints(data_retval, args.precomputed)
                     
                     emggroundtruth = data_retval['emg_values']
                     emggroundtruth = emggroundtruth/100.0
@@ -231,6 +162,11 @@ def main(args, logger):
         np_val_emg = np.array(list_of_val_emg_notleft)
         msel = torch.nn.MSELoss()
         print(msel(torch.tensor(np_train_emg)*100,torch.tensor(np_val_emg)*100),trainpath)
+        if int(args.prefetch) > 0:
+            for (name, loader) in [('train', train_loader), ('val', val_aug_loader)]:
+                wait_stats = loader.wait_stats()
+                logger.info(f'{name}: waited {wait_stats["total"]:.3f}s for data over '
+                            f'{wait_stats["steps"]} steps')
 
 
 #TRAIN SKELETON MATRIX FLATTENED OVER TIME 
@@ -47,7 +47,8 @@ class PositionalEncoding(nn.Module):
     def forward(self, token_embedding: torch.tensor) -> torch.tensor:
         # Residual connection + pos encoding
         #pdb.set_trace()
-        return self.dropout(token_embedding + self.pos_encoding)
+        # Windows may be shorter than max_len, e.g. early in a window length curriculum.
+        return self.dropout(token_embedding + self.pos_encoding[:, :token_embedding.size(1)])
 
 class TransformerEnc(nn.Module):
     """
@@ -46,7 +46,8 @@ class PositionalEncoding(nn.Module):
         
     def forward(self, token_embedding: torch.tensor) -> torch.tensor:
         # Residual connection + pos encoding
-        return self.dropout(token_embedding + self.pos_encoding[:,:,:])
+        # Windows may be shorter than max_len, e.g. early in a window length curriculum.
+        return self.dropout(token_embedding + self.pos_encoding[:, :token_embedding.size(1)])
 
 class MyLayer(torch.nn.Module):
     def __init__(self, dim_model,num_heads):
@@ -113,7 +114,8 @@ class TransformerEnc(nn.Module):
         num_decoder_layers,
         dropout_p,
         device,
-        embedding
+        embedding,
+        step=30
     ):
         super().__init__()
 
@@ -125,7 +127,7 @@ class TransformerEnc(nn.Module):
 
         # LAYERS
         self.positional_encoder_time = PositionalEncoding(
-            dim_model=dim_model, dropout_p=dropout_p, max_len=30
+            dim_model=dim_model, dropout_p=dropout_p, max_len=int(step)
         )
 
         self.positional_encoder_space = PositionalEncoding(
@@ -4,6 +4,8 @@ import torch
 import musclesinaction.configs.args as args
 import vis.logvis as logvis
 import musclesinaction.dataloader.data as data
+import musclesinaction.utils.projection as projection
+import musclesinaction.dataloader.store as store
 import time
 import os
 import random
@@ -14,48 +16,6 @@ import musclesinaction.models.model as transmodel
 import musclesinaction.models.basicconv as convmodel
 
 
-def perspective_projection(points, rotation, translation,
-                        focal_length, camera_center):
-
-    batch_size = points.shape[0]
-    K = torch.zeros([batch_size, 3, 3], device=points.device)
-    K[:,0,0] = focal_length
-    K[:,1,1] = focal_length
-    K[:,2,2] = 1.
-    K[:,:-1, -1] = camera_center
-
-    # Transform points
-    #pdb.set_trace()
-    points = torch.einsum('bij,bkj->bki', rotation, points)
-    points = points + translation.unsqueeze(1)
-
-    # Apply perspective distortion
-    projected_points = points / points[:,:,-1].unsqueeze(-1)
-
-    # Apply camera intrinsics
-    projected_points = torch.einsum('bij,bkj->bki', K, projected_points)
-
-    return projected_points[:, :, :-1], points
-
-def convert_pare_to_full_img_cam(
-        pare_cam, bbox_height, bbox_center,
-        img_w, img_h, focal_length, crop_res=224):
-    # Converts weak perspective camera estimated by PARE in
-    # bbox coords to perspective camera in full image coordinates
-    # from https://arxiv.org/pdf/2009.06549.pdf
-    s, tx, ty = pare_cam[:, 0], pare_cam[:, 1], pare_cam[:, 2]
-    res = 224
-    r = bbox_height / res
-    tz = 2 * focal_length / (r * res * s)
-    #pdb.set_trace()
-    cx = 2 * (bbox_center[:, 0] - (img_w / 2.)) / (s * bbox_height)
-    cy = 2 * (bbox_center[:, 1] - (img_h / 2.)) / (s * bbox_height)
-
-    cam_t = torch.stack([tx + cx, ty + cy, tz], dim=-1)
-
-    return cam_t
-
-
 class NearestNeighbor(object):
     def __init__(self):
         pass
@@ -152,13 +112,13 @@ def main(args, logger):
     logger.info('Initializing data loaders...')
     start_time = time.time()
     (train_loader, train_loader_noshuffle, val_aug_loader, val_noaug_loader, dset_args) = \
-        data.create_train_val_data_loaders(args, logger)
+        data.create_train_val_data_loaders(args, logger, fields=data.train_fields(args))
 
     list_of_resultsnn = []
     list_of_results = []
     list_of_resultsnn = []
     (train_loader, train_loader_noshuffle, val_aug_loader, val_noaug_loader, dset_args) = \
-    data.create_train_val_data_loaders(args, logger)
+    data.create_train_val_data_loaders(args, logger, fields=data.train_fields(args))
 
     
     total_emg_train = []
@@ -173,6 +133,7 @@ def main(args, logger):
         trainpath= args.data_path_train #= trainpath
         ignoremovie = trainpath
         ignoremovie = ignoremovie.split("/")[-1].split(".txt")[0].split("_")[2]
+        ignore_id = store.video_id(ignoremovie)
 
         list_of_train_emg = []
         list_of_train_skeleton = []
@@ -187,28 +148,9 @@ def main(args, logger):
         for cur_step, data_retval in enumerate(tqdm.tqdm(val_aug_loader)):
 
 
-                threedskeleton = data_retval['3dskeleton']
-                bboxes = data_retval['bboxes']
-                predcam = data_retval['predcam']
-                proj = 5000.0
-            
-                height= bboxes[:,:,2:3].reshape(bboxes.shape[0]*bboxes.shape[1])
-                center = bboxes[:,:,:2].reshape(bboxes.shape[0]*bboxes.shape[1],-1)
-                focal=torch.tensor([[proj]]).repeat(height.shape[0],1)
-                predcamelong = predcam.reshape(predcam.shape[0]*predcam.shape[1],-1)
-                translation = convert_pare_to_full_img_cam(predcamelong,height,center,1080,1920,focal[:,0])
-                reshapethreed= threedskeleton.reshape(threedskeleton.shape[0]*threedskeleton.shape[1],threedskeleton.shape[2],threedskeleton.shape[3])
-                rotation=torch.unsqueeze(torch.eye(3),dim=0).repeat(reshapethreed.shape[0],1,1)
-                focal=torch.tensor([[proj]]).repeat(translation.shape[0],1)
-                imgdimgs=torch.unsqueeze(torch.tensor([1080.0/2, 1920.0/2]),dim=0).repeat(reshapethreed.shape[0],1)
-                twodkpts, skeleton = perspective_projection(reshapethreed, rotation, translation.float(),focal[:,0], imgdimgs)
-                
-                twodkpts = twodkpts.reshape(threedskeleton.shape[0],int(args.step),twodkpts.shape[1],twodkpts.shape[2])
-                divide = torch.unsqueeze(torch.unsqueeze(torch.unsqueeze(torch.tensor([1080.0,1920.0]),dim=0),dim=0),dim=0).repeat(twodkpts.shape[0],twodkpts.shape[1],twodkpts.shape[2],1)
-                    
-                twodkpts = twodkpts/divide
+                twodkpts = projection.batch_keypoints(data_retval, args.precomputed)
                 
-                twodkpts = twodkpts.reshape(threedskeleton.shape[0],twodkpts.shape[1],-1)
+                twodkpts = twodkpts.reshape(twodkpts.shape[0],twodkpts.shape[1],-1)
                 emggroundtruth = data_retval['emg_values']
                 emggroundtruth = emggroundtruth/100.0
 
@@ -216,14 +158,14 @@ def main(args, logger):
 
                 emg_output = my_model(twodkpts)
 
-                if ignoremovie in data_retval['frame_paths'][0][0]: 
+                if int(data_retval['video_id'][0]) == ignore_id: 
                     list_of_val_emg.append(torch.sum(emggroundtruth[0],dim=1).numpy())
                     list_of_val_predemg.append(torch.sum(emg_output[0],dim=1).detach().cpu().numpy())
                     list_of_val_skeleton.append(twodkpts.reshape(-1).numpy())
                 else:
                     list_of_train_emg.append(torch.sum(emggroundtruth[0],dim=1).numpy())
                     list_of_train_skeleton.append(twodkpts.reshape(-1).numpy())
-                    list_of_train_class.append(int(data_retval['frame_paths'][0][0].split("/")[-2].split("_")[1]))
+                    list_of_train_class.append(int(data_retval['video_id'][0]))
 
 
         np_train_emg = np.array(list_of_train_emg)
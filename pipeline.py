@@ -10,6 +10,7 @@ import time
 # Internal imports.
 import musclesinaction.losses.loss as loss
 import musclesinaction.utils.utils as utils
+import musclesinaction.utils.projection as projection
 
 
 class MyTrainPipeline(torch.nn.Module):
@@ -102,40 +103,14 @@ class MyTrainPipeline(torch.nn.Module):
             loss_retval (dict): Preliminary loss information (per-example, but not batch-wide).
         '''
         cur = time.time()
-        twodskeleton = data_retval['2dskeleton']
-        twodskeleton = twodskeleton.reshape(twodskeleton.shape[0],twodskeleton.shape[1],-1)
-
-
-        threedskeleton = data_retval['3dskeleton']
-        bboxes = data_retval['bboxes']
-        predcam = data_retval['predcam']
-        proj = 5000.0
-        
-        height= bboxes[:,:,2:3].reshape(bboxes.shape[0]*bboxes.shape[1])
-        center = bboxes[:,:,:2].reshape(bboxes.shape[0]*bboxes.shape[1],-1)
-        focal=torch.tensor([[proj]]).to(self.device).repeat(height.shape[0],1)
-        predcamelong = predcam.reshape(predcam.shape[0]*predcam.shape[1],-1)
-        translation = self.convert_pare_to_full_img_cam(predcamelong,height,center,1080,1920,focal[:,0])
-        reshapethreed= threedskeleton.reshape(threedskeleton.shape[0]*threedskeleton.shape[1],threedskeleton.shape[2],threedskeleton.shape[3])
-        rotation=torch.unsqueeze(torch.eye(3),dim=0).repeat(reshapethreed.shape[0],1,1).to(self.device)
-        focal=torch.tensor([[proj]]).to(self.device).repeat(translation.shape[0],1)
-        imgdimgs=torch.unsqueeze(torch.tensor([1080.0/2, 1920.0/2]),dim=0).repeat(reshapethreed.shape[0],1).to(self.device)
-        twodkpts, skeleton = self.perspective_projection(reshapethreed, rotation, translation.float(),focal[:,0], imgdimgs)
-        #pdb.set_trace()
-        twodkpts = twodkpts.reshape(twodskeleton.shape[0],(self.train_args.step),twodkpts.shape[1],twodkpts.shape[2])
-        divide = torch.unsqueeze(torch.unsqueeze(torch.unsqueeze(torch.tensor([1080.0,1920.0]),dim=0),dim=0),dim=0).repeat(twodkpts.shape[0],twodkpts.shape[1],twodkpts.shape[2],1).to(self.device)
-        twodkpts = twodkpts/divide
-        twodkpts = twodkpts.reshape(twodskeleton.shape[0],twodkpts.shape[1],-1)
+        # (B, T, 25, 2), either precomputed per frame or projected from the VIBE outputs here.
+        twodkpts = projection.batch_keypoints(data_retval, self.train_args.precomputed).to(self.device)
+        twodkpts = twodkpts.reshape(twodkpts.shape[0],twodkpts.shape[1],-1)
     
-        bined_left_quad = data_retval['bined_left_quad']-1
         emggroundtruth = data_retval['emg_values'].to(self.device)
         cond = data_retval['cond'].to(self.device)
         emggroundtruth = emggroundtruth/100.0
 
-        leftquad = data_retval['left_quad'].to(self.device)
-        leftquad = leftquad/100.0
-        leftquad[leftquad > 1.0] = 1.0
-        twodskeleton = twodskeleton.to(self.device)
         twodkpts = torch.unsqueeze(twodkpts.permute(0,2,1),dim=1)
 
         emg_output = self.my_model(twodkpts) 
@@ -144,10 +119,14 @@ class MyTrainPipeline(torch.nn.Module):
 
         
         mask = torch.ones(emg_output.shape).type(torch.cuda.FloatTensor)
-        for i in range(emg_output.shape[0]):                
-            if '2423' in data_retval['frame_paths'][0][i]:
-                mask[i,4,:] = 1.0
-        total_loss = self.mse(emg_output*mask, (emggroundtruth*mask).type(torch.cuda.FloatTensor))
+        mask[data_retval['video_id'].to(mask.device) == 2423, 4, :] = 1.0
+        if self.phase == 'train' and 'sample_weight' in data_retval:
+            # Importance weights of the activation sampler, see data.ActivationSampler.
+            squared = (emg_output*mask - (emggroundtruth*mask).type(torch.cuda.FloatTensor)) ** 2
+            weight = data_retval['sample_weight'].to(self.device)
+            total_loss = torch.mean(squared.mean(dim=(1, 2)) * weight)
+        else:
+            total_loss = self.mse(emg_output*mask, (emggroundtruth*mask).type(torch.cuda.FloatTensor))
 
         model_retval = dict()
         model_retval['emg_output'] = emg_output[:,:,:]
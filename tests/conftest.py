@@ -0,0 +1,19 @@
+'''
+Makes the repo importable as the musclesinaction package, like the training scripts expect.
+'''
+
+import os
+import sys
+import types
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, REPO_ROOT)
+if os.path.basename(REPO_ROOT) == 'musclesinaction':
+    sys.path.insert(0, os.path.dirname(REPO_ROOT))
+elif 'musclesinaction' not in sys.modules:
+    # Checked out under another folder name.
+    package = types.ModuleType('musclesinaction')
+    package.__path__ = [REPO_ROOT]
+    sys.modules['musclesinaction'] = package
@@ -0,0 +1,28 @@
+import torch
+
+import musclesinaction.utils.augs as augs
+
+
+def test_batch_clip_augment_is_consistent_within_clips():
+    torch.manual_seed(0)
+    # Every clip repeats a single frame, so its augmented frames should be identical.
+    frames = torch.randint(0, 256, (6, 1, 32, 24, 3), dtype=torch.uint8)
+    clips = augs.clips_to_tensor(frames.expand(6, 4, 32, 24, 3))
+    augmented = augs.BatchClipAugment(16)(clips)
+
+    assert augmented.shape == (6, 4, 3, 16, 16)
+    torch.testing.assert_close(augmented, augmented[:, :1].expand_as(augmented))
+    # Parameters differ between the clips of a batch.
+    same = augs.BatchClipAugment(16, alphastd=0.0)(clips[:1].expand(6, 4, 3, 32, 24))
+    assert not torch.allclose(same[0], same[1])
+
+
+def test_lighting_matches_eigen_decomposition():
+    torch.manual_seed(0)
+    lighting = augs.Lighting(0.1, torch.tensor([1.0, 2.0, 3.0]), torch.eye(3))
+    img = torch.zeros(3, 4, 4)
+    torch.manual_seed(1)
+    out = lighting(img)
+    torch.manual_seed(1)
+    alpha = torch.randn(3) * 0.1
+    torch.testing.assert_close(out, (alpha * torch.tensor([1.0, 2.0, 3.0])).view(3, 1, 1).expand(3, 4, 4))
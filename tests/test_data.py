@@ -0,0 +1,227 @@
+import argparse
+import glob
+import json
+import logging
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import musclesinaction.dataloader.data as data
+import musclesinaction.dataloader.framesource as framesource
+import musclesinaction.dataloader.framestore as framestore
+import musclesinaction.dataloader.store as store
+import musclesinaction.dataloader.windows as windows
+import musclesinaction.utils.augs as augs
+
+
+LOGGER = logging.getLogger(__name__)
+VIDEO = 'IMG_1234_30.MOV'
+WIDTH = 5
+
+
+NUM_WINDOWS = 4
+
+
+def _write_windows(txt_path, num_windows=NUM_WINDOWS):
+    # Same layout as the generated window text files: video, pickle, then STRIDE fields per frame.
+    lines = []
+    for i in range(num_windows):
+        fields = ['output/' + VIDEO, 'output/' + VIDEO + '/vibe_output.pkl']
+        for j in range(WIDTH):
+            frame = i + j + 1
+            emg = [str(10.0 * channel + frame) for channel in range(windows.NUM_EMG)]
+            record = [str(frame), '0', '0', f'frames/{frame - 1}', '0', '0'] + emg
+            fields += record + ['0'] * (windows.STRIDE - len(record))
+        lines.append(','.join(fields))
+    with open(txt_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+@pytest.fixture
+def txt_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(data, 'load_video_set', lambda name: {
+        'videos': [VIDEO], 'stride': windows.STRIDE, 'num_emg': windows.NUM_EMG,
+        'emg_channels': list(range(windows.NUM_EMG)), 'pose_source': 'vibe', 'len_offset': 0})
+    # None of the requested fields are read from the pose outputs.
+    monkeypatch.setattr(store, 'load_pose_shared', lambda video, fields, pose_source='vibe': dict())
+    txt_path = str(tmp_path / 'train.txt')
+    _write_windows(txt_path)
+    return txt_path
+
+
+@pytest.fixture
+def precomputed_dataset(txt_path):
+
+    def _dataset(windowing):
+        return data.MyMuscleDataset(txt_path, LOGGER, 'train', 1.0, WIDTH - 1, windowing=windowing,
+                                    precomputed=True, fields=['emg_bins', 'emg_values'])
+
+    return _dataset
+
+
+@pytest.mark.parametrize('windowing', ['index', 'sliding'])
+def test_precomputed_emg_bins_without_frame_store(precomputed_dataset, windowing):
+    dataset = precomputed_dataset(windowing)
+    assert dataset.frame_store is None
+
+    sample = dataset[0]
+    np.testing.assert_array_equal(sample['emg_bins'],
+                                  np.digitize(sample['emg_values'], dataset.bins))
+
+    batch = dataset.__getitems__(list(range(len(dataset))))
+    assert batch['emg_bins'].shape == batch['emg_values'].shape
+    np.testing.assert_array_equal(batch['emg_bins'],
+                                  np.digitize(batch['emg_values'], dataset.bins))
+
+
+def test_append_window_index_keeps_old_mappings(tmp_path):
+    txt_path = str(tmp_path / 'train.txt')
+    _write_windows(txt_path, num_windows=2)
+    (old_index, _) = windows.load_window_index(txt_path)
+    expected = np.array(old_index)
+    (index_fp, _) = windows._index_paths(txt_path)
+    old_inode = os.stat(index_fp).st_ino
+
+    _write_windows(txt_path)
+    (index, meta) = windows.append_window_index(txt_path)
+    assert len(index) == NUM_WINDOWS
+    np.testing.assert_array_equal(index[:2], expected)
+    # The file that workers may still map is replaced rather than truncated and rewritten.
+    assert os.stat(index_fp).st_ino != old_inode
+    np.testing.assert_array_equal(old_index, expected)
+
+
+def _build_frame_store(tmp_path, height=16, width=12):
+    frame_dir = tmp_path / 'frames' / VIDEO
+    frame_dir.mkdir(parents=True)
+    for frame in range(framesource.FIRST_FRAME, NUM_WINDOWS + WIDTH + framesource.FIRST_FRAME):
+        image = np.full((2 * height, 2 * width, 3), frame, dtype=np.uint8)
+        cv2.imwrite(str(frame_dir / (str(frame).zfill(6) + '.png')), image)
+    store_root = str(tmp_path / 'frame_store')
+    framestore.build_video(str(frame_dir), store_root, framesource.FrameReader('png', ''),
+                           height=height, width=width, chunk_frames=4, overlap=3)
+    return store_root
+
+
+def test_train_fields_load_rgb_clips(txt_path, tmp_path):
+    args = argparse.Namespace(precomputed=False, reweight_loss=False, frame_store='')
+    assert 'rgb' not in data.train_fields(args)
+    args.frame_store = _build_frame_store(tmp_path)
+    assert 'rgb' in data.train_fields(args)
+
+    step = WIDTH - 1
+    dataset = data.MyMuscleDataset(txt_path, LOGGER, 'train', 1.0, step, frame_store=args.frame_store,
+                                   fields=['rgb', 'frame_idx'])
+    batch = data._collate_batch(dataset.__getitems__(list(range(len(dataset)))))
+    assert batch['rgb'].shape == (NUM_WINDOWS, step, 16, 12, 3)
+    # Every frame of the synthetic videos is filled with its frame number.
+    np.testing.assert_array_equal(batch['rgb'][:, :, 0, 0, 0].numpy(), batch['frame_idx'].numpy())
+
+    clips = augs.BatchClipAugment(8)(augs.clips_to_tensor(batch['rgb']))
+    assert clips.shape == (NUM_WINDOWS, step, 3, 8, 8)
+
+
+def _write_validity(txt_path, invalid_row, mtime, poses=None):
+    (index, meta) = windows.load_window_index(txt_path)
+    mask = np.ones(index['frame'].shape, dtype=bool)
+    mask[invalid_row] = False
+    (mask_fp, report_fp) = windows.validity_paths(txt_path + '.idx')
+    np.save(mask_fp, mask)
+    with open(report_fp, 'w') as f:
+        json.dump({'source': meta['source'], 'poses': poses or store.pose_stamps([VIDEO])}, f)
+    os.utime(mask_fp, (mtime, mtime))
+
+
+def test_validity_follows_pose_outputs(txt_path):
+    _write_validity(txt_path, 0, 1000000000)
+    dataset = data.MyMuscleDataset(txt_path, LOGGER, 'train', 1.0, WIDTH - 1,
+                                   fields=['emg_values'])
+    assert 0 not in dataset.rows
+
+    # Validated against a pose output that has since been re-run.
+    _write_validity(txt_path, 0, 1000000000, poses={VIDEO: {'size': 1, 'mtime': 1.0}})
+    dataset = data.MyMuscleDataset(txt_path, LOGGER, 'train', 1.0, WIDTH - 1,
+                                   fields=['emg_values'])
+    assert dataset.rows is None
+
+
+def test_stratified_subset_follows_revalidation(txt_path):
+    # Same number of valid windows before and after re-validation, but different ones, so only the
+    # validity stamp tells the cached subsets apart.
+    for (invalid_row, mtime) in [(0, 1000000000), (1, 1000000100)]:
+        _write_validity(txt_path, invalid_row, mtime)
+        dataset = data.MyMuscleDataset(txt_path, LOGGER, 'train', 0.5, WIDTH - 1,
+                                       fields=['emg_values'])
+        assert dataset.subset is not None
+        assert invalid_row not in dataset.rows
+    assert len(glob.glob(txt_path + '.idx.subset_*.npy')) == 2
+
+
+@pytest.fixture
+def pose_dataset(txt_path, tmp_path, monkeypatch):
+    # VIBE-shaped outputs, with fewer vertices than the SMPL mesh.
+    num_frames = NUM_WINDOWS + WIDTH + 1
+    rng = np.random.default_rng(0)
+    person = {'joints3d': rng.standard_normal((num_frames, 49, 3), dtype=np.float32),
+              'joints2d_img_coord': rng.standard_normal((num_frames, 49, 2), dtype=np.float32),
+              'bboxes': rng.standard_normal((num_frames, 4), dtype=np.float32),
+              'pred_cam': rng.standard_normal((num_frames, 3), dtype=np.float32),
+              'orig_cam': rng.standard_normal((num_frames, 4), dtype=np.float32),
+              'verts': rng.standard_normal((num_frames, 10, 3), dtype=np.float32)}
+    monkeypatch.setattr(store, 'load_pose_shared', lambda video, fields, pose_source='vibe': {
+        field: person[field] for field in fields})
+    # visualize_video() always lists the EMG channels in the order of configs/videosets.yaml.
+    video_set = dict(data.load_video_set('all'), emg_channels=[0, 2, 4, 6, 1, 3, 5, 7])
+    monkeypatch.setattr(data, 'load_video_set', lambda name: video_set)
+    # visualize_video() creates its log directories relative to the working directory.
+    monkeypatch.chdir(tmp_path)
+    return data.MyMuscleDataset(txt_path, LOGGER, 'train', 1.0, WIDTH, fields=data.SAMPLE_FIELDS)
+
+
+def test_gather_window_matches_visualize_video(pose_dataset):
+    for index in range(len(pose_dataset)):
+        pose_dataset.vectorized = False
+        expected = pose_dataset[index]
+        pose_dataset.vectorized = True
+        sample = pose_dataset.gather_window(index)
+
+        assert sample.keys() == expected.keys()
+        for field in data.SAMPLE_FIELDS:
+            if field == 'frame_paths':
+                assert sample[field] == expected[field]
+            else:
+                np.testing.assert_allclose(sample[field], expected[field], rtol=1e-6,
+                                           err_msg=field)
+
+
+@pytest.mark.parametrize('weighted', [False, True])
+def test_sampler_resumes_mid_epoch(weighted):
+    data_source = range(50)
+    weights = np.linspace(0.1, 2.0, len(data_source))
+
+    def _sampler():
+        return data.ActivationSampler(data_source, weights, seed=3) if weighted \
+            else data.ResumableSampler(data_source, seed=3)
+
+    sampler = _sampler()
+    sampler.set_epoch(2)
+    full_epoch = list(sampler)
+    assert list(sampler) == full_epoch
+    if not weighted:
+        assert sorted(full_epoch) == list(data_source)
+
+    # Checkpoint after 17 consumed samples, then resume in a fresh sampler.
+    state = sampler.state_dict(17)
+    resumed = _sampler()
+    resumed.load_state_dict(state)
+    assert list(resumed) == full_epoch[17:]
+    # Only the resumed pass skips ahead.
+    assert list(resumed) == full_epoch
+
+    resumed.set_epoch(3)
+    assert list(resumed) != full_epoch
+
+    with pytest.raises(AssertionError):
+        data.ResumableSampler(range(49)).load_state_dict(state)
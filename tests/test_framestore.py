@@ -0,0 +1,46 @@
+import cv2
+import numpy as np
+import pytest
+
+import musclesinaction.dataloader.framesource as framesource
+import musclesinaction.dataloader.framestore as framestore
+
+
+CHUNK_FRAMES = 4
+OVERLAP = 3
+
+
+def _build(tmp_path, num_frames, height=8, width=6):
+    frame_dir = tmp_path / 'frames' / 'IMG_1234_30.MOV'
+    frame_dir.mkdir(parents=True)
+    for frame in range(framesource.FIRST_FRAME, num_frames + framesource.FIRST_FRAME):
+        # Every frame is filled with its own frame number.
+        image = np.full((2 * height, 2 * width, 3), frame, dtype=np.uint8)
+        cv2.imwrite(str(frame_dir / (str(frame).zfill(6) + '.png')), image)
+    store_root = str(tmp_path / 'frame_store')
+    meta = framestore.build_video(str(frame_dir), store_root, framesource.FrameReader('png', ''),
+                                  height=height, width=width, chunk_frames=CHUNK_FRAMES,
+                                  overlap=OVERLAP)
+    return (meta, framestore.FrameStore(store_root).video(str(frame_dir)))
+
+
+# Tails that fill a whole chunk, fit into the overlap of the previous chunk, or need a short chunk.
+@pytest.mark.parametrize('num_frames', [1, 3, 4, 7, 8, 10, 11, 12])
+def test_frame_store_tail_chunk(tmp_path, num_frames):
+    (meta, video) = _build(tmp_path, num_frames)
+    assert meta['num_frames'] == num_frames
+    first = framesource.FIRST_FRAME
+    last = first + num_frames
+
+    # Every clip of consecutive frames that fits into the overlap is a view into one chunk,
+    # including the ones that end on the last frame.
+    for length in range(1, OVERLAP + 2):
+        for start in range(first, last - length + 1):
+            clip = video.clip(np.arange(start, start + length))
+            assert clip.shape == (length, 8, 6, 3)
+            assert isinstance(clip.base, np.memmap) or isinstance(clip, np.memmap)
+            np.testing.assert_array_equal(clip[:, 0, 0, 0], np.arange(start, start + length))
+
+    # Longer or strided clips are gathered frame by frame.
+    frames = np.arange(first, last)[::-1]
+    np.testing.assert_array_equal(video.clip(frames)[:, 0, 0, 0], frames)
@@ -0,0 +1,31 @@
+import pytest
+import torch
+
+import musclesinaction.dataloader.prefetch as prefetch
+
+
+def _batches(num_batches=5):
+    return [{'emg_values': torch.full((2, 3), float(i), dtype=torch.float64),
+             'video_id': torch.tensor([i, i])} for i in range(num_batches)]
+
+
+def test_prefetcher_keeps_order_and_dtypes():
+    batches = list(prefetch.BatchPrefetcher(_batches(), 'cpu', num_batches=2))
+    assert [int(batch['video_id'][0]) for batch in batches] == list(range(5))
+    assert all(batch['emg_values'].dtype == torch.float32 for batch in batches)
+    assert all(batch['video_id'].dtype == torch.int64 for batch in batches)
+
+
+def test_prefetcher_applies_batch_transform():
+    transform = lambda batch: dict(batch, emg_values=batch['emg_values'] + 1.0)
+    batches = prefetch.BatchPrefetcher(_batches(), 'cpu', batch_transform=transform)
+    assert [float(batch['emg_values'][0, 0]) for batch in batches] == [1.0, 2.0, 3.0, 4.0, 5.0]
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason='needs a GPU')
+def test_prefetcher_hands_batches_to_the_current_stream():
+    loader = [{key: value.pin_memory() for (key, value) in batch.items()}
+              for batch in _batches(20)]
+    for (i, batch) in enumerate(prefetch.BatchPrefetcher(loader, 'cuda', num_batches=3)):
+        # Kernels on the default stream, while the next copies are queued on the side stream.
+        assert float((batch['emg_values'] * 2.0).sum()) == 12.0 * i
@@ -0,0 +1,95 @@
+import os
+
+import joblib
+import numpy as np
+import pytest
+
+import musclesinaction.dataloader.ingest as ingest
+import musclesinaction.dataloader.store as store
+
+
+VIDEO = 'IMG_1234_30.MOV'
+
+
+@pytest.fixture
+def vibe_root(tmp_path):
+    rng = np.random.default_rng(0)
+    num_frames = 6
+    person = {'joints3d': rng.standard_normal((num_frames, 49, 3)).astype(np.float32),
+              'joints2d_img_coord': rng.standard_normal((num_frames, 49, 2)).astype(np.float32),
+              'bboxes': rng.uniform(10, 100, (num_frames, 4)).astype(np.float32),
+              'pred_cam': rng.uniform(0.5, 1.5, (num_frames, 3)).astype(np.float32),
+              'orig_cam': rng.uniform(0.5, 1.5, (num_frames, 4)).astype(np.float32),
+              'verts': rng.standard_normal((num_frames, 6890, 3)).astype(np.float32)}
+    os.makedirs(tmp_path / 'output' / VIDEO)
+    joblib.dump({1: person}, store.vibe_output_path(VIDEO, str(tmp_path)))
+    store.clear_pose_registry()
+    yield str(tmp_path)
+    store.clear_pose_registry()
+
+
+def test_pose_registry_keeps_requested_fields(vibe_root):
+    arrays = store.load_pose_shared(VIDEO, ['joints3d'], vibe_root=vibe_root)
+    (registered,) = store._POSE_REGISTRY.values()
+    assert list(registered) == ['joints3d']
+    assert not arrays['joints3d'].flags.writeable
+
+    # Later requests only add their own fields and reuse the arrays read before.
+    again = store.load_pose_shared(VIDEO, ['joints3d', 'twodkpts_norm'], vibe_root=vibe_root)
+    assert again['joints3d'] is arrays['joints3d']
+    assert sorted(registered) == ['joints3d', 'twodkpts_norm']
+    assert again['twodkpts_norm'].shape == (6, 25, 2)
+
+
+def test_share_video_replaces_registered_arrays(vibe_root):
+    arrays = store.load_pose_shared(VIDEO, ['joints3d', 'bboxes'], vibe_root=vibe_root)
+    tensors = store.share_video(arrays)
+    (registered,) = store._POSE_REGISTRY.values()
+    for (field, tensor) in tensors.items():
+        assert tensor.is_shared()
+        np.testing.assert_array_equal(registered[field], arrays[field])
+        # The registry now holds a view of the shared copy instead of the original.
+        assert np.shares_memory(registered[field], tensor.numpy())
+
+    # Another dataset of the process gets the same shared tensors.
+    again = store.share_video(store.load_pose_shared(VIDEO, ['joints3d', 'bboxes'],
+                                                     vibe_root=vibe_root))
+    assert all(again[field] is tensors[field] for field in tensors)
+
+
+def test_built_store_is_not_stale(vibe_root, tmp_path):
+    store_root = str(tmp_path / 'store')
+    manifest = store.build_store([VIDEO], store_root, vibe_root)
+    stamp = store.source_stamp(VIDEO, vibe_root=vibe_root)
+    assert not ingest.is_stale(manifest['videos'][VIDEO], stamp, 'vibe')
+    assert ingest.ingest([VIDEO], store_root, vibe_root, num_procs=1) == []
+
+    os.utime(store.vibe_output_path(VIDEO, vibe_root), (0, 0))
+    stamp = store.source_stamp(VIDEO, vibe_root=vibe_root)
+    assert ingest.is_stale(manifest['videos'][VIDEO], stamp, 'vibe')
+
+
+@pytest.mark.parametrize('encoding', ['float16', 'int16'])
+def test_encode_array_round_trip(encoding):
+    rng = np.random.default_rng(0)
+    # Channels of very different ranges, as in bboxes (pixels) next to pred_cam (~1), plus a
+    # constant channel.
+    array = rng.standard_normal((100, 7, 4)).astype(np.float32) * \
+        np.array([1000.0, 1.0, 0.01, 0.0], dtype=np.float32)
+    array[..., 3] = 5.0
+    (data, quant) = store.encode_array(array, encoding)
+    decoded = store.decode_array(data, quant)
+    assert decoded.dtype == np.float32 and decoded.shape == array.shape
+
+    error = np.abs(decoded.astype(np.float64) - array)
+    eps32 = np.finfo(np.float32).eps
+    if encoding == 'float16':
+        assert quant is None
+        # Half a unit in the last place of float16 (11 significant bits), and of its subnormals.
+        bound = np.maximum(np.abs(array) * 2.0 ** -11, 2.0 ** -25)
+    else:
+        assert quant.shape == (2, 4)
+        # Half a quantization step per channel, plus float32 rounding of the decoding.
+        bound = 0.5 * quant[0] + 4 * eps32 * (np.abs(array) + np.abs(quant[1]))
+    assert np.all(error <= bound)
+    np.testing.assert_array_equal(decoded[..., 3], 5.0)
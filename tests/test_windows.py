@@ -0,0 +1,74 @@
+import numpy as np
+
+import musclesinaction.dataloader.windows as windows
+
+
+WIDTH = 5
+# Number of windows per video, each starting one frame after the previous one.
+NUM_WINDOWS = {'output/IMG_1234_30.MOV': 6, 'output/IMG_1240_30.MOV': 3}
+
+
+def _write_sliding_windows(txt_path):
+    # Overlapping windows with stride 1, like the generated window text files.
+    lines = []
+    for (v, (video, num_windows)) in enumerate(NUM_WINDOWS.items()):
+        for start in range(1, num_windows + 1):
+            fields = [video, video + '/vibe_output.pkl']
+            for frame in range(start, start + WIDTH):
+                emg = [str(100.0 * v + frame + 0.25 * channel)
+                       for channel in range(windows.NUM_EMG)]
+                record = [str(frame), str(frame), str(frame), f'{v}/{frame - 1}',
+                          f'{v}/{frame - 1}', f'{v}/{frame - 1}'] + emg
+                fields += record + ['0'] * (windows.STRIDE - len(record))
+            lines.append(','.join(fields))
+    with open(txt_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def _baseline_windows(txt_path):
+    # How the dataset used to read every window: split the line and walk its frame records.
+    with open(txt_path) as f:
+        lines = f.readlines()
+    result = []
+    for line in lines:
+        filepath = line.split(',')
+        frames = [int(filepath[2 + i * 17]) for i in range(WIDTH)]
+        pickle_frames = [int(filepath[5 + i * 17].split('/')[-1]) for i in range(WIDTH)]
+        emg = [[float(value) for value in filepath[8 + i * 17:8 + i * 17 + windows.NUM_EMG]]
+               for i in range(WIDTH)]
+        result.append((filepath[0], frames, pickle_frames, emg))
+    return result
+
+
+def test_compile_window_index_matches_baseline(tmp_path):
+    txt_path = str(tmp_path / 'train.txt')
+    _write_sliding_windows(txt_path)
+    (index, meta) = windows.compile_window_index(txt_path)
+    baseline = _baseline_windows(txt_path)
+
+    assert meta['width'] == WIDTH and len(index) == len(baseline)
+    assert meta['videos'] == list(NUM_WINDOWS)
+    for (row, (video, frames, pickle_frames, emg)) in zip(index, baseline):
+        assert meta['videos'][row['video']] == video
+        np.testing.assert_array_equal(row['frame'], frames)
+        np.testing.assert_array_equal(row['pickle_frame'], pickle_frames)
+        np.testing.assert_array_equal(row['emg'], np.array(emg, dtype=np.float32))
+
+
+def test_sliding_windows_match_baseline(tmp_path):
+    txt_path = str(tmp_path / 'train.txt')
+    _write_sliding_windows(txt_path)
+    (index, meta) = windows.load_window_index(txt_path)
+    timeline = windows.load_timeline(txt_path, index, meta)
+    sliding = windows.SlidingWindows(timeline, WIDTH)
+    baseline = _baseline_windows(txt_path)
+
+    # Windows never cross from one video into the next.
+    assert len(sliding) == len(baseline)
+    (videos, frames, pickle_frames, emg) = sliding.batch(np.arange(len(sliding)))
+    for (i, (video, *expected)) in enumerate(baseline):
+        assert meta['videos'][videos[i]] == video
+        for (actual, values) in zip([frames[i], pickle_frames[i], emg[i]], expected):
+            np.testing.assert_array_equal(actual, np.array(values, dtype=actual.dtype))
+        # Single windows are views of the same timeline rows.
+        np.testing.assert_array_equal(sliding[i][1], frames[i])
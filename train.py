@@ -3,6 +3,7 @@ Training + validation oversight and recipe configuration.
 '''
 
 # Internal imports.
+import copy
 import numpy as np
 import torch 
 import torchvision
@@ -18,8 +19,10 @@ import musclesinaction.models.basicconv as convmodel
 
 import musclesinaction.configs.args as args
 import musclesinaction.dataloader.data as data
+import musclesinaction.dataloader.prefetch as prefetch
 import musclesinaction.losses.loss as loss
 import musclesinaction.models.model as model
+import musclesinaction.utils.augs as augs
 import vis.logvis as logvis
 import musclesinaction.utils.utils as utils
 import pipeline as pipeline
@@ -29,8 +32,56 @@ def _get_learning_rate(optimizer):
         return param_group['lr']
 
 
+def _curriculum_step(args, epoch):
+    '''
+    :return (int): Window length to train on in this epoch. args.step_curriculum lists
+        start_epoch:step pairs, e.g. '0:10,20:20,40:30'; args.step if empty.
+    '''
+    step = int(args.step)
+    phases = [phase.split(':') for phase in str(args.step_curriculum).split(',') if phase.strip()]
+    for (start_epoch, phase_step) in sorted((int(a), int(b)) for (a, b) in phases):
+        if epoch >= start_epoch:
+            step = phase_step
+    # The positional encodings of the model only cover args.step frames.
+    return min(step, int(args.step))
+
+
+def _create_data_loaders(args, logger, step):
+    '''
+    :param step (int): Window length, which is shorter than args.step early in a curriculum.
+    '''
+    loader_args = copy.copy(args)
+    loader_args.step = step
+    return data.create_train_val_data_loaders(loader_args, logger, fields=data.train_fields(args))
+
+
+def _batch_augment(args):
+    '''
+    :return: Function that augments the uint8 rgb clips of a training batch in place of the
+        per-clip transforms of the dataset, or None if there are no clips to augment.
+    '''
+    if not args.frame_store or not args.batch_augment:
+        return None
+    augment = augs.BatchClipAugment(int(args.clip_size))
+
+    def _transform(batch):
+        if 'rgb' not in batch:
+            return batch
+        return dict(batch, rgb=augment(augs.clips_to_tensor(batch['rgb'])))
+
+    return _transform
+
+
 def _train_one_epoch(args, train_pipeline, phase, epoch, optimizer,
-                     lr_scheduler, train_data_loader, val_data_loader,device, logger):
+                     lr_scheduler, train_data_loader, val_data_loader,device, logger,
+                     start_step=0, checkpoint_fn=None):
+    '''
+    :param start_step (int): Batches of this epoch that were already trained on before resuming;
+        the sampler of the loader is expected to skip them.
+    :param checkpoint_fn: Called as checkpoint_fn(epoch, step, sampler) every
+        args.checkpoint_every_steps training steps.
+    :return (float): Mean total loss over the steps of this epoch.
+    '''
     #assert phase in ['train', 'val', 'val_aug', 'val_noaug']
 
     log_str = f'Epoch (1-based): {epoch + 1} / {args.num_epochs}'
@@ -51,17 +102,31 @@ def _train_one_epoch(args, train_pipeline, phase, epoch, optimizer,
         total_step_base = total_step_base + len(train_data_loader)
     start_time = time.time()
     num_exceptions = 0
+    epoch_losses = []
     if phase == 'train':
         data_loader = train_data_loader
     else:
         data_loader = val_data_loader
-        
-    for cur_step, data_retval in enumerate(tqdm.tqdm(data_loader)):
-
-        if cur_step == 0:
-            logger.info(f'Enter first data loader iteration took {time.time() - start_time:.3f}s')
-
+    batch_transform = _batch_augment(args) if phase == 'train' else None
+    if int(args.prefetch) > 0:
+        data_loader = prefetch.BatchPrefetcher(data_loader, device, int(args.prefetch),
+                                               batch_transform=batch_transform)
+        batch_transform = None
+
+    for cur_step, data_retval in enumerate(tqdm.tqdm(data_loader, initial=start_step),
+                                           start=start_step):
+
+        if cur_step == start_step:
+            # Includes worker startup, unless the workers persist across epochs.
+            first_batch_time = time.time() - start_time
+            logger.info(f'Enter first data loader iteration of {phase} epoch {epoch} took '
+                        f'{first_batch_time:.3f}s')
+            logger.report_scalar(phase + '/first_batch_time', first_batch_time, step=epoch)
         total_step = cur_step + total_step_base  # For continuity in wandb.
+        if int(args.prefetch) > 0:
+            logger.report_scalar(phase + '/data_wait', data_loader.last_wait, step=total_step)
+        if batch_transform is not None:
+            data_retval = batch_transform(data_retval)
 
         try:
 
@@ -70,6 +135,7 @@ def _train_one_epoch(args, train_pipeline, phase, epoch, optimizer,
             loss_retval = train_pipeline[1].process_entire_batch(
                 data_retval, model_retval, loss_retval, ignoremovie, cur_step, total_step)
             total_loss = loss_retval['total']
+            epoch_losses.append(total_loss.item())
 
         except Exception as e:
             num_exceptions += 1
@@ -91,32 +157,81 @@ def _train_one_epoch(args, train_pipeline, phase, epoch, optimizer,
 
             optimizer.step()
 
+            if checkpoint_fn is not None and int(args.checkpoint_every_steps) > 0 \
+                    and (cur_step + 1) % int(args.checkpoint_every_steps) == 0:
+                checkpoint_fn(epoch, cur_step + 1, train_data_loader.sampler)
+
         # DEBUG:
         if cur_step >= 256 and 'dbg' in args.name:
             logger.warning('Cutting epoch short for debugging...')
             break
 
+    if int(args.prefetch) > 0:
+        wait_stats = data_loader.wait_stats()
+        logger.info(f'Waited {wait_stats["total"]:.3f}s for data over {wait_stats["steps"]} steps '
+                    f'({wait_stats["mean"] * 1000.0:.1f}ms per step)')
+
     if phase == 'train':
         lr_scheduler.step()
 
+    return np.mean(epoch_losses) if len(epoch_losses) != 0 else float('nan')
+
 
 def _train_all_epochs(args, train_pipeline, optimizer, lr_scheduler, start_epoch, train_loader, train_loader_noshuffle,
-                      val_aug_loader, val_noaug_loader, device, logger, checkpoint_fn):
+                      val_aug_loader, val_noaug_loader, device, logger, checkpoint_fn, start_step=0,
+                      loader_step=None):
+    '''
+    :param loader_step (int): Window length of the given loaders. They are rebuilt whenever the
+        window length curriculum (args.step_curriculum) moves on.
+    '''
 
     logger.info('Start training loop...')
     start_time = time.time()
     list_of_val_vals = []
+    target_reached = False
     for epoch in range(start_epoch, args.num_epochs):
 
+        epoch_step = _curriculum_step(args, epoch)
+        if loader_step is not None and epoch_step != loader_step:
+            logger.info(f'Window length curriculum: step {loader_step} -> {epoch_step}')
+            (train_loader, train_loader_noshuffle, val_aug_loader, val_noaug_loader, _) = \
+                _create_data_loaders(args, logger, epoch_step)
+            loader_step = epoch_step
+        logger.report_scalar('train/step', epoch_step, step=epoch)
+
+        if isinstance(train_loader.dataset, data.MyMuscleStream):
+            # Reshuffle the shard order.
+            train_loader.dataset.set_epoch(epoch)
+        epoch_start_step = start_step if epoch == start_epoch else 0
+        if isinstance(train_loader.sampler, data.ResumableSampler):
+            train_loader.sampler.set_epoch(epoch)
+            train_loader.sampler.set_position(epoch_start_step * args.bs)
+        elif epoch_start_step != 0:
+            logger.warning('Train loader cannot skip batches, restarting the epoch')
+            epoch_start_step = 0
+
         # Training.
         _train_one_epoch(
             args, train_pipeline, 'train', epoch, optimizer,
-            lr_scheduler, train_loader, val_aug_loader, device, logger)
+            lr_scheduler, train_loader, val_aug_loader, device, logger,
+            start_step=epoch_start_step, checkpoint_fn=checkpoint_fn)
         
         _train_one_epoch(
             args, train_pipeline, 'eval', epoch, optimizer,
             lr_scheduler, train_loader_noshuffle, train_loader_noshuffle, device, logger)
 
+        if float(args.target_val_mse) > 0.0 and not target_reached:
+            # Wall-clock time to reach a target validation loss, to compare samplers.
+            val_mse = _train_one_epoch(
+                args, train_pipeline, 'val', epoch, optimizer,
+                lr_scheduler, train_loader, val_aug_loader, device, logger)
+            if val_mse <= float(args.target_val_mse):
+                target_reached = True
+                elapsed = time.time() - start_time
+                logger.info(f'Reached val MSE {val_mse:.5f} <= {float(args.target_val_mse):.5f} '
+                            f'after epoch {epoch + 1} in {elapsed:.1f}s ({args.sampler} sampler)')
+                logger.report_scalar('val/time_to_target', elapsed, step=epoch)
+
         # Save model weights.
         if epoch%1==0 and args.name != 'dbg':
             checkpoint_fn(epoch)
@@ -149,8 +264,9 @@ def main(args, logger):
     # Instantiate datasets.
     logger.info('Initializing data loaders...')
     start_time = time.time()
+    loader_step = _curriculum_step(args, 0)
     (train_loader, train_loader_noshuffle, val_aug_loader, val_noaug_loader, dset_args) = \
-        data.create_train_val_data_loaders(args, logger)
+        _create_data_loaders(args, logger, loader_step)
     logger.info(f'Took {time.time() - start_time:.3f}s')
 
     logger.info('Initializing model...')
@@ -205,28 +321,54 @@ def main(args, logger):
         optimizer.load_state_dict(checkpoint['optimizer'])
         lr_scheduler.load_state_dict(checkpoint['lr_scheduler'])
         start_epoch = checkpoint['epoch'] + 1
+        # Mid-epoch checkpoints continue from the exact batch.
+        start_step = checkpoint.get('resume_step', 0)
+        if _curriculum_step(args, start_epoch) != loader_step:
+            loader_step = _curriculum_step(args, start_epoch)
+            (train_loader, train_loader_noshuffle, val_aug_loader, val_noaug_loader, dset_args) = \
+                _create_data_loaders(args, logger, loader_step)
+        if 'sampler' in checkpoint and isinstance(train_loader.sampler, data.ResumableSampler):
+            train_loader.sampler.load_state_dict(checkpoint['sampler'])
+        if 'rng_states' in checkpoint:
+            utils.set_rng_states(checkpoint['rng_states'])
+        if start_step != 0:
+            logger.info(f'Resuming epoch {start_epoch} at step {start_step}')
     else:
         start_epoch = 0
+        start_step = 0
 
     logger.info(f'Took {time.time() - start_time:.3f}s')
 
     # Define logic for how to store checkpoints.
-    def save_model_checkpoint(epoch):
+    def save_model_checkpoint(epoch, step=None, sampler=None):
+        '''
+        :param step (int): Set for mid-epoch checkpoints: number of batches of epoch done so far.
+            These only overwrite checkpoint.pth.
+        :param sampler: Sampler of the current train loader, for mid-epoch checkpoints.
+        '''
         if args.checkpoint_path:
             logger.info(f'Saving model checkpoint to {args.checkpoint_path}...')
             checkpoint = {
                 'optimizer': optimizer.state_dict(),
                 'lr_scheduler': lr_scheduler.state_dict(),
-                'epoch': epoch,
+                'epoch': epoch if step is None else epoch - 1,  # Last completed epoch.
                 'train_args': args,
                 'dset_args': dset_args,
                 'model_args': model_args,
+                'rng_states': utils.get_rng_states(),
             }
+            if step is not None:
+                checkpoint['resume_step'] = step
+                if isinstance(sampler, data.ResumableSampler):
+                    checkpoint['sampler'] = sampler.state_dict(step * args.bs)
             checkpoint['my_model'] = networks_nodp[0].state_dict()
-            torch.save(checkpoint,
-                       os.path.join(args.checkpoint_path, 'model_{}.pth'.format(epoch)))
-            torch.save(checkpoint,
-                       os.path.join(args.checkpoint_path, 'checkpoint.pth'))
+            if step is None:
+                torch.save(checkpoint,
+                           os.path.join(args.checkpoint_path, 'model_{}.pth'.format(epoch)))
+            # Write to a temporary file first such that preemption never leaves a partial file.
+            checkpoint_fp = os.path.join(args.checkpoint_path, 'checkpoint.pth')
+            torch.save(checkpoint, checkpoint_fp + '.tmp')
+            os.replace(checkpoint_fp + '.tmp', checkpoint_fp)
             logger.info()
 
     if 1:
@@ -241,7 +383,8 @@ def main(args, logger):
     # Start training loop.
     _train_all_epochs(
         args, (train_pipeline, train_pipeline_nodp), optimizer, lr_scheduler, start_epoch,
-        train_loader, train_loader_noshuffle, val_aug_loader, val_noaug_loader, device, logger, save_model_checkpoint)
+        train_loader, train_loader_noshuffle, val_aug_loader, val_noaug_loader, device, logger, save_model_checkpoint,
+        start_step=start_step, loader_step=loader_step)
 
 
 if __name__ == '__main__':
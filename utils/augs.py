@@ -2,7 +2,10 @@
 Data augmentation logic.
 '''
 
+import math
+
 import torch
+import torch.nn.functional as F
 # Library imports.
 from torchvision import transforms
 
@@ -31,17 +34,21 @@ class Lighting(object):
         self.alphastd = alphastd
         self.eigval = eigval
         self.eigvec = eigvec
+        # eigvec scaled by eigval, converted to the dtype / device of the images on first use.
+        self.basis = eigvec * eigval.view(1, 3)
 
     def __call__(self, img):
+        '''
+        :param img (..., 3, H, W) tensor.
+        '''
         if self.alphastd == 0:
             return img
 
-        alpha = img.new().resize_(3).normal_(0, self.alphastd)
-        rgb = self.eigvec.type_as(img).clone()\
-            .mul(alpha.view(1, 3).expand(3, 3))\
-            .mul(self.eigval.view(1, 3).expand(3, 3))\
-            .sum(1).squeeze()
-        return img.add(rgb.view(3, 1, 1).expand_as(img))
+        if self.basis.dtype != img.dtype or self.basis.device != img.device:
+            self.basis = self.basis.to(img.device, img.dtype)
+        alpha = torch.randn(3, dtype=img.dtype, device=img.device) * self.alphastd
+        rgb = self.basis @ alpha
+        return img + rgb.view(3, 1, 1)
 
 
 def get_train_transform(size):
@@ -64,3 +71,144 @@ def get_test_transform(size):
         # normalize,
     ])
     return my_transform
+
+
+class ClipToTensor(object):
+    '''
+    Turns a (T, H, W, 3) uint8 clip into a (T, 3, H, W) float tensor in [0, 1], i.e. ToTensor()
+    for every frame at once.
+    '''
+
+    def __call__(self, clip):
+        return torch.as_tensor(clip).permute(0, 3, 1, 2).float().div_(255.0)
+
+
+def get_clip_train_transform(size):
+    # Same as get_train_transform(), with one set of random parameters per clip, such that the
+    # frames of a clip stay consistent.
+    my_transform = transforms.Compose([
+        ClipToTensor(),
+        transforms.RandomResizedCrop(size),
+        transforms.RandomHorizontalFlip(),
+        transforms.ColorJitter(.4, .4, .4),
+        Lighting(0.1, __imagenet_pca['eigval'], __imagenet_pca['eigvec']),
+        # normalize,
+    ])
+    return my_transform
+
+
+def get_clip_test_transform(size):
+    my_transform = transforms.Compose([
+        ClipToTensor(),
+        transforms.Resize(int(size * 1.14)),
+        transforms.CenterCrop(size),
+        # normalize,
+    ])
+    return my_transform
+
+
+# Luma weights of torchvision's rgb_to_grayscale().
+GRAY_WEIGHTS = (0.2989, 0.587, 0.114)
+
+
+def _imagenet_lighting(alphastd):
+    # Module level, since the name would be mangled inside a class body.
+    return Lighting(alphastd, __imagenet_pca['eigval'], __imagenet_pca['eigvec'])
+
+
+def clips_to_tensor(clips):
+    '''
+    :param clips (B, T, H, W, 3) uint8 tensor, e.g. the rgb field of a batch.
+    :return (B, T, 3, H, W) float tensor in [0, 1].
+    '''
+    return clips.permute(0, 1, 4, 2, 3).float().div_(255.0)
+
+
+class BatchClipAugment(object):
+    '''
+    Batched equivalent of get_clip_train_transform(): random resized crop, horizontal flip,
+    color jitter and PCA lighting noise with separate random parameters for every clip of a
+    (B, T, 3, H, W) tensor (the same for all frames of a clip), in a few vectorized ops on
+    whatever device the batch is on.
+    NOTE: Unlike torchvision, crops are resampled bilinearly without antialiasing, and the jitter
+    operations always run in the order brightness, contrast, saturation.
+    '''
+
+    def __init__(self, size, scale=(0.08, 1.0), ratio=(3.0 / 4.0, 4.0 / 3.0), flip_p=0.5,
+                 brightness=0.4, contrast=0.4, saturation=0.4, alphastd=0.1):
+        self.size = size if isinstance(size, (tuple, list)) else (size, size)
+        self.scale = scale
+        self.ratio = ratio
+        self.flip_p = flip_p
+        self.jitter = (brightness, contrast, saturation)
+        self.lighting = _imagenet_lighting(alphastd)
+
+    def _crop_theta(self, batch_size, height, width, device):
+        '''
+        :return (B, 2, 3) tensor: Affine maps from output to input coordinates (in [-1, 1]) of one
+            random resized crop (and flip) per clip.
+        '''
+        area = torch.empty(batch_size, device=device).uniform_(*self.scale)
+        log_ratio = torch.empty(batch_size, device=device).uniform_(
+            math.log(self.ratio[0]), math.log(self.ratio[1]))
+        aspect = torch.exp(log_ratio)
+        # Crop size as a fraction of the image; torchvision retries instead of clamping.
+        crop_w = torch.sqrt(area * aspect * height / width).clamp(max=1.0)
+        crop_h = torch.sqrt(area / aspect * width / height).clamp(max=1.0)
+        center_x = (torch.rand(batch_size, device=device) * 2.0 - 1.0) * (1.0 - crop_w)
+        center_y = (torch.rand(batch_size, device=device) * 2.0 - 1.0) * (1.0 - crop_h)
+        flip = torch.where(torch.rand(batch_size, device=device) < self.flip_p, -1.0, 1.0)
+
+        theta = torch.zeros(batch_size, 2, 3, device=device)
+        theta[:, 0, 0] = crop_w * flip
+        theta[:, 0, 2] = center_x
+        theta[:, 1, 1] = crop_h
+        theta[:, 1, 2] = center_y
+        return theta
+
+    def _factors(self, amount, batch_size, device):
+        # Per clip factor in [1 - amount, 1 + amount], broadcastable to (B, T, C, H, W).
+        return torch.empty(batch_size, 1, 1, 1, 1, device=device).uniform_(
+            max(0.0, 1.0 - amount), 1.0 + amount)
+
+    def __call__(self, clips):
+        '''
+        :param clips (B, T, 3, H, W) float tensor in [0, 1].
+        :return (B, T, 3, size, size) tensor.
+        '''
+        (B, T, C, H, W) = clips.shape
+        device = clips.device
+
+        # One grid per clip, shared by its T * C channels.
+        theta = self._crop_theta(B, H, W, device)
+        grid = F.affine_grid(theta, (B, T * C) + tuple(self.size), align_corners=False)
+        clips = F.grid_sample(clips.reshape(B, T * C, H, W), grid.to(clips.dtype),
+                              mode='bilinear', padding_mode='border', align_corners=False)
+        clips = clips.reshape((B, T, C) + tuple(self.size))
+
+        # The resampled clips are a new tensor, so the color operations below work in place rather
+        # than allocating a full size temporary per operation.
+        (brightness, contrast, saturation) = self.jitter
+        if brightness > 0:
+            clips.mul_(self._factors(brightness, B, device)).clamp_(0.0, 1.0)
+        if contrast > 0:
+            # The mean of the grayscale image, from the (B, T, 3) channel means.
+            mean = clips.mean(dim=(-2, -1)) @ clips.new_tensor(GRAY_WEIGHTS)
+            factor = self._factors(contrast, B, device)
+            clips.mul_(factor).add_(mean.view(B, T, 1, 1, 1) * (1.0 - factor)).clamp_(0.0, 1.0)
+        if saturation > 0:
+            gray = clips[:, :, 0] * GRAY_WEIGHTS[0]
+            gray.add_(clips[:, :, 1], alpha=GRAY_WEIGHTS[1]).add_(clips[:, :, 2],
+                                                                   alpha=GRAY_WEIGHTS[2])
+            factor = self._factors(saturation, B, device)
+            gray.mul_(1.0 - factor.view(B, 1, 1, 1))
+            clips.mul_(factor).add_(gray.unsqueeze(2)).clamp_(0.0, 1.0)
+
+        if self.lighting.alphastd != 0:
+            lighting = self.lighting
+            if lighting.basis.dtype != clips.dtype or lighting.basis.device != device:
+                lighting.basis = lighting.basis.to(device, clips.dtype)
+            alpha = torch.randn(B, 3, dtype=clips.dtype, device=device) * lighting.alphastd
+            rgb = alpha @ lighting.basis.T
+            clips.add_(rgb.view(B, 1, 3, 1, 1))
+        return clips
@@ -0,0 +1,90 @@
+'''
+Projection of VIBE 3D joints into normalized 2D image keypoints, i.e. the input of my_model.
+Shared by MyTrainPipeline and the offline precompute stage in dataloader/store.py, such that
+precomputed keypoints are exactly the ones computed on the fly.
+'''
+
+import torch
+
+
+PROJ = 5000.0
+IMG_W = 1080
+IMG_H = 1920
+
+
+def perspective_projection(points, rotation, translation,
+                           focal_length, camera_center):
+
+    batch_size = points.shape[0]
+    K = torch.zeros([batch_size, 3, 3], device=points.device)
+    K[:,0,0] = focal_length
+    K[:,1,1] = focal_length
+    K[:,2,2] = 1.
+    K[:,:-1, -1] = camera_center
+
+    # Transform points
+    points = torch.einsum('bij,bkj->bki', rotation, points)
+    points = points + translation.unsqueeze(1)
+
+    # Apply perspective distortion
+    projected_points = points / points[:,:,-1].unsqueeze(-1)
+
+    # Apply camera intrinsics
+    projected_points = torch.einsum('bij,bkj->bki', K, projected_points)
+
+    return projected_points[:, :, :-1], points
+
+
+def convert_pare_to_full_img_cam(
+        pare_cam, bbox_height, bbox_center,
+        img_w, img_h, focal_length, crop_res=224):
+    # Converts weak perspective camera estimated by PARE in
+    # bbox coords to perspective camera in full image coordinates
+    # from https://arxiv.org/pdf/2009.06549.pdf
+    s, tx, ty = pare_cam[:, 0], pare_cam[:, 1], pare_cam[:, 2]
+    res = 224
+    r = bbox_height / res
+    tz = 2 * focal_length / (r * res * s)
+
+    cx = 2 * (bbox_center[:, 0] - (img_w / 2.)) / (s * bbox_height)
+    cy = 2 * (bbox_center[:, 1] - (img_h / 2.)) / (s * bbox_height)
+
+    cam_t = torch.stack([tx + cx, ty + cy, tz], dim=-1)
+
+    return cam_t
+
+
+def normalized_keypoints(threedskeleton, bboxes, predcam):
+    '''
+    Projects 3D joints into the full image with the VIBE camera and divides by the image size.
+    :param threedskeleton (B, T, 25, 3) tensor.
+    :param bboxes (B, T, 4) tensor.
+    :param predcam (B, T, 3) tensor.
+    :return (B, T, 25, 2) tensor.
+    '''
+    device = threedskeleton.device
+    height = bboxes[:,:,2:3].reshape(bboxes.shape[0]*bboxes.shape[1])
+    center = bboxes[:,:,:2].reshape(bboxes.shape[0]*bboxes.shape[1],-1)
+    focal = torch.tensor([[PROJ]]).to(device).repeat(height.shape[0],1)
+    predcamelong = predcam.reshape(predcam.shape[0]*predcam.shape[1],-1)
+    translation = convert_pare_to_full_img_cam(predcamelong,height,center,IMG_W,IMG_H,focal[:,0])
+    reshapethreed = threedskeleton.reshape(threedskeleton.shape[0]*threedskeleton.shape[1],threedskeleton.shape[2],threedskeleton.shape[3])
+    rotation = torch.unsqueeze(torch.eye(3),dim=0).repeat(reshapethreed.shape[0],1,1).to(device)
+    imgdimgs = torch.unsqueeze(torch.tensor([IMG_W/2, IMG_H/2]),dim=0).repeat(reshapethreed.shape[0],1).to(device)
+    twodkpts, _ = perspective_projection(reshapethreed, rotation, translation.float(),focal[:,0], imgdimgs)
+    twodkpts = twodkpts.reshape(threedskeleton.shape[0],threedskeleton.shape[1],twodkpts.shape[1],twodkpts.shape[2])
+    divide = torch.tensor([float(IMG_W), float(IMG_H)]).to(device)
+    return twodkpts/divide
+
+
+def batch_keypoints(data_retval, precomputed):
+    '''
+    :param data_retval (dict): Data loader elements.
+    :param precomputed (bool): Use the twodkpts field precomputed by dataloader/store.py instead of
+        projecting 3dskeleton.
+    :return (B, T, 25, 2) tensor: Normalized 2D keypoints of the batch.
+    '''
+    if precomputed:
+        return data_retval['twodkpts']
+    return normalized_keypoints(data_retval['3dskeleton'], data_retval['bboxes'],
+                                data_retval['predcam'])
@@ -6,6 +6,10 @@ import pickle
 import pathlib
 import os
 import copy
+import random
+
+import numpy as np
+import torch
 
 
 def cached_listdir(dir_path, allow_exts=[], recursive=False):
@@ -55,3 +59,22 @@ def cached_listdir(dir_path, allow_exts=[], recursive=False):
             pickle.dump(result, f)
     
     return result
+
+
+def get_rng_states():
+    '''
+    :return (dict): States of all random number generators, for checkpoints.
+    '''
+    states = {'python': random.getstate(), 'numpy': np.random.get_state(),
+              'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        states['cuda'] = torch.cuda.get_rng_state_all()
+    return states
+
+
+def set_rng_states(states):
+    random.setstate(states['python'])
+    np.random.set_state(states['numpy'])
+    torch.set_rng_state(states['torch'])
+    if 'cuda' in states and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(states['cuda'])
@@ -2,6 +2,7 @@
 Logging and visualization logic.
 '''
 
+import musclesinaction.dataloader.framesource as framesource
 import musclesinaction.vis.logvisgen as logvisgen
 from musclesinaction.vis.renderer import Renderer
 
@@ -31,6 +32,8 @@ class MyLogger(logvisgen.Logger):
         self.classif = args.classif
         self.args = args
         self.renderer = Renderer(resolution=(1080, 1920), orig_img=True, wireframe=False)
+        # Reads the frames behind frame_paths, optionally straight from the source videos.
+        self.frame_reader = framesource.FrameReader(args.frame_source, args.video_root)
         super().__init__(args.log_path, context, args.name)
 
     def perspective_projection(self, points, rotation, translation,
@@ -201,7 +204,7 @@ class MyLogger(logvisgen.Logger):
             os.makedirs(current_path + '/frames', 0o777)
         for i in range(len(frames)):
             #pdb.set_trace()
-            img=cv2.imread(frames[i])
+            img=self.frame_reader.read(frames[i])
             img = (img*1.0).astype('int')
 
             
@@ -362,7 +365,7 @@ class MyLogger(logvisgen.Logger):
 
         for i in range(len(frames)):
             cur_skeleton = twodskeleton[i].cpu().numpy()
-            img=cv2.imread(frames[i])
+            img=self.frame_reader.read(frames[i])
             img = (img*1.0).astype('int')
             if int(cur_skeleton[0][1]) - 100 > 0 and int(cur_skeleton[0][1]) + 100 < img.shape[0] and int(cur_skeleton[0][0]) - 100 > 0 and int(cur_skeleton[0][0]) + 100 <img.shape[1]:
                 blurimg = img[int(cur_skeleton[0][1]) - 100:int(cur_skeleton[0][1]) + 100, int(cur_skeleton[0][0]) - 100:int(cur_skeleton[0][0]) + 100]
@@ -18,6 +18,7 @@ import musclesinaction.models.basicconv as convmodel
 
 import musclesinaction.configs.args as args
 import musclesinaction.dataloader.data as data
+import musclesinaction.dataloader.prefetch as prefetch
 import musclesinaction.losses.loss as loss
 import musclesinaction.models.model as model
 import vis.logvis as logvis
@@ -55,6 +56,9 @@ def _inference_one_epoch(args, train_pipeline, phase, epoch, optimizer,
         data_loader = train_data_loader
     else:
         data_loader = val_data_loader
+    if int(args.prefetch) > 0:
+        # Visualization reads the batches on the host, so only overlap loading and collation.
+        data_loader = prefetch.BatchPrefetcher(data_loader, 'cpu', int(args.prefetch))
         
     for cur_step, data_retval in enumerate(tqdm.tqdm(data_loader)):
 
@@ -84,6 +88,11 @@ def _inference_one_epoch(args, train_pipeline, phase, epoch, optimizer,
             logger.handle_val_step(epoch, phase, cur_step, total_step, steps_per_epoch,data_retval, model_retval, loss_retval)
 
 
+    if int(args.prefetch) > 0:
+        wait_stats = data_loader.wait_stats()
+        logger.info(f'Waited {wait_stats["total"]:.3f}s for data over {wait_stats["steps"]} steps '
+                    f'({wait_stats["mean"] * 1000.0:.1f}ms per step)')
+
     if phase == 'train':
         lr_scheduler.step()
 